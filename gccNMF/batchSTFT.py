@@ -0,0 +1,97 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2016 Sean UN Wood
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: Sean UN Wood
+'''
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from scipy.fft import rfft, irfft
+
+MAX_STFT_BLOCK_SIZE = 2**22
+
+def getWindow(windowFunction, windowSize, fftSize):
+    window = np.asarray( windowFunction(windowSize) if callable(windowFunction) else windowFunction, np.float32 )
+    if window.size != windowSize:
+        raise ValueError('batchSTFT: window length %d does not match windowSize %d' % (window.size, windowSize))
+    # centre the window within the FFT frame, as in librosaSTFT.pad_center
+    paddedWindow = np.zeros(fftSize, np.float32)
+    paddingSize = (fftSize - windowSize) // 2
+    paddedWindow[paddingSize:paddingSize + windowSize] = window
+    return paddedWindow
+
+def getFrames(signals, frameSize, hopSize):
+    # read-only (..., numFrames, frameSize) view of signals (..., numSamples), without copying
+    signals = np.ascontiguousarray(signals)
+    numFrames = 1 + (signals.shape[-1] - frameSize) // hopSize
+    if numFrames < 1:
+        raise ValueError('batchSTFT: signal length %d is shorter than the frame size %d' % (signals.shape[-1], frameSize))
+    shape = signals.shape[:-1] + (numFrames, frameSize)
+    strides = signals.strides[:-1] + (signals.strides[-1] * hopSize, signals.strides[-1])
+    return as_strided(signals, shape=shape, strides=strides, writeable=False)
+
+def batchSTFT(signals, windowSize, hopSize, windowFunction=np.hanning, fftSize=None, dtype=np.complex64):
+    '''STFT of signals (..., numSamples) with left-aligned frames, returning (..., fftSize // 2 + 1, numFrames).
+    Matches librosaSTFT.stft(..., center=False), including its conjugated phase convention.'''
+    fftSize = windowSize if fftSize is None else fftSize
+    window = getWindow(windowFunction, windowSize, fftSize)
+    frames = getFrames(signals, fftSize, hopSize)
+    numFrames = frames.shape[-2]
+    
+    spectrograms = np.empty( frames.shape[:-2] + (fftSize // 2 + 1, numFrames), dtype )
+    numFramesPerBlock = max( 1, MAX_STFT_BLOCK_SIZE // (fftSize * max(1, int(np.prod(frames.shape[:-2])))) )
+    for startIndex in range(0, numFrames, numFramesPerBlock):
+        endIndex = min(startIndex + numFramesPerBlock, numFrames)
+        blockSpectrogram = rfft(frames[..., startIndex:endIndex, :] * window, axis=-1)
+        np.conjugate( np.swapaxes(blockSpectrogram, -1, -2), out=spectrograms[..., startIndex:endIndex] )
+    return spectrograms
+
+def overlapAdd(frames, hopSize):
+    '''Overlap-add frames (..., numFrames, frameSize) with the given hop, returning (..., frameSize + hopSize * (numFrames - 1)).'''
+    numFrames, frameSize = frames.shape[-2:]
+    leadingShape = frames.shape[:-2]
+    numSamples = frameSize + hopSize * (numFrames - 1)
+    
+    if frameSize % hopSize == 0:
+        # each frame spans overlapFactor hop-sized segments, so overlapFactor vectorised additions cover every frame
+        overlapFactor = frameSize // hopSize
+        signals = np.zeros( leadingShape + (numFrames + overlapFactor - 1, hopSize), frames.dtype )
+        frameSegments = frames.reshape( leadingShape + (numFrames, overlapFactor, hopSize) )
+        for segmentIndex in range(overlapFactor):
+            signals[..., segmentIndex:segmentIndex + numFrames, :] += frameSegments[..., segmentIndex, :]
+        return signals.reshape( leadingShape + (numSamples,) )
+    
+    signals = np.zeros( (int(np.prod(leadingShape)), numSamples), frames.dtype )
+    sampleIndexes = ( np.arange(numFrames)[:, np.newaxis] * hopSize + np.arange(frameSize) ).ravel()
+    for signal, signalFrames in zip(signals, frames.reshape( (-1, numFrames * frameSize) )):
+        np.add.at(signal, sampleIndexes, signalFrames)
+    return signals.reshape( leadingShape + (numSamples,) )
+
+def batchISTFT(spectrograms, windowSize, hopSize, windowFunction=np.hanning, dtype=np.float32):
+    '''Inverse of batchSTFT for spectrograms (..., numFrequencies, numFrames), returning (..., numSamples).
+    Matches librosaSTFT.istft(..., center=False) applied to each leading index.'''
+    fftSize = 2 * (spectrograms.shape[-2] - 1)
+    window = getWindow(windowFunction, windowSize, fftSize)
+    frames = irfft( np.conjugate( np.swapaxes(spectrograms, -1, -2) ), n=fftSize, axis=-1 ).astype(dtype, copy=False)
+    frames *= window
+    return overlapAdd(frames, hopSize)
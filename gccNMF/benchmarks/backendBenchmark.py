@@ -0,0 +1,133 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2016 Sean UN Wood
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: Sean UN Wood
+'''
+
+import logging
+import argparse
+from time import time
+import numpy as np
+
+from gccNMF.defs import TARGET_MODE_WINDOW_FUNCTION
+from gccNMF.gccNMFBackends import BACKENDS, getBackend, getExpJOmegaTauTable, getFFTGCCTable
+
+def getKernelInputs(numFrequencies, numTime, numTDOAs, dictionarySize, sampleRate=16000, maxTDOA=1e-3, seedValue=0):
+    randomState = np.random.RandomState(seedValue)
+    complexMixtureSpectrogram = ( randomState.randn(2, numFrequencies, numTime) + 1j * randomState.randn(2, numFrequencies, numTime) ).astype(np.complex64)
+    frequenciesInHz = np.linspace(0, sampleRate / 2.0, numFrequencies)
+    tdoasInSeconds = np.linspace(-maxTDOA, maxTDOA, numTDOAs)
+    expJOmegaTau = np.exp( np.outer(frequenciesInHz, -(2j * np.pi) * tdoasInSeconds) ).astype(np.complex64)
+    fftGCCTable = getFFTGCCTable(frequenciesInHz, tdoasInSeconds, dtype=np.float32)
+    W = randomState.rand(numFrequencies, dictionarySize).astype(np.float32)
+    return complexMixtureSpectrogram, expJOmegaTau, fftGCCTable, W
+
+def getKernelOutputs(backend, complexMixtureSpectrogram, expJOmegaTau, fftGCCTable, W):
+    numTDOAs = expJOmegaTau.shape[1]
+    
+    outputs = {}
+    kernelTimes = {}
+    
+    startTime = time()
+    outputs['coherence'] = backend.getSpectralCoherence(complexMixtureSpectrogram)
+    kernelTimes['coherence'] = time() - startTime
+    
+    startTime = time()
+    outputs['gccPHAT'] = backend.getGCCPHAT(outputs['coherence'], expJOmegaTau)
+    kernelTimes['gccPHAT'] = time() - startTime
+    
+    startTime = time()
+    outputs['gccNMF'] = backend.getGCCNMF(outputs['gccPHAT'], W)
+    kernelTimes['gccNMF'] = time() - startTime
+    
+    expJOmegaTauTable = getExpJOmegaTauTable(expJOmegaTau)
+    startTime = time()
+    outputs['gccNMFFused'] = backend.getGCCNMFFused(outputs['coherence'], expJOmegaTauTable, W)
+    kernelTimes['gccNMFFused'] = time() - startTime
+    
+    startTime = time()
+    outputs['angularSpectrogram'] = backend.getAngularSpectrogram(outputs['coherence'], expJOmegaTauTable)
+    kernelTimes['angularSpectrogram'] = time() - startTime
+    
+    startTime = time()
+    outputs['gccNMFFFT'] = backend.getGCCNMFFFT(outputs['coherence'], fftGCCTable, W)
+    kernelTimes['gccNMFFFT'] = time() - startTime
+    
+    startTime = time()
+    outputs['angularSpectrogramFFT'] = backend.getAngularSpectrogramFFT(outputs['coherence'], fftGCCTable)
+    kernelTimes['angularSpectrogramFFT'] = time() - startTime
+    
+    startTime = time()
+    outputs['mask'] = backend.getTDOAWindowMask(outputs['gccNMF'], TARGET_MODE_WINDOW_FUNCTION, numTDOAs / 2.0, numTDOAs / 10.0, 2.0, 0.0)
+    kernelTimes['mask'] = time() - startTime
+    
+    startTime = time()
+    outputs['reconstruction'] = backend.getReconstruction(W, outputs['mask'])
+    kernelTimes['reconstruction'] = time() - startTime
+    
+    return outputs, kernelTimes
+
+def runBenchmark(backendNames, numFrequencies, numTime, numTDOAs, dictionarySize, numRepetitions):
+    kernelInputs = getKernelInputs(numFrequencies, numTime, numTDOAs, dictionarySize)
+    referenceOutputs, _ = getKernelOutputs(getBackend('numpy'), *kernelInputs)
+    
+    results = {}
+    for backendName in backendNames:
+        try:
+            backend = getBackend(backendName)
+        except ImportError as e:
+            logging.info('BackendBenchmark: skipping %s backend (%s)' % (backendName, str(e)))
+            continue
+        
+        getKernelOutputs(backend, *kernelInputs) # warmup (JIT compilation)
+        
+        kernelTimes = []
+        for _ in range(numRepetitions):
+            outputs, currentKernelTimes = getKernelOutputs(backend, *kernelInputs)
+            kernelTimes.append(currentKernelTimes)
+        
+        results[backendName] = {}
+        logging.info('%s backend:' % backendName)
+        for kernelName, referenceOutput in referenceOutputs.items():
+            medianTime = np.median( [currentKernelTimes[kernelName] for currentKernelTimes in kernelTimes] )
+            maxAbsDifference = np.max( np.abs(outputs[kernelName] - referenceOutput) )
+            results[backendName][kernelName] = {'medianTime': medianTime, 'maxAbsDifference': maxAbsDifference}
+            logging.info( '    %s: %.3f ms (max abs difference vs numpy: %g)' % (kernelName, medianTime * 1000, maxAbsDifference) )
+        logging.info( '    fused vs unfused GCC-NMF max abs difference: %g' % np.max( np.abs(outputs['gccNMFFused'] - outputs['gccNMF']) ) )
+    return results
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description='GCC-NMF compute backend benchmark')
+    parser.add_argument('--backends', help='backends to benchmark', nargs='+', default=list(BACKENDS.keys()))
+    parser.add_argument('--num-frequencies', help='number of frequency bins', type=int, default=513)
+    parser.add_argument('--num-time', help='number of STFT frames', type=int, default=64)
+    parser.add_argument('--num-tdoas', help='number of TDOAs', type=int, default=128)
+    parser.add_argument('--dictionary-size', help='NMF dictionary size', type=int, default=256)
+    parser.add_argument('--num-repetitions', help='number of timed repetitions', type=int, default=20)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    
+    args = parseArguments()
+    runBenchmark(args.backends, args.num_frequencies, args.num_time, args.num_tdoas, args.dictionary_size, args.num_repetitions)
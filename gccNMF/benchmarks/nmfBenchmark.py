@@ -0,0 +1,68 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2016 Sean UN Wood
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: Sean UN Wood
+'''
+
+import logging
+import argparse
+import numpy as np
+
+from gccNMF.gccNMFFunctions import performKLNMFWithStats
+
+def getRandomMagnitudeSpectrogram(numFrequencies, numTime, seedValue=0):
+    randomState = np.random.RandomState(seedValue)
+    return np.abs( randomState.randn(numFrequencies, numTime) ).astype(np.float32)
+
+def runBenchmark(threadCounts, numFrequencies, numTime, dictionarySize, numIterations):
+    # BLAS threads compete with the NMF thread pool, consider running with e.g. OMP_NUM_THREADS=1
+    V = getRandomMagnitudeSpectrogram(numFrequencies, numTime)
+    
+    results = {}
+    referenceW = None
+    for numThreads in threadCounts:
+        W, _, stats = performKLNMFWithStats(V, dictionarySize, numIterations, sparsityAlpha=0, objectiveInterval=0, numThreads=numThreads)
+        if referenceW is None:
+            referenceW = W
+            referenceTime = stats['totalTime']
+        speedup = referenceTime / stats['totalTime']
+        maxAbsDifference = np.max( np.abs(W - referenceW) )
+        results[numThreads] = {'totalTime': stats['totalTime'], 'speedup': speedup, 'maxAbsDifference': maxAbsDifference}
+        logging.info( 'NMFBenchmark: %d threads: %.2f s, %.2fx speedup vs %d thread(s) (max abs W difference: %g)'
+                      % (numThreads, stats['totalTime'], speedup, threadCounts[0], maxAbsDifference) )
+    return results
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description='Multi-threaded KL-NMF benchmark')
+    parser.add_argument('--thread-counts', help='numbers of threads to benchmark', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--num-frequencies', help='number of frequency bins', type=int, default=513)
+    parser.add_argument('--num-time', help='number of STFT frames (columns of V)', type=int, default=20000)
+    parser.add_argument('--dictionary-size', help='NMF dictionary size', type=int, default=128)
+    parser.add_argument('--num-iterations', help='number of NMF iterations', type=int, default=20)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    
+    args = parseArguments()
+    runBenchmark(args.thread_counts, args.num_frequencies, args.num_time, args.dictionary_size, args.num_iterations)
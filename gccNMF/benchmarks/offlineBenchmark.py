@@ -0,0 +1,188 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2016 Sean UN Wood
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: Sean UN Wood
+'''
+
+import os
+import json
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import itertools
+from os.path import join, basename, abspath, exists
+from multiprocessing import get_context
+
+from gccNMF.defs import DATA_DIR
+from gccNMF.runBatchGCCNMF import getMixtureFilePrefixes, blasNumThreadsEnvironment, initializeWorker, MIXTURE_FILE_SUFFIX
+
+# timings only compare on the machine that produced them, so the baseline is generated locally (and not committed)
+DEFAULT_BASELINE_PATH = join(os.path.dirname(abspath(__file__)), 'offlineBenchmarkBaseline.json')
+GRID_PARAMETER_NAMES = ['windowSize', 'hopSize', 'numTDOAs', 'dictionarySize']
+
+def getCPUModel():
+    try:
+        with open('/proc/cpuinfo', 'r') as cpuInfoFile:
+            for line in cpuInfoFile:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except IOError:
+        pass
+    return platform.processor()
+
+def getHost():
+    return {'node': platform.node(), 'machine': platform.machine(), 'cpuModel': getCPUModel(), 'numCPUs': os.cpu_count()}
+
+def getRunKey(mixtureName, gridParameters):
+    return '%s:%s' % ( mixtureName, ','.join('%s=%s' % (parameterName, gridParameters[parameterName]) for parameterName in GRID_PARAMETER_NAMES) )
+
+def getParameterGrid(windowSizes, hopSizes, numTDOAsList, dictionarySizes):
+    return [dict( zip(GRID_PARAMETER_NAMES, values) ) for values in itertools.product(windowSizes, hopSizes, numTDOAsList, dictionarySizes)
+            if values[1] <= values[0]]
+
+def runBenchmarkConfiguration(arguments):
+    # runs in a fresh spawned process (maxtasksperchild=1), so ru_maxrss is the peak RSS of this configuration alone
+    mixtureFilePrefix, parameters, numRepetitions, outputDir = arguments
+    from gccNMF.runGCCNMF import runGCCNMF
+    
+    # link the mixture into a scratch directory so that the separated outputs are not written next to the input data
+    linkedMixtureFilePrefix = join( outputDir, basename(mixtureFilePrefix) )
+    if not exists(linkedMixtureFilePrefix + MIXTURE_FILE_SUFFIX):
+        os.symlink( abspath(mixtureFilePrefix + MIXTURE_FILE_SUFFIX), linkedMixtureFilePrefix + MIXTURE_FILE_SUFFIX )
+    
+    reports = [runGCCNMF(linkedMixtureFilePrefix, profile=True, **parameters) for _ in range(numRepetitions)]
+    reports.sort( key=lambda report: report['totalWallTime'] )
+    medianReport = reports[len(reports) // 2]
+    medianReport['maxRSSInBytes'] = max(report['maxRSSInBytes'] for report in reports)
+    medianReport['mixtureName'] = basename(mixtureFilePrefix)
+    medianReport['wallTimes'] = [report['totalWallTime'] for report in reports]
+    return medianReport
+
+def getResultSummary(report):
+    return {'realtimeFactor': report['realtimeFactor'],
+            'totalWallTime': report['totalWallTime'],
+            'totalCPUTime': report['totalCPUTime'],
+            'maxRSSInBytes': report['maxRSSInBytes'],
+            'stageWallTimes': dict( (stageReport['name'], stageReport['wallTime']) for stageReport in report['stages'] )}
+
+def compareToBaseline(results, baseline, regressionThreshold):
+    regressions = []
+    for runKey, result in sorted( results.items() ):
+        if runKey not in baseline:
+            logging.info( 'OfflineBenchmark: %s: not in baseline' % runKey )
+            continue
+        baselineResult = baseline[runKey]
+        speedup = baselineResult['totalWallTime'] / result['totalWallTime']
+        rssRatio = result['maxRSSInBytes'] / float(baselineResult['maxRSSInBytes'])
+        stageSpeedups = ', '.join( '%s %.2fx' % (stageName, baselineResult['stageWallTimes'][stageName] / stageWallTime)
+                                   for stageName, stageWallTime in result['stageWallTimes'].items()
+                                   if baselineResult['stageWallTimes'].get(stageName) and stageWallTime > 0 )
+        logging.info( 'OfflineBenchmark: %s: %.2fx speed, %.2fx peak RSS vs baseline (%s)' % (runKey, speedup, rssRatio, stageSpeedups) )
+        if speedup < 1 - regressionThreshold or rssRatio > 1 + regressionThreshold:
+            regressions.append(runKey)
+    for runKey in regressions:
+        logging.warning( 'OfflineBenchmark: regression: %s' % runKey )
+    return regressions
+
+def runBenchmark(inputPaths, parameterGrid, fixedParameters, numRepetitions=3, numBLASThreads=1, baselinePath=DEFAULT_BASELINE_PATH,
+                 saveBaseline=False, regressionThreshold=0.1, resultsPath=None):
+    mixtureFilePrefixes = getMixtureFilePrefixes(inputPaths)
+    tasks = [(mixtureFilePrefix, dict(fixedParameters, **gridParameters)) for mixtureFilePrefix in mixtureFilePrefixes for gridParameters in parameterGrid]
+    logging.info( 'OfflineBenchmark: %d mixtures x %d configurations, %d repetitions each' % (len(mixtureFilePrefixes), len(parameterGrid), numRepetitions) )
+    
+    results = {}
+    reports = []
+    outputDir = tempfile.mkdtemp(prefix='gccNMFBenchmark')
+    # configurations are run one at a time so that they do not compete for cores or memory bandwidth
+    with blasNumThreadsEnvironment(numBLASThreads):
+        pool = get_context('spawn').Pool(1, initializer=initializeWorker, initargs=(numBLASThreads,), maxtasksperchild=1)
+        try:
+            for (mixtureFilePrefix, parameters), report in zip( tasks, pool.imap(runBenchmarkConfiguration, [task + (numRepetitions, outputDir) for task in tasks]) ):
+                runKey = getRunKey( basename(mixtureFilePrefix), parameters )
+                results[runKey] = getResultSummary(report)
+                reports.append(report)
+                logging.info( 'OfflineBenchmark: %s: %.1fx realtime, %.3f s wall, %.3f s CPU, peak RSS %.1f MB'
+                              % (runKey, report['realtimeFactor'], report['totalWallTime'], report['totalCPUTime'], report['maxRSSInBytes'] / 2.0**20) )
+        finally:
+            pool.close()
+            pool.join()
+            shutil.rmtree(outputDir, ignore_errors=True)
+    
+    if resultsPath is not None:
+        with open(resultsPath, 'w') as resultsFile:
+            json.dump(reports, resultsFile, indent=2, default=str)
+    
+    regressions = []
+    if saveBaseline:
+        with open(baselinePath, 'w') as baselineFile:
+            json.dump({'host': getHost(), 'results': results}, baselineFile, indent=2, sort_keys=True)
+        logging.info( 'OfflineBenchmark: baseline saved to %s' % baselinePath )
+    elif exists(baselinePath):
+        with open(baselinePath, 'r') as baselineFile:
+            baseline = json.load(baselineFile)
+        if baseline.get('host') != getHost():
+            raise ValueError( 'OfflineBenchmark: baseline %s was recorded on %s, not on this host (%s), run with --save-baseline to create one here'
+                              % (baselinePath, baseline.get('host'), getHost()) )
+        regressions = compareToBaseline( results, baseline['results'], regressionThreshold )
+    else:
+        logging.info( 'OfflineBenchmark: no baseline at %s, run with --save-baseline to create one' % baselinePath )
+    return results, regressions
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description='Offline GCC-NMF benchmark over a parameter grid, compared against a stored baseline')
+    parser.add_argument('inputPaths', help='directories containing *%s files, or glob patterns' % MIXTURE_FILE_SUFFIX, nargs='*', default=[DATA_DIR])
+    parser.add_argument('--window-sizes', type=int, nargs='+', default=[1024, 2048])
+    parser.add_argument('--hop-sizes', type=int, nargs='+', default=[128, 256])
+    parser.add_argument('--num-tdoas', type=int, nargs='+', default=[64, 128])
+    parser.add_argument('--dictionary-sizes', type=int, nargs='+', default=[128])
+    parser.add_argument('--microphone-separation', help='microphone separation in metres', type=float, default=1.0)
+    parser.add_argument('--num-targets', help='fixed so that every run does the same amount of work', type=int, default=3)
+    parser.add_argument('--num-iterations', type=int, default=100)
+    parser.add_argument('--backend', help='compute backend (numpy, numba or torch)', default='numpy')
+    parser.add_argument('--parameters', help='JSON object of additional runGCCNMF keyword arguments', default='{}')
+    parser.add_argument('--num-repetitions', help='timed repetitions per configuration, the median is reported', type=int, default=3)
+    parser.add_argument('--num-blas-threads', type=int, default=1)
+    parser.add_argument('--baseline', help='baseline JSON file, only compared against on the host that saved it', default=DEFAULT_BASELINE_PATH)
+    parser.add_argument('--save-baseline', help='store these results as the new baseline instead of comparing', action='store_true')
+    parser.add_argument('--regression-threshold', help='relative slowdown or peak RSS increase reported as a regression', type=float, default=0.1)
+    parser.add_argument('--results', help='write the full per-stage reports to this JSON file', default=None)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    
+    args = parseArguments()
+    parameterGrid = getParameterGrid(args.window_sizes, args.hop_sizes, args.num_tdoas, args.dictionary_sizes)
+    fixedParameters = {'microphoneSeparationInMetres': args.microphone_separation,
+                       'numTargets': args.num_targets,
+                       'numIterations': args.num_iterations,
+                       'backendName': args.backend,
+                       'profileMemory': False}
+    fixedParameters.update( json.loads(args.parameters) )
+    
+    _, regressions = runBenchmark(args.inputPaths, parameterGrid, fixedParameters, args.num_repetitions, args.num_blas_threads, args.baseline,
+                                  args.save_baseline, args.regression_threshold, args.results)
+    if regressions:
+        exit(1)
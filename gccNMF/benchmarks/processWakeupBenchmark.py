@@ -0,0 +1,140 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2016 Sean UN Wood
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: Sean UN Wood
+'''
+
+import ctypes
+import logging
+import argparse
+import resource
+from time import sleep, perf_counter
+import numpy as np
+from multiprocessing import Process, Event, Queue, Semaphore, Array, Value
+
+from gccNMF.realtime.utils import NotifyingEvent, NotifyingQueue, SharedMemoryBlockRing, releaseSharedBuffers
+from gccNMF.realtime.gccNMFProcessor import GCCNMFProcess
+
+class WakeupLatencyRecorder(object):
+    '''Stands in for OverlapAddProcessor, recording how long after the block was signalled processing started.'''
+    
+    def __init__(self, numBlocks, blockShape=(2, 512)):
+        self.inputFrames = np.zeros(blockShape, np.float32)
+        self.outputFrames = np.zeros(blockShape, np.float32)
+        self.blockStartTime = Value(ctypes.c_double, 0.0)
+        self.latencies = Array(ctypes.c_double, numBlocks)
+        self.blockIndex = Value(ctypes.c_int, 0)
+    
+    def processFrames(self, processFramesFunction):
+        self.latencies[self.blockIndex.value] = perf_counter() - self.blockStartTime.value
+        self.blockIndex.value += 1
+
+def pollingLoop(recorder, queues, processFramesEvent, processFramesDoneEvent, terminateEvent):
+    # the previous GCCNMFProcess.run main loop, kept for comparison only
+    while True:
+        if terminateEvent.is_set():
+            return
+        wait = True
+        for queue in queues:
+            if not queue.empty():
+                queue.get()
+                wait = False
+        if processFramesEvent.is_set():
+            processFramesEvent.clear()
+            recorder.processFrames(None)
+            processFramesDoneEvent.set()
+            wait = False
+        if wait:
+            sleep(0.001)
+
+def getPollingProcess(recorder):
+    queues = [Queue() for _ in range(3)]
+    processFramesEvent, processFramesDoneEvent, terminateEvent = Event(), Event(), Event()
+    process = Process( target=pollingLoop, args=(recorder, queues, processFramesEvent, processFramesDoneEvent, terminateEvent) )
+    
+    def sendBlock():
+        # the previous audio callback handshake, blocking until the block was processed
+        processFramesEvent.set()
+        processFramesDoneEvent.wait()
+        processFramesDoneEvent.clear()
+    return process, sendBlock, terminateEvent, []
+
+def getDoorbellProcess(recorder):
+    doorbell = Semaphore(0)
+    queues = [NotifyingQueue(doorbell) for _ in range(4)]
+    inputRing, outputRing = SharedMemoryBlockRing(4, recorder.inputFrames.shape), SharedMemoryBlockRing(4, recorder.outputFrames.shape)
+    terminateEvent = NotifyingEvent(doorbell)
+    process = GCCNMFProcess(recorder, 16000, 1024, 1, {}, 'Random', 64, 0, 0.1, False, 1, None, None, None, None, None,
+                            queues[0], Event(), queues[1], Event(), queues[2], Event(), inputRing, outputRing, terminateEvent, doorbell, queues[3])
+    
+    def sendBlock():
+        inputRing.write(recorder.inputFrames)
+        doorbell.release()
+        outputRing.discard()
+    return process, sendBlock, terminateEvent, [inputRing, outputRing]
+
+def getWakeupLatencies(getProcess, numBlocks, blockInterval):
+    recorder = WakeupLatencyRecorder(numBlocks)
+    process, sendBlock, terminateEvent, sharedBuffers = getProcess(recorder)
+    
+    startCPUTime = resource.getrusage(resource.RUSAGE_CHILDREN)
+    process.start()
+    sleep(0.5)
+    startTime = perf_counter()
+    for _ in range(numBlocks):
+        # blocks arrive at the audio callback period, as when playing
+        sleep(blockInterval)
+        recorder.blockStartTime.value = perf_counter()
+        sendBlock()
+    sleep(blockInterval)
+    wallTime = perf_counter() - startTime
+    terminateEvent.set()
+    process.join()
+    releaseSharedBuffers(sharedBuffers)
+    endCPUTime = resource.getrusage(resource.RUSAGE_CHILDREN)
+    
+    cpuTime = (endCPUTime.ru_utime + endCPUTime.ru_stime) - (startCPUTime.ru_utime + startCPUTime.ru_stime)
+    return np.array(recorder.latencies[:]), cpuTime / wallTime
+
+def runBenchmark(numBlocks, blockInterval):
+    results = {}
+    for loopName, getProcess in [('polling', getPollingProcess), ('doorbell', getDoorbellProcess)]:
+        latencies, cpuLoad = getWakeupLatencies(getProcess, numBlocks, blockInterval)
+        results[loopName] = {'p50': np.percentile(latencies, 50), 'p99': np.percentile(latencies, 99), 'max': np.max(latencies),
+                             'std': np.std(latencies), 'cpuLoad': cpuLoad}
+        logging.info( 'ProcessWakeupBenchmark: %s: block start latency (p50/p99/max): %.3f, %.3f, %.3f ms, jitter (std) %.3f ms, processing process CPU load %.1f%%'
+                      % (loopName, results[loopName]['p50'] * 1000, results[loopName]['p99'] * 1000, results[loopName]['max'] * 1000,
+                         results[loopName]['std'] * 1000, cpuLoad * 100) )
+    return results
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description='GCCNMFProcess block start latency: 1 ms polling vs doorbell semaphore')
+    parser.add_argument('--num-blocks', help='number of signalled blocks', type=int, default=500)
+    parser.add_argument('--block-interval', help='time between blocks in seconds', type=float, default=0.016)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    
+    args = parseArguments()
+    runBenchmark(args.num_blocks, args.block_interval)
@@ -0,0 +1,159 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2016 Sean UN Wood
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: Sean UN Wood
+'''
+
+import logging
+import argparse
+from time import time
+import numpy as np
+from numpy.fft import rfft
+
+from gccNMF.defs import GCC_PHAT_MODE_EXPLICIT, GCC_PHAT_MODE_FFT
+from gccNMF.realtime.gccNMFProcessor import GCCNMFProcessor, TARGET_MODE_BOXCAR, TARGET_MODE_WINDOW_FUNCTION
+
+TARGET_MODE_NAMES = {TARGET_MODE_BOXCAR: 'boxcar',
+                     TARGET_MODE_WINDOW_FUNCTION: 'window'}
+
+class TheanoReferenceEngine(object):
+    # Theano graph previously built by GCCNMFProcessor.buildTheanoFunctions, kept for comparison only
+    def __init__(self, gccNMFProcessor):
+        from theano import shared, tensor, function
+        
+        self.gccNMFProcessor = gccNMFProcessor
+        W = gccNMFProcessor.W
+        expJOmegaTau = gccNMFProcessor.expJOmegaTau
+        
+        self.targetTDOAIndex = shared( np.float32(gccNMFProcessor.targetTDOAIndex) )
+        self.targetTDOAEpsilon = shared( np.float32(gccNMFProcessor.targetTDOAEpsilon) )
+        self.targetTDOABeta = shared( np.float32(gccNMFProcessor.targetTDOABeta) )
+        self.targetTDOANoiseFloor = shared( np.float32(gccNMFProcessor.targetTDOANoiseFloor) )
+        
+        self.spectrogram = shared(gccNMFProcessor.complexMixtureSpectrogram)
+        coherenceV = self.spectrogram[0] * self.spectrogram[1].conj() / np.abs(self.spectrogram[0]) / np.abs(self.spectrogram[1])
+        complexGCC = coherenceV[:, :, np.newaxis] * expJOmegaTau[:, np.newaxis]
+        self.getComplexGCC = function([], [complexGCC])
+        
+        realGCC = tensor.tensor3('realGCC', dtype='float32')
+        gccNMF = tensor.dot( realGCC.T, W )
+        if gccNMFProcessor.targetMode == TARGET_MODE_BOXCAR:
+            HMask = tensor.switch( abs(tensor.argmax(gccNMF, axis=0).T - self.targetTDOAIndex) < self.targetTDOAEpsilon, 1.0, 0.0 )
+        else:
+            HMask = tensor.exp( - (abs(tensor.argmax(gccNMF, axis=0).T - self.targetTDOAIndex) / self.targetTDOAEpsilon) ** self.targetTDOABeta ) / (1+self.targetTDOANoiseFloor) + self.targetTDOANoiseFloor
+        tfMask = ( tensor.dot(W, HMask).T / tensor.sum(W, axis=-1) ).T
+        self.getTFMask = function(inputs=[realGCC], outputs=[tfMask, HMask])
+    
+    def processFrames(self, windowedSamples):
+        complexMixtureSpectrogram = rfft(windowedSamples * self.gccNMFProcessor.windowFunction, axis=1).astype(np.complex64)
+        self.spectrogram.set_value(complexMixtureSpectrogram)
+        realGCC = self.getComplexGCC()[0].real
+        inputMask, _ = self.getTFMask(realGCC)
+        return np.fft.irfft(inputMask * complexMixtureSpectrogram, axis=1) * self.gccNMFProcessor.synthesisWindowFunction
+
+def createGCCNMFProcessor(dictionarySize, numTDOAs, targetMode, windowSize=1024, numTimePerChunk=1, sampleRate=16000, microphoneSeparationInMetres=0.1,
+                          gccPHATMode=GCC_PHAT_MODE_EXPLICIT):
+    W = np.random.rand(windowSize // 2 + 1, dictionarySize).astype(np.float32)
+    dictionariesW = {'Random': {dictionarySize: W}}
+    
+    gccNMFProcessor = GCCNMFProcessor(sampleRate, windowSize, numTimePerChunk, dictionariesW, 'Random', dictionarySize, 0, microphoneSeparationInMetres,
+                                      localizationEnabled=False, localizationWindowSize=1, gccPHATMode=gccPHATMode)
+    gccNMFProcessor.numTDOAs = numTDOAs
+    gccNMFProcessor.targetMode = targetMode
+    gccNMFProcessor.setTargetTDOARange(numTDOAs / 2.0, numTDOAs / 10.0, 2.0, 0.0)
+    
+    startTime = time()
+    gccNMFProcessor.reset()
+    resetTime = time() - startTime
+    
+    return gccNMFProcessor, resetTime
+
+def getBlockTimes(processFramesFunction, windowedSamplesBlocks, numWarmupBlocks=5):
+    for windowedSamples in windowedSamplesBlocks[:numWarmupBlocks]:
+        processFramesFunction(windowedSamples)
+    
+    blockTimes = []
+    for windowedSamples in windowedSamplesBlocks:
+        startTime = time()
+        processFramesFunction(windowedSamples)
+        blockTimes.append(time() - startTime)
+    return np.array(blockTimes)
+
+def runBenchmark(dictionarySizes, numTDOAsList, targetModes, numBlocks, windowSize=1024, numTimePerChunk=1, gccPHATMode=GCC_PHAT_MODE_EXPLICIT):
+    try:
+        import theano
+        theanoAvailable = True
+    except ImportError:
+        logging.info('RealtimeEngineBenchmark: Theano not available, benchmarking NumPy engine only')
+        theanoAvailable = False
+    
+    results = []
+    for targetMode in targetModes:
+        for dictionarySize in dictionarySizes:
+            for numTDOAs in numTDOAsList:
+                gccNMFProcessor, resetTime = createGCCNMFProcessor(dictionarySize, numTDOAs, targetMode, windowSize, numTimePerChunk, gccPHATMode=gccPHATMode)
+                windowedSamplesBlocks = np.random.randn(numBlocks, 2, windowSize, numTimePerChunk).astype(np.float32) * 0.1
+                
+                result = {'targetMode': TARGET_MODE_NAMES[targetMode],
+                          'dictionarySize': dictionarySize,
+                          'numTDOAs': numTDOAs,
+                          'numpyResetTime': resetTime,
+                          'numpyBlockTimes': getBlockTimes(gccNMFProcessor.processFrames, windowedSamplesBlocks)}
+                
+                if theanoAvailable and gccPHATMode == GCC_PHAT_MODE_EXPLICIT:
+                    startTime = time()
+                    theanoEngine = TheanoReferenceEngine(gccNMFProcessor)
+                    result['theanoResetTime'] = time() - startTime
+                    result['theanoBlockTimes'] = getBlockTimes(theanoEngine.processFrames, windowedSamplesBlocks)
+                    result['maxAbsDifference'] = np.max( np.abs( gccNMFProcessor.processFrames(windowedSamplesBlocks[0]) - theanoEngine.processFrames(windowedSamplesBlocks[0]) ) )
+                results.append(result)
+                logResult(result)
+    return results
+
+def logResult(result):
+    logging.info( 'mode: %s, dictionarySize: %d, numTDOAs: %d' % (result['targetMode'], result['dictionarySize'], result['numTDOAs']) )
+    for engineName in ['numpy', 'theano']:
+        if engineName + 'BlockTimes' not in result:
+            continue
+        blockTimes = result[engineName + 'BlockTimes'] * 1000
+        logging.info( '    %s: reset %.2f ms, block (median/p99/max): %.3f, %.3f, %.3f ms' % (engineName, result[engineName + 'ResetTime'] * 1000,
+                                                                                               np.median(blockTimes), np.percentile(blockTimes, 99), np.max(blockTimes)) )
+    if 'maxAbsDifference' in result:
+        logging.info( '    max abs difference: %g' % result['maxAbsDifference'] )
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description='GCCNMFProcessor engine benchmark')
+    parser.add_argument('--dictionary-sizes', help='dictionary sizes', type=int, nargs='+', default=[64, 256, 1024])
+    parser.add_argument('--num-tdoas', help='number of TDOAs', type=int, nargs='+', default=[64, 128])
+    parser.add_argument('--num-blocks', help='number of timed blocks per configuration', type=int, default=200)
+    parser.add_argument('--window-size', help='STFT window size', type=int, default=1024)
+    parser.add_argument('--windows-per-block', help='number of STFT frames per block', type=int, default=1)
+    parser.add_argument('--gcc-phat-mode', help='GCC-PHAT evaluation mode', choices=[GCC_PHAT_MODE_EXPLICIT, GCC_PHAT_MODE_FFT], default=GCC_PHAT_MODE_EXPLICIT)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    
+    args = parseArguments()
+    runBenchmark(args.dictionary_sizes, args.num_tdoas, [TARGET_MODE_BOXCAR, TARGET_MODE_WINDOW_FUNCTION],
+                 args.num_blocks, args.window_size, args.windows_per_block, args.gcc_phat_mode)
@@ -0,0 +1,138 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2016 Sean UN Wood
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: Sean UN Wood
+'''
+
+import json
+import logging
+import argparse
+import itertools
+from time import perf_counter
+import numpy as np
+
+from gccNMF.defs import DEFAULT_AUDIO_FILE, TARGET_MODE_BOXCAR, TARGET_MODE_WINDOW_FUNCTION
+from gccNMF.wavfile import WavReader
+from gccNMF.realtime.utils import OverlapAddProcessor, SharedMemoryCircularBuffer, releaseSharedBuffers
+from gccNMF.realtime.gccNMFProcessor import GCCNMFProcessor
+from gccNMF.benchmarks.realtimeEngineBenchmark import TARGET_MODE_NAMES
+
+TARGET_MODES = dict( (targetModeName, targetMode) for targetMode, targetModeName in TARGET_MODE_NAMES.items() )
+
+def createProcessors(sampleRate, numChannels, windowSize, hopSize, blockSize, dictionarySize, numTDOAs, targetMode, numHUpdates=0,
+                     microphoneSeparationInMetres=0.1, backendName='numpy', historiesEnabled=False, numHistory=128, seedValue=0):
+    # mirrors RealtimeGCCNMF.initSharedArrays/initProcesses, with a random dictionary since only timing matters here
+    windowsPerBlock = blockSize // hopSize
+    inputFrames = np.zeros( (numChannels, blockSize), np.float32 )
+    outputFrames = np.zeros( (numChannels, blockSize), np.float32 )
+    oladProcessor = OverlapAddProcessor(numChannels, windowSize, hopSize, blockSize, windowsPerBlock, inputFrames, outputFrames)
+    
+    numFrequencies = windowSize // 2 + 1
+    W = np.random.RandomState(seedValue).rand(numFrequencies, dictionarySize).astype(np.float32)
+    histories = [None] * 5
+    if historiesEnabled:
+        histories = [SharedMemoryCircularBuffer( (numTDOAs, numHistory) ), SharedMemoryCircularBuffer( (1, numHistory) ),
+                     SharedMemoryCircularBuffer( (numFrequencies, numHistory) ), SharedMemoryCircularBuffer( (numFrequencies, numHistory) ),
+                     {dictionarySize: SharedMemoryCircularBuffer( (dictionarySize, numHistory) )}]
+    gccNMFProcessor = GCCNMFProcessor(sampleRate, windowSize, windowsPerBlock, {'Random': {dictionarySize: W}}, 'Random', dictionarySize, numHUpdates,
+                                      microphoneSeparationInMetres, historiesEnabled, 6, *histories, backendName=backendName)
+    gccNMFProcessor.numTDOAs = numTDOAs
+    gccNMFProcessor.targetMode = targetMode
+    gccNMFProcessor.setTargetTDOARange(numTDOAs / 2.0, numTDOAs / 10.0, 2.0, 0.0)
+    gccNMFProcessor.reset()
+    return oladProcessor, gccNMFProcessor, inputFrames, outputFrames
+
+def getBlockLatencies(samples, oladProcessor, gccNMFProcessor, inputFrames, numBlocks, numWarmupBlocks=10):
+    # feeds consecutive blocks of the file (looping if needed) as fast as possible, timing each audio callback's worth of processing
+    blockSize = inputFrames.shape[-1]
+    numFileBlocks = samples.shape[-1] // blockSize
+    blockLatencies = np.zeros(numBlocks)
+    for blockIndex in range(-numWarmupBlocks, numBlocks):
+        fileBlockIndex = blockIndex % numFileBlocks
+        startTime = perf_counter()
+        inputFrames[:] = samples[:, fileBlockIndex * blockSize:(fileBlockIndex + 1) * blockSize]
+        oladProcessor.processFrames(gccNMFProcessor.processFrames)
+        if blockIndex >= 0:
+            blockLatencies[blockIndex] = perf_counter() - startTime
+    return blockLatencies
+
+def getLatencySummary(blockLatencies, blockDeadline):
+    return {'p50': np.percentile(blockLatencies, 50),
+            'p99': np.percentile(blockLatencies, 99),
+            'max': np.max(blockLatencies),
+            'deadline': blockDeadline,
+            'realtimeFactor': blockDeadline * len(blockLatencies) / np.sum(blockLatencies),
+            'fractionOverDeadline': np.mean(blockLatencies > blockDeadline)}
+
+def runBenchmark(audioPath, dictionarySizes, numTDOAsList, blockSizes, targetModeNames, windowSize=1024, hopSize=256, numBlocks=500, numHUpdates=0,
+                 backendName='numpy', historiesEnabled=False):
+    wavReader = WavReader(audioPath)
+    samples = wavReader.read()
+    sampleRate, numChannels = wavReader.sampleRate, wavReader.numChannels
+    
+    results = []
+    for targetModeName, dictionarySize, numTDOAs, blockSize in itertools.product(targetModeNames, dictionarySizes, numTDOAsList, blockSizes):
+        if blockSize % hopSize != 0:
+            logging.info( 'RealtimeFactorBenchmark: skipping blockSize %d, not a multiple of hopSize %d' % (blockSize, hopSize) )
+            continue
+        oladProcessor, gccNMFProcessor, inputFrames, _ = createProcessors(sampleRate, numChannels, windowSize, hopSize, blockSize, dictionarySize, numTDOAs,
+                                                                          TARGET_MODES[targetModeName], numHUpdates, backendName=backendName,
+                                                                          historiesEnabled=historiesEnabled)
+        blockLatencies = getBlockLatencies(samples, oladProcessor, gccNMFProcessor, inputFrames, numBlocks)
+        releaseSharedBuffers( [gccNMFProcessor.gccPHATHistory, gccNMFProcessor.tdoaHistory, gccNMFProcessor.inputSpectrogramHistory,
+                               gccNMFProcessor.outputSpectrogramHistory, gccNMFProcessor.coefficientMaskHistories] )
+        
+        result = {'targetMode': targetModeName, 'dictionarySize': dictionarySize, 'numTDOAs': numTDOAs, 'blockSize': blockSize}
+        result.update( getLatencySummary(blockLatencies, blockSize / float(sampleRate)) )
+        results.append(result)
+        logging.info( 'RealtimeFactorBenchmark: mode: %s, dictionarySize: %d, numTDOAs: %d, blockSize: %d: block (p50/p99/max): %.3f, %.3f, %.3f ms '
+                      'vs %.3f ms deadline, %.1fx realtime, %.1f%% of blocks late'
+                      % (targetModeName, dictionarySize, numTDOAs, blockSize, result['p50'] * 1000, result['p99'] * 1000, result['max'] * 1000,
+                         result['deadline'] * 1000, result['realtimeFactor'], result['fractionOverDeadline'] * 100) )
+    return results
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description='Realtime factor of OverlapAddProcessor + GCCNMFProcessor driven from a WAV file, without audio hardware')
+    parser.add_argument('-i', '--input', help='input wav file path', default=DEFAULT_AUDIO_FILE)
+    parser.add_argument('--dictionary-sizes', type=int, nargs='+', default=[64, 256, 1024])
+    parser.add_argument('--num-tdoas', type=int, nargs='+', default=[64, 128])
+    parser.add_argument('--block-sizes', type=int, nargs='+', default=[256, 512, 1024])
+    parser.add_argument('--target-modes', nargs='+', choices=sorted(TARGET_MODES), default=sorted(TARGET_MODES))
+    parser.add_argument('--window-size', type=int, default=1024)
+    parser.add_argument('--hop-size', type=int, default=256)
+    parser.add_argument('--num-blocks', help='number of timed blocks per configuration, looping over the file', type=int, default=500)
+    parser.add_argument('--num-h-updates', help='H-only NMF updates per block', type=int, default=0)
+    parser.add_argument('--backend', help='compute backend (numpy, numba or torch)', default='numpy')
+    parser.add_argument('--histories', help='also fill the visualisation histories and track the TDOA, as with the GUI', action='store_true')
+    parser.add_argument('--results', help='write the results to this JSON file', default=None)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    
+    args = parseArguments()
+    results = runBenchmark(args.input, args.dictionary_sizes, args.num_tdoas, args.block_sizes, args.target_modes, args.window_size, args.hop_size,
+                           args.num_blocks, args.num_h_updates, args.backend, args.histories)
+    if args.results is not None:
+        with open(args.results, 'w') as resultsFile:
+            json.dump(results, resultsFile, indent=2)
@@ -0,0 +1,80 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2016 Sean UN Wood
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: Sean UN Wood
+'''
+
+import logging
+import argparse
+from time import time
+import numpy as np
+
+from gccNMF.librosaSTFT import stft, istft
+from gccNMF.batchSTFT import batchSTFT, batchISTFT
+
+def getMedianTime(function, numRepetitions):
+    times = []
+    for _ in range(numRepetitions):
+        startTime = time()
+        result = function()
+        times.append( time() - startTime )
+    return np.median(times), result
+
+def runBenchmark(durationInSeconds, sampleRate, windowSize, hopSize, numTargets, numRepetitions):
+    signals = np.random.RandomState(0).randn(2, int(durationInSeconds * sampleRate)).astype(np.float32)
+    
+    librosaSTFT = lambda: np.array( [stft(signal.copy(), windowSize, hopSize, windowSize, np.hanning, center=False) for signal in signals] )
+    librosaSTFTTime, spectrograms = getMedianTime(librosaSTFT, numRepetitions)
+    batchSTFTTime, batchSpectrograms = getMedianTime(lambda: batchSTFT(signals, windowSize, hopSize, np.hanning), numRepetitions)
+    
+    targetSpectrograms = np.repeat( spectrograms[np.newaxis], numTargets, axis=0 )
+    librosaISTFT = lambda: np.array( [[istft(spectrogram, hopSize, windowSize, np.hanning, center=False) for spectrogram in channelSpectrograms]
+                                      for channelSpectrograms in targetSpectrograms] )
+    librosaISTFTTime, targetSignals = getMedianTime(librosaISTFT, numRepetitions)
+    batchISTFTTime, batchTargetSignals = getMedianTime(lambda: batchISTFT(targetSpectrograms, windowSize, hopSize, np.hanning), numRepetitions)
+    
+    results = {'stft': {'librosaTime': librosaSTFTTime, 'batchTime': batchSTFTTime, 'maxAbsDifference': np.max( np.abs(batchSpectrograms - spectrograms) )},
+               'istft': {'librosaTime': librosaISTFTTime, 'batchTime': batchISTFTTime, 'maxAbsDifference': np.max( np.abs(batchTargetSignals - targetSignals) )}}
+    numSamples = signals.shape[-1]
+    for transformName, numSignals in [('stft', 2), ('istft', 2 * numTargets)]:
+        result = results[transformName]
+        logging.info( 'STFTBenchmark: %s: librosa %.1f ms, batch %.1f ms (%.1fx, %.1f Msamples/s), max abs difference: %g'
+                      % (transformName, result['librosaTime'] * 1000, result['batchTime'] * 1000, result['librosaTime'] / result['batchTime'],
+                         numSignals * numSamples / result['batchTime'] / 1e6, result['maxAbsDifference']) )
+    return results
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description='Batched STFT/ISTFT vs librosaSTFT benchmark')
+    parser.add_argument('--duration', help='signal duration in seconds', type=float, default=30)
+    parser.add_argument('--sample-rate', type=int, default=16000)
+    parser.add_argument('--window-size', type=int, default=1024)
+    parser.add_argument('--hop-size', type=int, default=128)
+    parser.add_argument('--num-targets', help='number of target signals reconstructed by the ISTFT', type=int, default=3)
+    parser.add_argument('--num-repetitions', help='number of timed repetitions', type=int, default=5)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    
+    args = parseArguments()
+    runBenchmark(args.duration, args.sample_rate, args.window_size, args.hop_size, args.num_targets, args.num_repetitions)
@@ -38,4 +38,11 @@ DATA_DIR = getVariableWithDefault('GCCNMF_DATA_DIR', join(ROOT_DIR, 'data'))
 DEFAULT_AUDIO_FILE = join(DATA_DIR, 'dev_Sq1_Co_A_mix.wav')
 DEFAULT_CONFIG_FILE = join(ROOT_DIR, 'gccNMF.cfg')
 
-SPEED_OF_SOUND_IN_METRES_PER_SECOND = 340.29
\ No newline at end of file
+SPEED_OF_SOUND_IN_METRES_PER_SECOND = 340.29
+
+TARGET_MODE_BOXCAR = 0
+TARGET_MODE_MULTIPLE = 1
+TARGET_MODE_WINDOW_FUNCTION = 2
+
+GCC_PHAT_MODE_EXPLICIT = 'explicit'
+GCC_PHAT_MODE_FFT = 'fft'
@@ -0,0 +1,302 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2016 Sean UN Wood
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: Sean UN Wood
+'''
+
+import warnings
+import numpy as np
+from scipy.fft import irfft
+from collections import OrderedDict, namedtuple
+
+from gccNMF.defs import TARGET_MODE_BOXCAR, TARGET_MODE_WINDOW_FUNCTION
+
+MAX_GCC_BLOCK_SIZE = 2**18
+
+def getExpJOmegaTauTable(expJOmegaTau):
+    # stacked cos/sin table such that real(coherence * expJOmegaTau) = [coherence.real, coherence.imag] . table
+    return np.concatenate( [expJOmegaTau.real, -expJOmegaTau.imag] )
+
+FFTGCCTable = namedtuple('FFTGCCTable', ['fftSize', 'frequencyWeights', 'lowerLagIndexes', 'upperLagIndexes', 'upperLagWeights'])
+
+def getFFTGCCTable(frequenciesInHz, tdoasInSeconds, upsamplingFactor=4, dtype=np.float64):
+    # GCC-PHAT evaluated as a zero-padded inverse rFFT over frequency, linearly interpolated onto the TDOA grid;
+    # frequencyWeights undo the inverse rFFT's 1/N scaling and doubling of interior bins so results match the explicit sum
+    numFrequencies = len(frequenciesInHz)
+    sampleRate = 2 * frequenciesInHz[-1]
+    fftSize = 2 * (numFrequencies - 1) * upsamplingFactor
+    
+    frequencyWeights = np.full(numFrequencies, 0.5 * fftSize, dtype)
+    frequencyWeights[0] = fftSize
+    if upsamplingFactor == 1:
+        frequencyWeights[-1] = fftSize
+    
+    lags = np.asarray(tdoasInSeconds, np.float64) * sampleRate * upsamplingFactor
+    if np.max(np.abs(lags)) >= fftSize // 2 - 1:
+        raise ValueError('getFFTGCCTable: TDOAs exceed the half window length')
+    lowerLags = np.floor(lags)
+    
+    return FFTGCCTable( fftSize, frequencyWeights, lowerLags.astype(np.intp) % fftSize, (lowerLags.astype(np.intp) + 1) % fftSize,
+                        (lags - lowerLags).astype(dtype) )
+
+class NumPyBackend(object):
+    name = 'numpy'
+    
+    def getSpectralCoherence(self, complexMixtureSpectrogram, out=None):
+        coherenceV = np.multiply( complexMixtureSpectrogram[0], complexMixtureSpectrogram[1].conj(), out=out )
+        coherenceV /= np.abs(coherenceV)
+        return coherenceV
+    
+    def getGCCPHAT(self, coherenceV, expJOmegaTau, out=None):
+        # real part of coherenceV[:, :, newaxis] * expJOmegaTau[:, newaxis], without the complex intermediate
+        if out is None:
+            out = np.empty( coherenceV.shape + expJOmegaTau.shape[-1:], np.result_type(coherenceV.real, expJOmegaTau.real) )
+        np.multiply( coherenceV.real[:, :, np.newaxis], expJOmegaTau.real[:, np.newaxis], out=out )
+        out -= coherenceV.imag[:, :, np.newaxis] * expJOmegaTau.imag[:, np.newaxis]
+        return out
+    
+    def getGCCNMF(self, realGCC, W, out=None):
+        numFrequencies, numTime, numTDOAs = realGCC.shape
+        numAtom = W.shape[1]
+        gccNMF = np.dot( W.T, realGCC.reshape(numFrequencies, -1), out=None if out is None else out.reshape(numAtom, -1) )
+        return gccNMF.reshape(numAtom, numTime, numTDOAs)
+    
+    def getGCCNMFFused(self, coherenceV, expJOmegaTauTable, W, out=None, maxBlockSize=MAX_GCC_BLOCK_SIZE):
+        # equivalent to getGCCNMF(getGCCPHAT(coherenceV, expJOmegaTau), W), projecting blocks of frames onto W
+        # as they are computed so that the full freq x time x TDOA GCC-PHAT is never held in memory
+        numFrequencies, numTime = coherenceV.shape
+        numAtom = W.shape[1]
+        numTDOAs = expJOmegaTauTable.shape[1]
+        dtype = np.result_type(W, expJOmegaTauTable, coherenceV.real)
+        if out is None:
+            out = np.empty( (numAtom, numTime, numTDOAs), dtype )
+        
+        numFramesPerBlock = int( np.clip(maxBlockSize // (numFrequencies * numTDOAs), 1, numTime) )
+        realGCCBuffer = np.empty(numFrequencies * numFramesPerBlock * numTDOAs, dtype)
+        imagGCCBuffer = np.empty(numFrequencies * numFramesPerBlock * numTDOAs, dtype)
+        for blockStart in range(0, numTime, numFramesPerBlock):
+            blockEnd = min(blockStart + numFramesPerBlock, numTime)
+            blockShape = (numFrequencies, blockEnd - blockStart, numTDOAs)
+            realGCC = realGCCBuffer[:np.prod(blockShape)].reshape(blockShape)
+            imagGCC = imagGCCBuffer[:np.prod(blockShape)].reshape(blockShape)
+            np.multiply( coherenceV.real[:, blockStart:blockEnd, np.newaxis], expJOmegaTauTable[:numFrequencies, np.newaxis], out=realGCC )
+            np.multiply( coherenceV.imag[:, blockStart:blockEnd, np.newaxis], expJOmegaTauTable[numFrequencies:, np.newaxis], out=imagGCC )
+            realGCC += imagGCC
+            out[:, blockStart:blockEnd] = np.dot( W.T, realGCC.reshape(numFrequencies, -1) ).reshape(numAtom, -1, numTDOAs)
+        return out
+    
+    def getAngularSpectrogram(self, coherenceV, expJOmegaTauTable, out=None):
+        # GCC-PHAT summed over frequency, TDOA x time
+        numFrequencies = coherenceV.shape[0]
+        angularSpectrogram = np.dot( expJOmegaTauTable[:numFrequencies].T, coherenceV.real, out=out )
+        angularSpectrogram += np.dot( expJOmegaTauTable[numFrequencies:].T, coherenceV.imag )
+        return angularSpectrogram
+    
+    def getAngularSpectrogramFFT(self, coherenceV, fftGCCTable, out=None):
+        crossCorrelation = irfft( coherenceV.T.conj() * fftGCCTable.frequencyWeights, n=fftGCCTable.fftSize, axis=-1 )
+        angularSpectrogram = crossCorrelation[:, fftGCCTable.lowerLagIndexes] * (1 - fftGCCTable.upperLagWeights)
+        angularSpectrogram += crossCorrelation[:, fftGCCTable.upperLagIndexes] * fftGCCTable.upperLagWeights
+        if out is None:
+            return angularSpectrogram.T
+        out[:] = angularSpectrogram.T
+        return out
+    
+    def getGCCNMFFFT(self, coherenceV, fftGCCTable, W, out=None, maxBlockSize=MAX_GCC_BLOCK_SIZE):
+        numFrequencies, numTime = coherenceV.shape
+        numAtom = W.shape[1]
+        numTDOAs = len(fftGCCTable.upperLagWeights)
+        if out is None:
+            out = np.empty( (numAtom, numTime, numTDOAs), np.result_type(W, fftGCCTable.frequencyWeights, coherenceV.real) )
+        
+        weightedW = W.T * fftGCCTable.frequencyWeights
+        numFramesPerBlock = int( np.clip(maxBlockSize // (fftGCCTable.fftSize * numAtom), 1, numTime) )
+        for blockStart in range(0, numTime, numFramesPerBlock):
+            blockEnd = min(blockStart + numFramesPerBlock, numTime)
+            weightedCoherence = weightedW * coherenceV[:, np.newaxis, blockStart:blockEnd].T.conj()
+            crossCorrelation = irfft(weightedCoherence, n=fftGCCTable.fftSize, axis=-1)
+            gccNMF = crossCorrelation[..., fftGCCTable.lowerLagIndexes] * (1 - fftGCCTable.upperLagWeights)
+            gccNMF += crossCorrelation[..., fftGCCTable.upperLagIndexes] * fftGCCTable.upperLagWeights
+            out[:, blockStart:blockEnd] = gccNMF.transpose(1, 0, 2)
+        return out
+    
+    def getTDOAWindowMask(self, gccNMF, targetMode, targetTDOAIndex, targetTDOAEpsilon, targetTDOABeta, targetTDOANoiseFloor, out=None):
+        tdoaDistances = np.abs( np.argmax(gccNMF, axis=-1) - np.float32(targetTDOAIndex), dtype=np.float32 )
+        if out is None:
+            out = np.empty(tdoaDistances.shape, np.float32)
+        
+        if targetMode == TARGET_MODE_BOXCAR:
+            np.less( tdoaDistances, targetTDOAEpsilon, out=out, casting='unsafe' )
+        elif targetMode == TARGET_MODE_WINDOW_FUNCTION:
+            np.divide( tdoaDistances, targetTDOAEpsilon, out=out )
+            np.power( out, targetTDOABeta, out=out )
+            np.negative( out, out=out )
+            np.exp( out, out=out )
+            out *= 1 / (1 + targetTDOANoiseFloor)
+            out += targetTDOANoiseFloor
+        else:
+            raise ValueError('%s backend: unsupported targetMode: %s' % (self.name, str(targetMode)))
+        return out
+    
+    def getTargetCoefficientMasks(self, targetTDOAGCCNMFs, numTargets):
+        # one-hot masks over targets of the (NaN-ignoring) argmax, built in a single comparison
+        nanArgMax = np.nanargmax(targetTDOAGCCNMFs, axis=0)
+        targetIndexes = np.arange(numTargets).reshape( (numTargets,) + (1,) * nanArgMax.ndim )
+        return np.equal( nanArgMax, targetIndexes ).astype(targetTDOAGCCNMFs.dtype)
+    
+    def getReconstruction(self, W, coefficients, out=None):
+        return np.matmul(W, coefficients, out=out)
+
+numbaKernels = None
+
+def getNumbaKernels():
+    global numbaKernels
+    if numbaKernels is not None:
+        return numbaKernels
+    
+    from numba import njit, prange
+    
+    @njit(parallel=True, cache=True, error_model='numpy')
+    def spectralCoherence(complexMixtureSpectrogram, out):
+        numFrequencies, numTime = out.shape
+        for frequencyIndex in prange(numFrequencies):
+            for timeIndex in range(numTime):
+                crossSpectrum = complexMixtureSpectrogram[0, frequencyIndex, timeIndex] * np.conj(complexMixtureSpectrogram[1, frequencyIndex, timeIndex])
+                out[frequencyIndex, timeIndex] = crossSpectrum / np.abs(crossSpectrum)
+    
+    @njit(parallel=True, cache=True)
+    def gccPHAT(coherenceV, expJOmegaTau, out):
+        numFrequencies, numTime, numTDOAs = out.shape
+        for frequencyIndex in prange(numFrequencies):
+            for timeIndex in range(numTime):
+                coherence = coherenceV[frequencyIndex, timeIndex]
+                for tdoaIndex in range(numTDOAs):
+                    expJOmega = expJOmegaTau[frequencyIndex, tdoaIndex]
+                    out[frequencyIndex, timeIndex, tdoaIndex] = coherence.real * expJOmega.real - coherence.imag * expJOmega.imag
+    
+    @njit(parallel=True, cache=True)
+    def tdoaWindowMask(gccNMF, boxcar, targetTDOAIndex, targetTDOAEpsilon, targetTDOABeta, targetTDOANoiseFloor, out):
+        numAtom, numTime, _ = gccNMF.shape
+        for atomIndex in prange(numAtom):
+            for timeIndex in range(numTime):
+                tdoaDistance = np.abs( np.argmax(gccNMF[atomIndex, timeIndex]) - targetTDOAIndex )
+                if boxcar:
+                    out[atomIndex, timeIndex] = 1.0 if tdoaDistance < targetTDOAEpsilon else 0.0
+                else:
+                    out[atomIndex, timeIndex] = np.exp( -(tdoaDistance / targetTDOAEpsilon) ** targetTDOABeta ) / (1 + targetTDOANoiseFloor) + targetTDOANoiseFloor
+    
+    numbaKernels = {'spectralCoherence': spectralCoherence,
+                    'gccPHAT': gccPHAT,
+                    'tdoaWindowMask': tdoaWindowMask}
+    return numbaKernels
+
+class NumbaBackend(NumPyBackend):
+    name = 'numba'
+    
+    def __init__(self):
+        super(NumbaBackend, self).__init__()
+        self.kernels = getNumbaKernels()
+    
+    def getSpectralCoherence(self, complexMixtureSpectrogram, out=None):
+        if out is None:
+            out = np.empty(complexMixtureSpectrogram.shape[1:], complexMixtureSpectrogram.dtype)
+        self.kernels['spectralCoherence'](complexMixtureSpectrogram, out)
+        return out
+    
+    def getGCCPHAT(self, coherenceV, expJOmegaTau, out=None):
+        if out is None:
+            out = np.empty( coherenceV.shape + expJOmegaTau.shape[-1:], np.result_type(coherenceV.real, expJOmegaTau.real) )
+        self.kernels['gccPHAT'](coherenceV, expJOmegaTau, out)
+        return out
+    
+    def getTDOAWindowMask(self, gccNMF, targetMode, targetTDOAIndex, targetTDOAEpsilon, targetTDOABeta, targetTDOANoiseFloor, out=None):
+        if targetMode not in (TARGET_MODE_BOXCAR, TARGET_MODE_WINDOW_FUNCTION):
+            raise ValueError('%s backend: unsupported targetMode: %s' % (self.name, str(targetMode)))
+        if out is None:
+            out = np.empty(gccNMF.shape[:-1], np.float32)
+        self.kernels['tdoaWindowMask'](gccNMF, targetMode == TARGET_MODE_BOXCAR, np.float32(targetTDOAIndex), np.float32(targetTDOAEpsilon),
+                                       np.float32(targetTDOABeta), np.float32(targetTDOANoiseFloor), out)
+        return out
+
+class TorchBackend(NumPyBackend):
+    name = 'torch'
+    
+    def __init__(self):
+        super(TorchBackend, self).__init__()
+        import torch
+        self.torch = torch
+    
+    def getSpectralCoherence(self, complexMixtureSpectrogram, out=None):
+        spectrogram = self.torch.from_numpy(complexMixtureSpectrogram)
+        coherenceV = self.torch.from_numpy(out) if out is not None else self.torch.empty(spectrogram.shape[1:], dtype=spectrogram.dtype)
+        self.torch.mul( spectrogram[0], spectrogram[1].conj(), out=coherenceV )
+        coherenceV /= coherenceV.abs()
+        return coherenceV.numpy()
+    
+    def fromReadOnlyNumPy(self, array):
+        # dictionaries may be read-only shared memory views, which torch only reads from here
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)
+            return self.torch.from_numpy(array)
+    
+    def getGCCPHAT(self, coherenceV, expJOmegaTau, out=None):
+        coherence = self.torch.from_numpy(coherenceV)
+        expJOmega = self.torch.from_numpy(expJOmegaTau)
+        if out is None:
+            out = np.empty( coherenceV.shape + expJOmegaTau.shape[-1:], np.result_type(coherenceV.real, expJOmegaTau.real) )
+        realGCC = self.torch.from_numpy(out)
+        self.torch.mul( coherence.real[:, :, None], expJOmega.real[:, None], out=realGCC )
+        realGCC.addcmul_( coherence.imag[:, :, None], expJOmega.imag[:, None], value=-1 )
+        return out
+    
+    def getGCCNMF(self, realGCC, W, out=None):
+        numFrequencies, numTime, numTDOAs = realGCC.shape
+        numAtom = W.shape[1]
+        gcc = self.torch.from_numpy( np.ascontiguousarray(realGCC) ).reshape(numFrequencies, -1)
+        weights = self.fromReadOnlyNumPy(W).to(gcc.dtype)
+        if out is None:
+            out = np.empty( (numAtom, numTime, numTDOAs), realGCC.dtype )
+        self.torch.matmul( weights.T, gcc, out=self.torch.from_numpy(out).view(numAtom, -1) )
+        return out
+    
+    def getReconstruction(self, W, coefficients, out=None):
+        coefficients = self.torch.from_numpy( np.ascontiguousarray(coefficients) )
+        weights = self.fromReadOnlyNumPy(W).to(coefficients.dtype)
+        if out is None:
+            return self.torch.matmul(weights, coefficients).numpy()
+        self.torch.matmul( weights, coefficients, out=self.torch.from_numpy(out) )
+        return out
+
+BACKENDS = OrderedDict( [(NumPyBackend.name, NumPyBackend),
+                         (NumbaBackend.name, NumbaBackend),
+                         (TorchBackend.name, TorchBackend)] )
+
+backends = {}
+
+def getBackend(backendName='numpy'):
+    # one shared instance per backend, so that repeated offline calls don't re-import or re-initialize it
+    backendName = backendName.lower()
+    if backendName not in BACKENDS:
+        raise ValueError( 'Unknown backend: %s (available: %s)' % (backendName, ', '.join(BACKENDS.keys())) )
+    if backendName not in backends:
+        backends[backendName] = BACKENDS[backendName]()
+    return backends[backendName]
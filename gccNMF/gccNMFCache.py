@@ -0,0 +1,134 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2016 Sean UN Wood
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: Sean UN Wood
+'''
+
+import os
+import json
+import logging
+import hashlib
+import numpy as np
+from glob import glob
+from os.path import join, exists, getsize, getmtime
+
+FILE_HASH_CHUNK_SIZE = 2**20
+
+fileHashes = {}
+
+def getFileHash(filePath):
+    # hashes are memoized per (path, size, mtime), so unchanged files are only read once per process
+    fileStat = os.stat(filePath)
+    fileHashKey = (os.path.abspath(filePath), fileStat.st_size, fileStat.st_mtime)
+    if fileHashKey not in fileHashes:
+        fileHash = hashlib.sha256()
+        with open(filePath, 'rb') as inputFile:
+            for chunk in iter(lambda: inputFile.read(FILE_HASH_CHUNK_SIZE), b''):
+                fileHash.update(chunk)
+        fileHashes[fileHashKey] = fileHash.hexdigest()
+    return fileHashes[fileHashKey]
+
+def getWindowHash(windowFunction, windowSize):
+    # the window's samples identify it, a name does not (partials, lambdas and arrays have none, or a misleading one)
+    window = windowFunction(windowSize) if callable(windowFunction) else windowFunction
+    return hashlib.sha256( np.ascontiguousarray(window, np.float64).tobytes() ).hexdigest()
+
+def getCacheKey(inputHash, stageName, parameters):
+    keyString = json.dumps( [inputHash, stageName, parameters], sort_keys=True, default=str )
+    return stageName + '_' + hashlib.sha256( keyString.encode('utf-8') ).hexdigest()
+
+class ArrayCache(object):
+    # On-disk cache of named numpy arrays, one .npy file per array, loaded back memory-mapped.
+    # Entries are evicted least recently used first (by file mtime, refreshed on every hit) once the cache exceeds maxSizeInBytes.
+    def __init__(self, cacheDir, maxSizeInBytes=None):
+        self.cacheDir = cacheDir
+        self.maxSizeInBytes = maxSizeInBytes
+        if not exists(cacheDir):
+            os.makedirs(cacheDir)
+    
+    def getArrayPath(self, key, arrayName):
+        return join(self.cacheDir, '%s.%s.npy' % (key, arrayName))
+    
+    def get(self, key, arrayNames):
+        arrayPaths = [self.getArrayPath(key, arrayName) for arrayName in arrayNames]
+        if not all( [exists(arrayPath) for arrayPath in arrayPaths] ):
+            return None
+        try:
+            arrays = [np.load(arrayPath, mmap_mode='r') for arrayPath in arrayPaths]
+        except (IOError, ValueError):
+            logging.warning('ArrayCache: could not load %s, recomputing' % key)
+            return None
+        for arrayPath in arrayPaths:
+            os.utime(arrayPath, None)
+        return arrays
+    
+    def put(self, key, arrayNames, arrays):
+        for arrayName, array in zip(arrayNames, arrays):
+            arrayPath = self.getArrayPath(key, arrayName)
+            # written under a temporary name then renamed, so readers never see a partially written array
+            temporaryPath = arrayPath + '.%d.tmp' % os.getpid()
+            try:
+                with open(temporaryPath, 'wb') as arrayFile:
+                    np.save(arrayFile, np.asarray(array))
+                os.replace(temporaryPath, arrayPath)
+            except:
+                if exists(temporaryPath):
+                    os.remove(temporaryPath)
+                raise
+        self.evict()
+    
+    def getOrCompute(self, key, arrayNames, computeArrays):
+        arrays = self.get(key, arrayNames)
+        if arrays is not None:
+            logging.info('ArrayCache: hit %s' % key)
+            return arrays
+        logging.info('ArrayCache: miss %s' % key)
+        arrays = computeArrays()
+        self.put(key, arrayNames, arrays)
+        return arrays
+    
+    def getSizeInBytes(self):
+        return sum( [getsize(arrayPath) for arrayPath in glob( join(self.cacheDir, '*.npy') )] )
+    
+    def evict(self):
+        if self.maxSizeInBytes is None:
+            return
+        entries = {}
+        for arrayPath in glob( join(self.cacheDir, '*.npy') ):
+            key = os.path.basename(arrayPath).split('.')[0]
+            entrySize, entryTime = entries.get(key, (0, 0))
+            entries[key] = (entrySize + getsize(arrayPath), max(entryTime, getmtime(arrayPath)))
+        
+        totalSize = sum( [entrySize for entrySize, _ in entries.values()] )
+        for key, (entrySize, _) in sorted(entries.items(), key=lambda entry: entry[1][1]):
+            if totalSize <= self.maxSizeInBytes:
+                break
+            logging.info('ArrayCache: evicting %s (%d bytes)' % (key, entrySize))
+            for arrayPath in glob( join(self.cacheDir, key + '.*.npy') ):
+                os.remove(arrayPath)
+            totalSize -= entrySize
+
+def getCachedArrays(cache, inputHash, stageName, parameters, arrayNames, computeArrays):
+    if cache is None:
+        return computeArrays()
+    return cache.getOrCompute( getCacheKey(inputHash, stageName, parameters), arrayNames, computeArrays )
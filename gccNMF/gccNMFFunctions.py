@@ -24,18 +24,25 @@ SOFTWARE.
 @author: Sean UN Wood
 '''
 
-from numpy.random import random, seed
+from numpy.random import random, seed, RandomState
 from numpy import hanning, array, squeeze, arange, concatenate, sqrt, sum, dot, newaxis, linspace, \
     exp, outer, pi, einsum, argsort, mean, hsplit, zeros, empty, min, max, isnan, all, nanargmax, empty_like, \
-    where, zeros_like, angle, arctan2, int16, float32, complex64, argmax, take
+    where, zeros_like, angle, arctan2, int16, float32, float64, complex64, argmax, take, ceil, divide, add, log, absolute, reciprocal, ones, multiply
 from scipy.signal import argrelmax
 from os.path import basename, join
+from time import time
+from multiprocessing.pool import ThreadPool
+from threading import Thread
+from queue import Queue
 import logging
 
-from gccNMF.librosaSTFT import stft, istft
-from gccNMF.wavfile import wavread, wavwrite
+from gccNMF.batchSTFT import batchSTFT, batchISTFT
+from gccNMF.wavfile import wavread, wavwrite, WavReader, WavWriter, CLIP_PROTECTION_LIMITER
+from gccNMF.defs import GCC_PHAT_MODE_EXPLICIT, GCC_PHAT_MODE_FFT
+from gccNMF.gccNMFBackends import getBackend, getExpJOmegaTauTable, getFFTGCCTable
 
 SPEED_OF_SOUND_IN_METRES_PER_SECOND = 340.29
+DEFAULT_NMF_OBJECTIVE_INTERVAL = 10
 
 def getMixtureFileName(mixtureFileNamePrefix):
     return mixtureFileNamePrefix + '_mix.wav'
@@ -47,6 +54,9 @@ def getSourceEstimateFileName(mixtureFileNamePrefix, targetIndex):
 def loadMixtureSignal(mixtureFileName):
     return wavread(mixtureFileName)
 
+def getSampleRate(mixtureFileName):
+    return WavReader(mixtureFileName).sampleRate
+
 def getMaxTDOA(microphoneSeparationInMetres):
     return microphoneSeparationInMetres / SPEED_OF_SOUND_IN_METRES_PER_SECOND
 
@@ -59,37 +69,317 @@ def getFrequenciesInHz(sampleRate, numFrequencies):
     return linspace(0, sampleRate/2, numFrequencies)
 
 def computeComplexMixtureSpectrogram(stereoSamples, windowSize, hopSize, windowFunction, fftSize=None):
-    if fftSize is None:
-        fftSize = windowSize
+    return batchSTFT(stereoSamples[:2], windowSize, hopSize, windowFunction, fftSize)
+
+def getComplexMixtureSpectrogramBlocks(mixtureFileName, windowSize, hopSize, windowFunction, numFramesPerBlock, fftSize=None):
+    # decodes the memory-mapped samples for numFramesPerBlock frames at a time into a reused buffer, so memory is independent of file length
+    wavReader = WavReader(mixtureFileName, channelIndexes=[0, 1])
+    numFrames = 1 + (len(wavReader) - windowSize) // hopSize
+    blockSamples = empty( (2, (numFramesPerBlock - 1) * hopSize + windowSize), float32 )
+    for startFrameIndex in range(0, numFrames, numFramesPerBlock):
+        numBlockFrames = min( [numFramesPerBlock, numFrames - startFrameIndex] )
+        numBlockSamples = (numBlockFrames - 1) * hopSize + windowSize
+        wavReader.read(startFrameIndex * hopSize, numBlockSamples, out=blockSamples[:, :numBlockSamples])
+        yield computeComplexMixtureSpectrogram(blockSamples[:, :numBlockSamples], windowSize, hopSize, windowFunction, fftSize)
 
-    complexMixtureSpectrograms = array( [stft(squeeze(stereoSamples[channelIndex]).copy(), windowSize, hopSize, fftSize, hanning, center=False)
-                                         for channelIndex in arange(2)] )
-    return complexMixtureSpectrograms
+def getSpectralCoherenceV(complexMixtureSpectrogram, backendName='numpy'):
+    return getBackend(backendName).getSpectralCoherence(complexMixtureSpectrogram)
 
-def performKLNMF(V, dictionarySize, numIterations, sparsityAlpha, epsilon=1e-16, seedValue=0):
+def getNMFObjectiveInterval(tolerance, objectiveInterval):
+    # evaluating the objective costs about as much as a half iteration, so unless asked for it is only done when checking convergence
+    if objectiveInterval is None:
+        return DEFAULT_NMF_OBJECTIVE_INTERVAL if tolerance is not None else 0
+    return objectiveInterval
+
+def performKLNMF(V, dictionarySize, numIterations, sparsityAlpha, epsilon=1e-16, seedValue=0, tolerance=None, objectiveInterval=None, numThreads=1):
+    W, H, _ = performKLNMFWithStats(V, dictionarySize, numIterations, sparsityAlpha, epsilon, seedValue, tolerance, objectiveInterval, numThreads)
+    return W, H
+
+def performKLNMFWithStats(V, dictionarySize, maxNumIterations, sparsityAlpha, epsilon=1e-16, seedValue=0, tolerance=None, objectiveInterval=None, numThreads=1):
+    objectiveInterval = getNMFObjectiveInterval(tolerance, objectiveInterval)
+    if numThreads > 1:
+        return performKLNMFParallel(V, dictionarySize, maxNumIterations, sparsityAlpha, epsilon, seedValue, tolerance, objectiveInterval, numThreads)
+    
+    startTime = time()
     seed(seedValue)
     
     W = random( (V.shape[0], dictionarySize) ).astype(float32) + epsilon
     H = random( (dictionarySize, V.shape[1]) ).astype(float32) + epsilon
+    
+    # preallocated buffers, updated in place: one W.H product per half-step, overwritten by V / (W.H)
+    ratio = empty( V.shape, W.dtype )
+    hNumerator = empty_like(H)
+    wNumerator = empty_like(W)
+    atomSums = empty(dictionarySize, W.dtype)
+    objectiveBuffer = empty_like(ratio) if objectiveInterval else None
+    sumV = sum(V, dtype=float64)
+    
+    objectives = []
+    converged = False
+    iterationIndex = -1
+    for iterationIndex in range(maxNumIterations):
+        dot(W, H, out=ratio)
+        divide(V, ratio, out=ratio)
+        dot(W.T, ratio, out=hNumerator)
+        sum(W, axis=0, out=atomSums)
+        atomSums += sparsityAlpha + epsilon
+        hNumerator /= atomSums[:, newaxis]
+        H *= hNumerator
+        
+        dot(W, H, out=ratio)
+        divide(V, ratio, out=ratio)
+        if objectiveBuffer is not None and (iterationIndex + 1) % objectiveInterval == 0:
+            objectives.append( getKLDivergence(V, ratio, W, H, sumV, epsilon, objectiveBuffer) )
+            if tolerance is not None and len(objectives) > 1 and abs(objectives[-2] - objectives[-1]) <= tolerance * abs(objectives[-2]):
+                converged = True
+        dot(ratio, H.T, out=wNumerator)
+        sum(H, axis=1, out=atomSums)
+        wNumerator /= atomSums
+        W *= wNumerator
+        
+        einsum('fk,fk->k', W, W, out=atomSums)
+        sqrt(atomSums, out=atomSums)
+        W /= atomSums
+        H *= atomSums[:, newaxis]
+        
+        if converged:
+            break
+    
+    totalTime = time() - startTime
+    numIterations = iterationIndex + 1
+    stats = {'numIterations': numIterations,
+             'converged': converged,
+             'objectives': objectives,
+             'totalTime': totalTime,
+             'timePerIteration': totalTime / numIterations if numIterations else 0.0,
+             'numThreads': 1}
+    logging.info( 'performKLNMF: %d iterations in %.2f s (converged: %s)' % (numIterations, totalTime, str(converged)) )
+    return W, H, stats
 
-    for iterationIndex in range(numIterations):
-        H *= dot( W.T, V / dot( W, H ) ) / ( sum(W, axis=0)[:, newaxis] + sparsityAlpha + epsilon )
-        W *= dot( V / dot( W, H ), H.T ) / sum(H, axis=1)
+def performKLNMFParallel(V, dictionarySize, maxNumIterations, sparsityAlpha, epsilon=1e-16, seedValue=0, tolerance=None, objectiveInterval=None, numThreads=2):
+    # H columns are partitioned across threads sharing V, W and H; each thread updates its own H block and returns
+    # its contribution to the W update statistics, which are summed before updating W. The W normalization is folded
+    # into the next H update, so results match performKLNMFWithStats up to floating point summation order.
+    objectiveInterval = getNMFObjectiveInterval(tolerance, objectiveInterval)
+    startTime = time()
+    seed(seedValue)
+    
+    W = random( (V.shape[0], dictionarySize) ).astype(float32) + epsilon
+    H = random( (dictionarySize, V.shape[1]) ).astype(float32) + epsilon
+    
+    numThreads = int( min([numThreads, V.shape[1]]) )
+    blockEdges = linspace(0, V.shape[1], numThreads + 1).astype(int)
+    blockBuffers = [ {'V': V[:, start:end],
+                      'H': H[:, start:end],
+                      'ratio': empty( (V.shape[0], end - start), W.dtype ),
+                      'hNumerator': empty( (dictionarySize, end - start), W.dtype ),
+                      'wNumerator': empty_like(W),
+                      'hSums': empty(dictionarySize, W.dtype),
+                      'objectiveBuffer': empty( (V.shape[0], end - start), W.dtype ) if objectiveInterval else None}
+                     for start, end in zip(blockEdges[:-1], blockEdges[1:]) ]
+    wSums = empty(dictionarySize, W.dtype)
+    atomNorms = zeros(dictionarySize, W.dtype) + 1
+    wNumerator = empty_like(W)
+    hSums = empty_like(wSums)
+    sumV = sum(V, dtype=float64)
+    
+    def updateBlock(blockArgs):
+        blockBuffer, computeObjective = blockArgs
+        blockV, blockH, ratio, hNumerator = blockBuffer['V'], blockBuffer['H'], blockBuffer['ratio'], blockBuffer['hNumerator']
+        blockH *= atomNorms[:, newaxis]
         
-        dictionaryAtomNorms = sqrt( sum(W**2, 0 ) )
-        W /= dictionaryAtomNorms
-        H *= dictionaryAtomNorms[:, newaxis]
+        dot(W, blockH, out=ratio)
+        divide(blockV, ratio, out=ratio)
+        dot(W.T, ratio, out=hNumerator)
+        hNumerator /= wSums[:, newaxis]
+        blockH *= hNumerator
         
-    return W, H
+        dot(W, blockH, out=ratio)
+        divide(blockV, ratio, out=ratio)
+        dot(ratio, blockH.T, out=blockBuffer['wNumerator'])
+        sum(blockH, axis=1, out=blockBuffer['hSums'])
+        
+        if not computeObjective:
+            return 0.0
+        objectiveBuffer = blockBuffer['objectiveBuffer']
+        add(ratio, epsilon, out=objectiveBuffer)
+        log(objectiveBuffer, out=objectiveBuffer)
+        objectiveBuffer *= blockV
+        return sum(objectiveBuffer, dtype=float64)
+    
+    threadPool = ThreadPool(numThreads)
+    objectives = []
+    converged = False
+    iterationIndex = -1
+    try:
+        for iterationIndex in range(maxNumIterations):
+            sum(W, axis=0, out=wSums)
+            wSums += sparsityAlpha + epsilon
+            
+            computeObjective = objectiveInterval and (iterationIndex + 1) % objectiveInterval == 0
+            blockObjectives = threadPool.map( updateBlock, [(blockBuffer, computeObjective) for blockBuffer in blockBuffers] )
+            
+            wNumerator[:] = blockBuffers[0]['wNumerator']
+            hSums[:] = blockBuffers[0]['hSums']
+            for blockBuffer in blockBuffers[1:]:
+                wNumerator += blockBuffer['wNumerator']
+                hSums += blockBuffer['hSums']
+            
+            if computeObjective:
+                objectives.append( float( sum(blockObjectives) - sumV + dot( sum(W, axis=0, dtype=float64), hSums.astype(float64) ) ) )
+                if tolerance is not None and len(objectives) > 1 and abs(objectives[-2] - objectives[-1]) <= tolerance * abs(objectives[-2]):
+                    converged = True
+            
+            wNumerator /= hSums
+            W *= wNumerator
+            
+            einsum('fk,fk->k', W, W, out=atomNorms)
+            sqrt(atomNorms, out=atomNorms)
+            W /= atomNorms
+            
+            if converged:
+                break
+    finally:
+        threadPool.close()
+        threadPool.join()
+    H *= atomNorms[:, newaxis]
+    
+    totalTime = time() - startTime
+    numIterations = iterationIndex + 1
+    stats = {'numIterations': numIterations,
+             'converged': converged,
+             'objectives': objectives,
+             'totalTime': totalTime,
+             'timePerIteration': totalTime / numIterations if numIterations else 0.0,
+             'numThreads': numThreads}
+    logging.info( 'performKLNMF: %d iterations in %.2f s on %d threads (converged: %s)' % (numIterations, totalTime, numThreads, str(converged)) )
+    return W, H, stats
+
+def performOnlineKLNMF(getVBlocks, dictionarySize, numHIterations=10, sparsityAlpha=0, epsilon=1e-16, seedValue=0, forgettingFactor=1.0, numPasses=1):
+    # getVBlocks() returns an iterable of V blocks (numFrequencies x numFramesPerBlock), e.g. streamed from disk.
+    # H is solved per block with W fixed, then W is set from the accumulated sufficient statistics
+    # A = sum W * ((V / WH) . H^T) and B = sum H, following the online KL-NMF multiplicative update.
+    startTime = time()
+    randomState = RandomState(seedValue)
+    
+    W = None
+    numBlocks = 0
+    for passIndex in range(numPasses):
+        for V in getVBlocks():
+            if W is None:
+                W = randomState.random_sample( (V.shape[0], dictionarySize) ).astype(float32) + epsilon
+                W /= sqrt( sum(W**2, 0) )
+                A = zeros_like(W)
+                B = zeros(dictionarySize, W.dtype)
+            
+            H = randomState.random_sample( (dictionarySize, V.shape[1]) ).astype(float32) + epsilon
+            H = performKLNMFHUpdates(V, W, H, numHIterations, sparsityAlpha, epsilon)
+            
+            A *= forgettingFactor
+            A += W * dot( V / ( dot(W, H) + epsilon ), H.T )
+            B *= forgettingFactor
+            B += sum(H, axis=1)
+            divide(A, B + epsilon, out=W)
+            
+            # W / n with H * n leaves the statistic A unchanged and scales B by n
+            dictionaryAtomNorms = sqrt( sum(W**2, 0) )
+            W /= dictionaryAtomNorms
+            B *= dictionaryAtomNorms
+            numBlocks += 1
+    
+    if W is None:
+        raise ValueError('performOnlineKLNMF: no V blocks provided')
+    
+    totalTime = time() - startTime
+    stats = {'numBlocks': numBlocks,
+             'numPasses': numPasses,
+             'totalTime': totalTime,
+             'timePerBlock': totalTime / numBlocks}
+    logging.info( 'performOnlineKLNMF: %d blocks in %.2f s' % (numBlocks, totalTime) )
+    return W, stats
+
+def performKLNMFHUpdates(V, W, H, numIterations, sparsityAlpha, epsilon=1e-16, tolerance=None, ratio=None, hNumerator=None):
+    # multiplicative updates of H (in place, warm started from the given H) for a fixed dictionary W, over all columns of V at once.
+    # Stops early once an iteration changes H by less than tolerance, as sum(|H_new - H_old|) / sum(H_new).
+    # ratio (V.shape) and hNumerator (H.shape) may be passed in to avoid allocation in realtime use.
+    ratio = empty( V.shape, W.dtype ) if ratio is None else ratio
+    hNumerator = empty_like(H) if hNumerator is None else hNumerator
+    wSums = sum(W, axis=0)[:, newaxis] + sparsityAlpha + epsilon
+    for iterationIndex in range(numIterations):
+        # epsilon keeps silent columns (zero V, hence zero H after one update) finite
+        dot(W, H, out=ratio)
+        ratio += epsilon
+        divide(V, ratio, out=ratio)
+        dot(W.T, ratio, out=hNumerator)
+        hNumerator /= wSums
+        H *= hNumerator
+        
+        if tolerance is not None:
+            # |H_new - H_old| = H_new * |1 - 1 / hNumerator|
+            hNumerator += epsilon
+            reciprocal(hNumerator, out=hNumerator)
+            hNumerator -= 1
+            absolute(hNumerator, out=hNumerator)
+            hNumerator *= H
+            if sum(hNumerator) <= tolerance * sum(H):
+                break
+    return H
+
+def getKLNMFActivations(V, W, numIterations, sparsityAlpha, epsilon=1e-16, tolerance=None, seedValue=0):
+    H = RandomState(seedValue).random_sample( (W.shape[1], V.shape[1]) ).astype(W.dtype) + epsilon
+    return performKLNMFHUpdates(V, W, H, numIterations, sparsityAlpha, epsilon, tolerance)
+
+def getKLDivergence(V, ratio, W, H, sumV, epsilon, buffer):
+    # generalized KL divergence D(V || WH) from ratio = V / WH, using sum(WH) = sum(W, 0) . sum(H, 1)
+    add(ratio, epsilon, out=buffer)
+    log(buffer, out=buffer)
+    buffer *= V
+    return float( sum(buffer, dtype=float64) - sumV + dot( sum(W, axis=0, dtype=float64), sum(H, axis=1, dtype=float64) ) )
 
-def getAngularSpectrogram(spectralCoherenceV, frequenciesInHz, microphoneSeparationInMetres, numTDOAs):
+def getAngularSpectrogram(spectralCoherenceV, frequenciesInHz, microphoneSeparationInMetres, numTDOAs, backendName='numpy', maxMemoryInBytes=None, numThreads=1,
+                          gccPHATMode=GCC_PHAT_MODE_EXPLICIT, upsamplingFactor=4):
     numFrequencies, numTime = spectralCoherenceV.shape
     
     tdoasInSeconds = getTDOAsInSeconds(microphoneSeparationInMetres, numTDOAs)
-    expJOmega = exp( outer(frequenciesInHz, -(2j * pi) * tdoasInSeconds) )
+    backend = getBackend(backendName)
+    if gccPHATMode == GCC_PHAT_MODE_FFT:
+        gccPHATTable = getFFTGCCTable(frequenciesInHz, tdoasInSeconds, upsamplingFactor)
+        getBlockAngularSpectrogram = backend.getAngularSpectrogramFFT
+        bytesPerFrame = (numFrequencies * 2 + gccPHATTable.fftSize + 2 * numTDOAs) * gccPHATTable.frequencyWeights.itemsize
+    elif gccPHATMode == GCC_PHAT_MODE_EXPLICIT:
+        expJOmega = exp( outer(frequenciesInHz, -(2j * pi) * tdoasInSeconds) )
+        gccPHATTable = getExpJOmegaTauTable(expJOmega)
+        getBlockAngularSpectrogram = backend.getAngularSpectrogram
+        bytesPerFrame = 2 * numFrequencies * spectralCoherenceV.real.itemsize + 2 * numTDOAs * gccPHATTable.itemsize
+    else:
+        raise ValueError('getAngularSpectrogram: unknown gccPHATMode: %s' % gccPHATMode)
+    
+    if maxMemoryInBytes is None and numThreads == 1:
+        return getBlockAngularSpectrogram(spectralCoherenceV, gccPHATTable)
+    
+    # walk the time axis in blocks, bounding the per-block temporaries to maxMemoryInBytes
+    if maxMemoryInBytes is None:
+        numFramesPerBlock = int( ceil(numTime / float(numThreads)) )
+    else:
+        numFramesPerBlock = int( max( [1, maxMemoryInBytes // (numThreads * bytesPerFrame)] ) )
+    
+    angularSpectrogram = empty( (numTDOAs, numTime), float64 )
+    def processBlock(blockStart):
+        blockEnd = min( [blockStart + numFramesPerBlock, numTime] )
+        angularSpectrogram[:, blockStart:blockEnd] = getBlockAngularSpectrogram(spectralCoherenceV[:, blockStart:blockEnd], gccPHATTable)
     
-    FREQ, TIME, TDOA = range(3)
-    return sum( einsum( spectralCoherenceV, [FREQ, TIME], expJOmega, [FREQ, TDOA], [TDOA, FREQ, TIME] ).real, axis=1 )
+    blockStarts = range(0, numTime, numFramesPerBlock)
+    if numThreads > 1:
+        threadPool = ThreadPool(numThreads)
+        try:
+            threadPool.map(processBlock, blockStarts)
+        finally:
+            threadPool.close()
+            threadPool.join()
+    else:
+        for blockStart in blockStarts:
+            processBlock(blockStart)
+    return angularSpectrogram
     
 def estimateTargetTDOAIndexesFromAngularSpectrum(angularSpectrum, microphoneSeparationInMetres, numTDOAs, numSources):
     peakIndexes = argrelmax(angularSpectrum)[0]
@@ -100,9 +390,10 @@ def estimateTargetTDOAIndexesFromAngularSpectrum(angularSpectrum, microphoneSepa
         sourcePeakIndexes = peakIndexes[ argsort(angularSpectrum[peakIndexes])[-numSources:] ]
         
         if len(sourcePeakIndexes) != numSources:
-            logging.info('didn''t find enough peaks in ITDFunctions.estimateTargetTDOAIndexesFromAngularSpectrum... aborting' )
-            os._exit(1)
+            raise ValueError( 'estimateTargetTDOAIndexesFromAngularSpectrum: found %d peaks in the angular spectrum, %d sources requested' % (len(sourcePeakIndexes), numSources) )
     else:
+        # only needed when the number of sources is estimated
+        from sklearn.cluster import KMeans
         kMeans = KMeans(n_clusters=2, n_init=10)
         kMeans.fit(angularSpectrum[peakIndexes][:, newaxis])
         sourcesClusterIndex = argmax(kMeans.cluster_centers_)
@@ -115,55 +406,134 @@ def estimateTargetTDOAIndexesFromAngularSpectrum(angularSpectrum, microphoneSepa
     logging.info( 'Found target TDOAs: %s' % str(sourcePeakIndexes) )
     return sourcePeakIndexes
 
-def getTargetTDOAGCCNMFs(coherenceV, microphoneSeparationInMetres, numTDOAs, frequenciesInHz, targetTDOAIndexes, W, stereoH):
-    numTargets = len(targetTDOAIndexes)
+def getTargetTDOAGCCNMFs(coherenceV, microphoneSeparationInMetres, numTDOAs, frequenciesInHz, targetTDOAIndexes, W, stereoH, backendName='numpy'):
+    backend = getBackend(backendName)
     
     hypothesisTDOAs = getTDOAsInSeconds(microphoneSeparationInMetres, numTDOAs)
-    
-    numFrequencies, numTime = coherenceV.shape
-    numChannels, numAtom, numTime = stereoH.shape
     normalizedW = W #/ sqrt( sum(W**2, axis=1, keepdims=True) )
     
-    expJOmegaTau = exp( outer(frequenciesInHz, -(2j * pi) * hypothesisTDOAs) )
-
-    TIME, FREQ, TDOA, ATOM = range(4)
-    targetTDOAGCCNMFs = empty( (numTargets, numAtom, numTime), float32 )
-    for targetIndex, targetTDOAIndex in enumerate(targetTDOAIndexes):
-        gccChunk = einsum( coherenceV, [FREQ, TIME], expJOmegaTau[:, targetTDOAIndex], [FREQ], [FREQ, TIME] )
-        targetTDOAGCCNMFs[targetIndex] = einsum( normalizedW, [FREQ, ATOM], gccChunk, [FREQ, TIME], [ATOM, TIME] ).real
+    # all targets at once: the fused kernel projects blocks of frames onto W as their GCC-PHAT is computed
+    targetExpJOmegaTau = exp( outer(frequenciesInHz, -(2j * pi) * hypothesisTDOAs[targetTDOAIndexes]) )
+    targetTDOAGCCNMFs = backend.getGCCNMFFused( coherenceV, getExpJOmegaTauTable(targetExpJOmegaTau), normalizedW )
+    return targetTDOAGCCNMFs.transpose(2, 0, 1).astype(float32)
     
-    return targetTDOAGCCNMFs
+def getTargetCoefficientMasks(targetTDOAGCCNMFs, numTargets, backendName='numpy'):
+    return getBackend(backendName).getTargetCoefficientMasks(targetTDOAGCCNMFs, numTargets)
     
-def getTargetCoefficientMasks(targetTDOAGCCNMFs, numTargets):
-    nanArgMax = nanargmax(targetTDOAGCCNMFs, axis=0)
+def getTargetSpectrogramEstimates(targetCoefficientMasks, complexMixtureSpectrogram, W, stereoH, backendName='numpy'):
+    # targets x channels x freq x time magnitudes from a single stacked GEMM, with the mixture phase applied as X / |X| in complex64
+    targetMagnitudeEstimates = getBackend(backendName).getReconstruction( W, stereoH[newaxis] * targetCoefficientMasks[:, newaxis] )
     
-    targetCoefficientMasks = zeros_like(targetTDOAGCCNMFs)
-    for targetIndex in range(numTargets):
-        targetCoefficientMasks[targetIndex][where(nanArgMax==targetIndex)] = 1
-    return targetCoefficientMasks
+    mixtureMagnitude = absolute(complexMixtureSpectrogram)
+    mixturePhase = ones(complexMixtureSpectrogram.shape, complex64)
+    divide( complexMixtureSpectrogram, mixtureMagnitude, out=mixturePhase, where=mixtureMagnitude > 0 )
     
-def getTargetSpectrogramEstimates(targetCoefficientMasks, complexMixtureSpectrogram, W, stereoH):
-    numTargets = targetCoefficientMasks.shape[0]
-    targetSpectrogramEstimates = zeros( (numTargets,) + complexMixtureSpectrogram.shape, complex64 )
-    for targetIndex, targetCoefficientMask in enumerate(targetCoefficientMasks):
-        for channelIndex, coefficients in enumerate(stereoH):
-            targetSpectrogramEstimates[targetIndex, channelIndex] = dot(W, coefficients * targetCoefficientMask)
-    return targetSpectrogramEstimates * exp( 1j * angle(complexMixtureSpectrogram) )
+    targetSpectrogramEstimates = empty(targetMagnitudeEstimates.shape, complex64)
+    multiply( targetMagnitudeEstimates, mixturePhase, out=targetSpectrogramEstimates )
+    return targetSpectrogramEstimates
 
 def getTargetSignalEstimates(targetSpectrogramEstimates, windowSize, hopSize, windowFunction):
     numTargets, numChannels, numFreq, numTime = targetSpectrogramEstimates.shape
+    fftSize = 2 * (numFreq - 1)
     stftGainFactor = hopSize / float(windowSize) * 2
     
-    targetSignalEstimates = []
-    for targetIndex in range(numTargets):
-        currentSignalEstimates = []
-        for channelIndex in range(numChannels):
-            currentSignalEstimates.append( istft(targetSpectrogramEstimates[targetIndex, channelIndex], hopSize, windowSize, windowFunction) )
-        targetSignalEstimates.append(currentSignalEstimates)
-    return array(targetSignalEstimates) * stftGainFactor
+    # all targets and channels at once, trimmed by fftSize // 2 at both ends as with librosaSTFT.istft(..., center=True)
+    targetSignalEstimates = batchISTFT(targetSpectrogramEstimates, windowSize, hopSize, windowFunction)[..., fftSize // 2 : -(fftSize // 2)]
+    targetSignalEstimates *= stftGainFactor
+    return targetSignalEstimates
+
+def getMeanAngularSpectrumFromBlocks(complexMixtureSpectrogramBlocks, frequenciesInHz, microphoneSeparationInMetres, numTDOAs, backendName='numpy'):
+    angularSpectrumSum = zeros(numTDOAs, float64)
+    numTime = 0
+    for complexMixtureSpectrogramBlock in complexMixtureSpectrogramBlocks:
+        spectralCoherenceV = getSpectralCoherenceV(complexMixtureSpectrogramBlock, backendName)
+        angularSpectrumSum += sum( getAngularSpectrogram(spectralCoherenceV, frequenciesInHz, microphoneSeparationInMetres, numTDOAs, backendName), axis=-1 )
+        numTime += spectralCoherenceV.shape[-1]
+    return angularSpectrumSum / numTime
+
+def getTargetSpectrogramEstimateBlocks(complexMixtureSpectrogramBlocks, frequenciesInHz, microphoneSeparationInMetres, numTDOAs, targetTDOAIndexes, W,
+                                       numHIterations, sparsityAlpha, hTolerance=None, backendName='numpy'):
+    # per block: activations for the fixed W, then the GCC-NMF target masks and reconstruction, all frame-local
+    numTargets = len(targetTDOAIndexes)
+    for complexMixtureSpectrogramBlock in complexMixtureSpectrogramBlocks:
+        numChannels = complexMixtureSpectrogramBlock.shape[0]
+        V = concatenate( abs(complexMixtureSpectrogramBlock), axis=-1 )
+        stereoH = array( hsplit( getKLNMFActivations(V, W, numHIterations, sparsityAlpha, tolerance=hTolerance), numChannels ) )
+        
+        spectralCoherenceV = getSpectralCoherenceV(complexMixtureSpectrogramBlock, backendName)
+        targetTDOAGCCNMFs = getTargetTDOAGCCNMFs(spectralCoherenceV, microphoneSeparationInMetres, numTDOAs, frequenciesInHz, targetTDOAIndexes, W, stereoH, backendName)
+        targetCoefficientMasks = getTargetCoefficientMasks(targetTDOAGCCNMFs, numTargets, backendName)
+        yield getTargetSpectrogramEstimates(targetCoefficientMasks, complexMixtureSpectrogramBlock, W, stereoH, backendName)
+
+def getTargetSignalEstimateBlocks(targetSpectrogramEstimateBlocks, windowSize, hopSize, windowFunction):
+    # streaming getTargetSignalEstimates: the last (fftSize - hopSize) samples of each block's overlap-add are carried into the next block,
+    # and fftSize // 2 samples are trimmed at both ends of the whole signal, so the concatenated blocks equal the whole-file result
+    stftGainFactor = hopSize / float(windowSize) * 2
+    overlapSamples = None
+    numSamplesToTrim = None
+    for targetSpectrogramEstimateBlock in targetSpectrogramEstimateBlocks:
+        fftSize = 2 * (targetSpectrogramEstimateBlock.shape[-2] - 1)
+        numBlockFrames = targetSpectrogramEstimateBlock.shape[-1]
+        if numSamplesToTrim is None:
+            numSamplesToTrim = fftSize // 2
+        
+        blockSamples = batchISTFT(targetSpectrogramEstimateBlock, windowSize, hopSize, windowFunction)
+        if overlapSamples is not None:
+            blockSamples[..., :overlapSamples.shape[-1]] += overlapSamples
+        overlapSamples = blockSamples[..., numBlockFrames * hopSize:].copy()
+        
+        completeSamples = blockSamples[..., numSamplesToTrim:numBlockFrames * hopSize]
+        numSamplesToTrim = max( [0, numSamplesToTrim - numBlockFrames * hopSize] )
+        if completeSamples.shape[-1]:
+            yield completeSamples * stftGainFactor
+    
+    if overlapSamples is not None:
+        remainingSamples = overlapSamples[..., numSamplesToTrim:overlapSamples.shape[-1] - fftSize // 2]
+        if remainingSamples.shape[-1]:
+            yield remainingSamples * stftGainFactor
+
+def getThreadedIterator(iterable, maxQueueSize=2):
+    # runs iterable in a background thread, handing items over through a bounded queue so that consecutive stages overlap
+    itemQueue = Queue(maxQueueSize)
+    endOfIteration = object()
+    
+    def produceItems():
+        try:
+            for item in iterable:
+                itemQueue.put( (item, None) )
+            itemQueue.put( (endOfIteration, None) )
+        except BaseException as exception:
+            itemQueue.put( (endOfIteration, exception) )
+    
+    producerThread = Thread(target=produceItems)
+    producerThread.daemon = True
+    producerThread.start()
+    while True:
+        item, exception = itemQueue.get()
+        if exception is not None:
+            raise exception
+        if item is endOfIteration:
+            break
+        yield item
+    producerThread.join()
 
 def saveTargetSignalEstimates(targetSignalEstimates, sampleRate, mixtureFileNamePrefix):
     numTargets = targetSignalEstimates.shape[0]
     for targetIndex in range(numTargets):
         sourceEstimateFileName = getSourceEstimateFileName(mixtureFileNamePrefix, targetIndex)
         wavwrite( targetSignalEstimates[targetIndex], sourceEstimateFileName, sampleRate )
+
+def saveTargetSignalEstimateBlocks(targetSignalEstimateBlocks, sampleRate, mixtureFileNamePrefix, clipProtectionMode=CLIP_PROTECTION_LIMITER):
+    # streaming counterpart of saveTargetSignalEstimates, appending each (numTargets, numChannels, numSamples) block as it is produced
+    wavWriters = []
+    try:
+        for targetSignalEstimateBlock in targetSignalEstimateBlocks:
+            if not wavWriters:
+                numTargets, numChannels, _ = targetSignalEstimateBlock.shape
+                wavWriters = [ WavWriter( getSourceEstimateFileName(mixtureFileNamePrefix, targetIndex), sampleRate, numChannels, clipProtectionMode=clipProtectionMode )
+                               for targetIndex in range(numTargets) ]
+            for wavWriter, targetSignalEstimate in zip(wavWriters, targetSignalEstimateBlock):
+                wavWriter.write(targetSignalEstimate)
+    finally:
+        for wavWriter in wavWriters:
+            wavWriter.close()
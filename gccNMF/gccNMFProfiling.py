@@ -0,0 +1,123 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2016 Sean UN Wood
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: Sean UN Wood
+'''
+
+import json
+import logging
+import tracemalloc
+from time import perf_counter, process_time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def getMaxRSSInBytes():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class StageProfiler(object):
+    '''Records wall time, CPU time and (with trackMemory) the peak traced memory of each named stage of a pipeline.
+    Memory is measured with tracemalloc, which numpy reports its array allocations to.'''
+    
+    def __init__(self, trackMemory=True):
+        self.trackMemory = trackMemory
+        self.stages = []
+        self.metadata = {}
+        self.startedTracing = False
+        if trackMemory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.startedTracing = True
+        self.startWallTime = perf_counter()
+        self.startCPUTime = process_time()
+    
+    @contextmanager
+    def stage(self, stageName):
+        if self.trackMemory:
+            startMemory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        startWallTime = perf_counter()
+        startCPUTime = process_time()
+        stageCompleted = False
+        try:
+            yield
+            stageCompleted = True
+        finally:
+            stageReport = {'name': stageName,
+                           'wallTime': perf_counter() - startWallTime,
+                           'cpuTime': process_time() - startCPUTime}
+            if self.trackMemory:
+                currentMemory, peakMemory = tracemalloc.get_traced_memory()
+                stageReport['peakMemoryInBytes'] = peakMemory
+                stageReport['peakMemoryIncreaseInBytes'] = peakMemory - startMemory
+                stageReport['retainedMemoryInBytes'] = currentMemory - startMemory
+            self.stages.append(stageReport)
+            if not stageCompleted:
+                # the pipeline raised and will not reach stop(), don't leave tracemalloc slowing down the rest of the process
+                self.stop()
+    
+    def stop(self):
+        if self.startedTracing:
+            tracemalloc.stop()
+            self.startedTracing = False
+    
+    def getReport(self):
+        totalWallTime = perf_counter() - self.startWallTime
+        report = {'stages': self.stages,
+                  'totalWallTime': totalWallTime,
+                  'totalCPUTime': process_time() - self.startCPUTime,
+                  'maxRSSInBytes': getMaxRSSInBytes()}
+        report.update(self.metadata)
+        if 'durationInSeconds' in self.metadata:
+            report['realtimeFactor'] = self.metadata['durationInSeconds'] / totalWallTime
+        return report
+    
+    def saveReport(self, reportPath):
+        with open(reportPath, 'w') as reportFile:
+            json.dump(self.getReport(), reportFile, indent=2, default=str)
+    
+    def logReport(self):
+        for stageReport in self.stages:
+            logging.info( 'StageProfiler: %s: %.3f s wall, %.3f s CPU%s' % (stageReport['name'], stageReport['wallTime'], stageReport['cpuTime'],
+                          ', peak %.1f MB' % (stageReport['peakMemoryInBytes'] / 2.0**20) if 'peakMemoryInBytes' in stageReport else '') )
+
+class NullStageProfiler(object):
+    '''Profiler interface with no-op stages, used when profiling is disabled.'''
+    
+    @contextmanager
+    def stage(self, stageName):
+        yield
+    
+    def stop(self):
+        pass
+    
+    def getReport(self):
+        return None
+
+def getStageProfiler(enabled, trackMemory=True):
+    return StageProfiler(trackMemory) if enabled else NullStageProfiler()
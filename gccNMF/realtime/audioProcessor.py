@@ -30,11 +30,13 @@ from multiprocessing import Process
 from time import sleep
 import time as tm
 
-from gccNMF.wavfile import pcm2float, float2pcm
+from gccNMF.wavfile import float2pcm, WavReader
+
+OUTPUT_BYTES_PER_SAMPLE = 2
 
 class PyAudioStreamProcessor(Process):
     def __init__(self, numChannels, sampleRate, windowSize, hopSize, blockSize, deviceIndex,
-                 togglePlayQueue, togglePlayAck, inputFrames, outputFrames, processFramesEvent, processFramesDoneEvent, terminateEvent):
+                 togglePlayQueue, togglePlayAck, inputRing, outputRing, doorbell, inputRingDiscardQueue, terminateEvent, numLatencyBlocks=1):
         super(PyAudioStreamProcessor, self).__init__()
 
         self.numChannels = numChannels
@@ -45,10 +47,15 @@ class PyAudioStreamProcessor(Process):
         
         self.togglePlayQueue = togglePlayQueue
         self.togglePlayAck = togglePlayAck
-        self.inputFrames = inputFrames
-        self.outputFrames = outputFrames
-        self.processFramesEvent = processFramesEvent
-        self.processFramesDoneEvent = processFramesDoneEvent
+        self.inputRing = inputRing
+        self.outputRing = outputRing
+        self.doorbell = doorbell
+        self.inputRingDiscardQueue = inputRingDiscardQueue
+        self.numLatencyBlocks = numLatencyBlocks
+        self.numPrimingBlocks = numLatencyBlocks
+        self.outputLate = False
+        self.inputFrames = np.zeros( (numChannels, blockSize), np.float32 )
+        self.outputFrames = np.zeros( (numChannels, blockSize), np.float32 )
         self.terminateEvent = terminateEvent
         self.deviceIndex = deviceIndex
         
@@ -98,6 +105,7 @@ class PyAudioStreamProcessor(Process):
             elif currentTime - lastPrintTime >= 2:
                 if len(self.processingTimes) != 0:
                     logging.info( 'Processing times (min/max/avg): %f, %f, %f' % (np.min(self.processingTimes), np.max(self.processingTimes), np.mean(self.processingTimes)) )
+                    logging.info( 'Input ring overruns: %d, output ring underruns: %d' % (self.inputRing.getCounters()[0], self.outputRing.getCounters()[1]) )
                     lastPrintTime = currentTime
                     del self.processingTimes[:]
             else:
@@ -109,17 +117,23 @@ class PyAudioStreamProcessor(Process):
         if self.sampleIndex+numFrames >= self.numFrames:
             self.sampleIndex = 0
         
-        inputBuffer = self.samples[self.sampleIndex*self.bytesPerFrameAllChannels:(self.sampleIndex+numFrames)*self.bytesPerFrameAllChannels]
-        inputIntArray = np.frombuffer(inputBuffer, dtype='<i2')
-        self.inputFrames[:] = pcm2float(inputIntArray).reshape(-1, self.numChannels).T
+        self.wavReader.read(self.sampleIndex, numFrames, out=self.inputFrames)
         self.sampleIndex += numFrames
         
-        #logging.info('AudioStreamProcessor: setting processFramesEvent')
-        self.processFramesDoneEvent.clear()
-        self.processFramesEvent.set()
-        #logging.info('AudioStreamProcessor: waiting for processFramesDoneEvent')
-        self.processFramesDoneEvent.wait()
-        #logging.info('AudioStreamProcessor: done waiting for processFramesDoneEvent')
+        # never blocks: a full input ring drops the block (overrun), an empty output ring plays silence (underrun)
+        self.inputRing.write(self.inputFrames)
+        self.doorbell.release()
+        if self.numPrimingBlocks > 0:
+            self.numPrimingBlocks -= 1
+            self.outputFrames[:] = 0
+        else:
+            # the block that missed its callback arrives late, drop it so that the output stays numLatencyBlocks behind
+            if self.outputLate and self.outputRing.getNumAvailable() > self.numLatencyBlocks:
+                self.outputRing.discard(self.numLatencyBlocks)
+                self.outputLate = False
+            if not self.outputRing.read(out=self.outputFrames):
+                self.outputFrames[:] = 0
+                self.outputLate = True
         
         outputIntArray = float2pcm(self.outputFrames.T.flatten())
         try:
@@ -143,6 +157,12 @@ class PyAudioStreamProcessor(Process):
             self.fileNameChanged = False
             self.reset()
         logging.info('AudioStreamProcessor: starting stream')
+        # stale blocks from before the stream was stopped are dropped, and the processor is given numLatencyBlocks of slack;
+        # the input ring is read by the GCCNMF process, so it is asked to drop the blocks written so far
+        self.inputRingDiscardQueue.put(self.inputRing.writeIndex.value)
+        self.outputRing.discard()
+        self.numPrimingBlocks = self.numLatencyBlocks
+        self.outputLate = False
         self.audioStream.start_stream()
         
     def stopStream(self):
@@ -181,7 +201,6 @@ class PyAudioStreamProcessor(Process):
         logging.info( 'min/max/mean/std time to process: %f, %f, %f, %f' % (minTimeToProcess, maxTimeToProcess, meanTimeToProcess, stdTimeToProcess) )
             
     def createAudioStream(self):
-        import wave        
         import pyaudio
         
         if self.pyaudio is None:
@@ -189,15 +208,11 @@ class PyAudioStreamProcessor(Process):
         
         self.paContinue = pyaudio.paContinue
         
-        waveFile = wave.open(self.fileName, 'rb')
-        self.numFrames = waveFile.getnframes()
-        self.samples = waveFile.readframes(self.numFrames)
-        self.sampleRate = waveFile.getframerate()
-        self.bytesPerFrame = waveFile.getsampwidth()
-        self.bytesPerFrameAllChannels = self.bytesPerFrame * self.numChannels
-        self.format = self.pyaudio.get_format_from_width(self.bytesPerFrame)
-        waveFile.close()
-        self.waveFile = wave.open(self.fileName, 'rb')
+        # samples are memory-mapped and decoded one block at a time in filePlayerCallback
+        self.wavReader = WavReader(self.fileName, channelIndexes=range(self.numChannels))
+        self.numFrames = len(self.wavReader)
+        self.sampleRate = self.wavReader.sampleRate
+        self.format = self.pyaudio.get_format_from_width(OUTPUT_BYTES_PER_SAMPLE)
             
         self.sampleIndex = 0
         self.audioStream = self.pyaudio.open(format=self.format,
@@ -24,6 +24,7 @@ SOFTWARE.
 @author: Sean UN Wood
 '''
 
+import os
 import logging
 from collections import namedtuple
 import ast
@@ -38,10 +39,10 @@ from gccNMF.realtime.gccNMFPretraining import getDictionariesW
 
 INT_OPTIONS = ['numTDOAs', 'numTDOAHistory', 'numSpectrogramHistory', 'numChannels',
                'windowSize', 'hopSize', 'blockSize', 'dictionarySize', 'numHUpdates',
-               'localizationWindowSize']
+               'localizationWindowSize', 'gccPHATUpsamplingFactor', 'ringBufferDepth', 'numLatencyBlocks']
 FLOAT_OPTIONS = ['gccPHATNLAlpha', 'microphoneSeparationInMetres']
 BOOL_OPTIONS = ['gccPHATNLEnabled', 'localizationEnabled']
-STRING_OPTIONS = ['dictionaryType', 'audioPath']
+STRING_OPTIONS = ['dictionaryType', 'audioPath', 'backendName', 'gccPHATMode', 'sharedMemoryDType', 'sharedMemoryPrefix']
 
 def getDefaultConfig():
     configParser = configparser.ConfigParser(allow_no_value=True)
@@ -52,6 +53,8 @@ def getDefaultConfig():
                       'numSpectrogramHistory': '128',
                       'gccPHATNLAlpha': '2.0',
                       'gccPHATNLEnabled': 'False',
+                      'gccPHATMode': 'explicit',
+                      'gccPHATUpsamplingFactor': '4',
                       'microphoneSeparationInMetres': '0.1',
                       'targetTDOAEpsilon': '5.0',
                       'targetTDOABeta': '2.0',
@@ -61,7 +64,9 @@ def getDefaultConfig():
     
     config['Audio'] = {'numChannels': '2',
                        'sampleRate': '16000',
-                       'deviceIndex': 'None'}
+                       'deviceIndex': 'None',
+                       'ringBufferDepth': '4',
+                       'numLatencyBlocks': '1'}
     
     config['STFT'] = {'windowSize': '1024',
                       'hopSize': '512',
@@ -71,6 +76,10 @@ def getDefaultConfig():
                      'dictionarySizes': '[64, 128, 256, 512, 1024]',
                      'dictionaryType': 'Pretrained',
                      'numHUpdates': '0'}
+    
+    config['Compute'] = {'backendName': 'numpy',
+                         'sharedMemoryDType': 'float32',
+                         'sharedMemoryPrefix': ''}
     try:
         for key, value in config.items():
             configParser[key] = value
@@ -104,17 +113,25 @@ def getDictFromConfig(config):
 def getGCCNMFConfig(configPath):
     raise ValueError('configPath is None')
 
-def getGCCNMFConfigParams(audioPath=DEFAULT_AUDIO_FILE, configPath=DEFAULT_CONFIG_FILE):
+def getGCCNMFConfigParams(audioPath=DEFAULT_AUDIO_FILE, configPath=DEFAULT_CONFIG_FILE, overrides=None, buildDictionaries=True):
+    # buildDictionaries=False leaves dictionariesW to the caller (the realtime engine shares them through a DictionaryStore)
     try:
         config = getGCCNMFConfig(configPath)
     except:
         config = getDefaultConfig()
         
     parametersDict = getDictFromConfig(config)
+    if overrides:
+        parametersDict.update(overrides)
     parametersDict['audioPath'] = audioPath
     parametersDict['numFreq'] = parametersDict['windowSize'] // 2 + 1
     parametersDict['windowsPerBlock'] = parametersDict['blockSize'] // parametersDict['hopSize']
-    parametersDict['dictionariesW'] = getDictionariesW(parametersDict['windowSize'], parametersDict['dictionarySizes'], ordered=True)
+    parametersDict['sharedMemoryPrefix'] = parametersDict['sharedMemoryPrefix'] or 'gccNMF_%d' % os.getpid()
+    if not buildDictionaries:
+        parametersDict['dictionariesW'] = None
+    else:
+        parametersDict['dictionariesW'] = getDictionariesW(parametersDict['windowSize'], [parametersDict['dictionarySize']], ordered=True,
+                                                           dictionaryTypes=[parametersDict['dictionaryType']])
     
     params = namedtuple('ParamsDict', parametersDict.keys())(**parametersDict)
     return params
@@ -27,7 +27,6 @@ SOFTWARE.
 import logging
 from os import listdir
 from os.path import join, isdir
-from collections import OrderedDict
 
 import numpy as np
 from pyqtgraph.Qt import QtGui, QtCore
@@ -52,8 +51,9 @@ class RealtimeGCCNMFInterfaceWindow(QtGui.QMainWindow):
         
         self.numTDOAs = numTDOAs
         self.tdoaIndexes = np.arange(numTDOAs)
-        self.dictionariesW = getVisualizedDictionariesW(dictionariesW)
-        self.dictionaryTypes = self.dictionariesW.keys()
+        self.dictionariesW = dictionariesW
+        self.visualizedDictionariesW = {}
+        self.dictionaryTypes = list( self.dictionariesW.keys() )
         
         self.dictionarySize = dictionarySize
         self.dictionarySizes = dictionarySizes
@@ -487,7 +487,7 @@ class RealtimeGCCNMFInterfaceWindow(QtGui.QMainWindow):
         self.dictionarySize = self.dictionarySizes[self.dictionarySizeDropDown.currentIndex()]
         logging.info('GCCNMFInterface: setting dictionarySize: %d' % self.dictionarySize)
         
-        visualizedDictionary = self.dictionariesW[self.dictionaryType][self.dictionarySize]
+        visualizedDictionary = self.getVisualizedDictionary(self.dictionaryType, self.dictionarySize)
         self.dictionaryImageItem.setImage(visualizedDictionary)
         self.dictionaryViewBox.setXRange(0, visualizedDictionary.shape[0] - 1, padding=0)
         self.dictionaryViewBox.setYRange(0, visualizedDictionary.shape[1] - 1, padding=0)
@@ -502,6 +502,12 @@ class RealtimeGCCNMFInterfaceWindow(QtGui.QMainWindow):
                              {'dictionarySize': self.dictionarySize},
                              'gccNMFProcessTogglePlayParameters')
 
+    def getVisualizedDictionary(self, dictionaryType, dictionarySize):
+        # visualized (and so copied) on first display only, the dictionaries themselves stay in shared memory
+        if (dictionaryType, dictionarySize) not in self.visualizedDictionariesW:
+            self.visualizedDictionariesW[(dictionaryType, dictionarySize)] = getVisualizedDictionary(self.dictionariesW[dictionaryType][dictionarySize])
+        return self.visualizedDictionariesW[(dictionaryType, dictionarySize)]
+    
     def dictionaryTypeChanged(self):
         dictionaryType = self.dictionaryTypes[self.dictionaryTypeDropDown.currentIndex()]
         logging.info('GCCNMFInterface: setting dictionarySize: %s' % dictionaryType)
@@ -577,15 +583,9 @@ class TargetWindowFunctionPlot(pg.PlotDataItem):
         tdoa = self.targetModeWindowTDOASlider.value() / 100.0 * self.numTDOAs
         return tdoa
     
-def getVisualizedDictionariesW(dictionariesW):
-    visualizedDictionariesW = OrderedDict()
-    for dictionaryType, dictionaries in dictionariesW.items():
-        currentDictionaries = OrderedDict()
-        for dictionarySize, dictionary in dictionaries.items():
-            visualizedDictionary = dictionary.copy()
-            visualizedDictionary /= np.max(visualizedDictionary)
-            visualizedDictionary **= (1 / 3.0)
-            visualizedDictionary = 1 - visualizedDictionary
-            currentDictionaries[dictionarySize] = visualizedDictionary
-        visualizedDictionariesW[dictionaryType] = currentDictionaries
-    return visualizedDictionariesW
+def getVisualizedDictionary(dictionary):
+    visualizedDictionary = dictionary.copy()
+    visualizedDictionary /= np.max(visualizedDictionary)
+    visualizedDictionary **= (1 / 3.0)
+    visualizedDictionary = 1 - visualizedDictionary
+    return visualizedDictionary
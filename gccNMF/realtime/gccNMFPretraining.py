@@ -25,37 +25,151 @@ SOFTWARE.
 '''
 
 import numpy as np
-from os import makedirs
+from os import makedirs, getpid
 from os.path import exists, join
 import logging
+from time import sleep
 from collections import OrderedDict
+from collections.abc import Mapping
 
-from gccNMF.gccNMFFunctions import performKLNMF
+from gccNMF.gccNMFFunctions import performKLNMFWithStats
 from gccNMF.defs import DATA_DIR
+from gccNMF.realtime.utils import SharedMemoryArray, unlinkSharedMemory
 
 PRETRAINED_W_DIR = join(DATA_DIR, 'pretrainedW')
 PRETRAINED_W_PATH_TEMPLATE = join(PRETRAINED_W_DIR, 'W_%d.npy')
 
 SPARSITY_ALPHA = 0
 NUM_PRELEARNING_ITERATIONS = 100
+# off, so that the pretrained dictionaries (cached in PRETRAINED_W_DIR and shared between runs) stay those of the full fixed-iteration fit
+PRELEARNING_TOLERANCE = None
 CHIME_DATASET_PATH = join(DATA_DIR, 'chimeTrainSet.npy')
 
-def getDictionariesW(windowSize, dictionarySizes, ordered=False):
+def getDictionaryW(windowSize, dictionaryType, dictionarySize, ordered=False):
     fftSize = windowSize // 2 + 1
-    dictionariesW = OrderedDict( [('Pretrained', OrderedDict( [(dictionarySize, loadPretrainedW(dictionarySize)) for dictionarySize in dictionarySizes] )),
-                                  ('Random', OrderedDict( [(dictionarySize, np.random.rand(fftSize, dictionarySize).astype('float32')) for dictionarySize in dictionarySizes] )) ])#,
-                                  #('Harmonic', OrderedDict( [(dictionarySize, getHarmonicDictionary(minF0, maxF0, fftSize, dictionarySize, sampleRate, windowFunction=np.hanning)[0]) for dictionarySize in dictionarySizes] ))] )
+    dictionaryFunctions = {'Pretrained': loadPretrainedW,
+                           'Random': lambda dictionarySize: np.random.rand(fftSize, dictionarySize).astype('float32')}
+                           #'Harmonic': lambda dictionarySize: getHarmonicDictionary(minF0, maxF0, fftSize, dictionarySize, sampleRate, windowFunction=np.hanning)[0]
+    W = dictionaryFunctions[dictionaryType](dictionarySize)
+    return getOrderedDictionary(W) if ordered else W
+
+def getDictionariesW(windowSize, dictionarySizes, ordered=False, dictionaryTypes=('Pretrained', 'Random')):
+    dictionariesW = OrderedDict()
+    for dictionaryType in dictionaryTypes:
+        dictionariesW[dictionaryType] = OrderedDict( [(dictionarySize, getDictionaryW(windowSize, dictionaryType, dictionarySize, ordered))
+                                                      for dictionarySize in dictionarySizes] )
+    return dictionariesW
+
+def getDictionaryStore(windowSize, dictionarySizes, namePrefix=None, dictionaryTypes=('Pretrained', 'Random')):
+    # ordered dictionaries, as used by the realtime engine
+    return DictionaryStore(windowSize, dictionarySizes, dictionaryTypes, namePrefix)
+
+DICTIONARY_STATE_BUILDING = 0
+DICTIONARY_STATE_READY = 1
+DICTIONARY_STATE_FAILED = -1
+DICTIONARY_WAIT_INTERVAL_IN_SECONDS = 0.01
+
+class DictionaryStore(Mapping):
+    '''Read-only dictionaries W in named shared memory segments (<namePrefix><dictionaryType>_<dictionarySize>),
+    indexed like the nested dicts returned by getDictionariesW: store[dictionaryType][dictionarySize].
+    
+    Nothing is built up front: the first process to access a dictionary creates its segment, builds W into it and marks it
+    ready, and other processes attach to it (waiting for it to be ready if needed). Pickling only transfers the parameters
+    and name prefix, so the processing process and interface share one float32 copy of each dictionary they use.
+    The creating store's release() unlinks every segment, whichever process built it.'''
+    
+    def __init__(self, windowSize, dictionarySizes, dictionaryTypes=('Pretrained', 'Random'), namePrefix=None):
+        self.windowSize = windowSize
+        self.dictionarySizes = list(dictionarySizes)
+        self.dictionaryTypes = list(dictionaryTypes)
+        self.namePrefix = namePrefix or 'gccNMF_%d_W' % getpid()
+        self.owner = True
+        self.arrays = {}
+    
+    def __getstate__(self):
+        return {'windowSize': self.windowSize, 'dictionarySizes': self.dictionarySizes, 'dictionaryTypes': self.dictionaryTypes, 'namePrefix': self.namePrefix}
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.owner = False
+        self.arrays = {}
+    
+    def __getitem__(self, dictionaryType):
+        if dictionaryType not in self.dictionaryTypes:
+            raise KeyError(dictionaryType)
+        return DictionaryStoreSizes(self, dictionaryType)
+    
+    def __iter__(self):
+        return iter(self.dictionaryTypes)
+    
+    def __len__(self):
+        return len(self.dictionaryTypes)
+    
+    def getName(self, dictionaryType, dictionarySize):
+        return '%s%s_%d' % (self.namePrefix, dictionaryType, dictionarySize)
+    
+    def getW(self, dictionaryType, dictionarySize):
+        key = (dictionaryType, dictionarySize)
+        if key not in self.arrays:
+            self.arrays[key] = self.createOrAttach(dictionaryType, dictionarySize)
+        return self.arrays[key].values
+    
+    def createOrAttach(self, dictionaryType, dictionarySize):
+        name = self.getName(dictionaryType, dictionarySize)
+        try:
+            array = SharedMemoryArray( (self.windowSize // 2 + 1, dictionarySize), np.float32, name )
+        except FileExistsError:
+            return self.attach(name)
+        
+        # only this store's owner unlinks, so a dictionary built by another process outlives it
+        array.owner = self.owner
+        try:
+            array.values[:] = getDictionaryW(self.windowSize, dictionaryType, dictionarySize, ordered=True)
+        except:
+            array.counters[0] = DICTIONARY_STATE_FAILED
+            array.owner = True
+            array.release()
+            raise
+        array.values.flags.writeable = False
+        array.counters[0] = DICTIONARY_STATE_READY
+        return array
+    
+    def attach(self, name):
+        array = SharedMemoryArray(name=name, create=False)
+        while array.counters[0] == DICTIONARY_STATE_BUILDING:
+            sleep(DICTIONARY_WAIT_INTERVAL_IN_SECONDS)
+        if array.counters[0] == DICTIONARY_STATE_FAILED:
+            array.release()
+            raise ValueError('DictionaryStore: building %s failed in another process' % name)
+        array.values.flags.writeable = False
+        return array
+    
+    def release(self):
+        for array in self.arrays.values():
+            array.release()
+        self.arrays = {}
+        if self.owner:
+            for dictionaryType in self.dictionaryTypes:
+                for dictionarySize in self.dictionarySizes:
+                    unlinkSharedMemory( self.getName(dictionaryType, dictionarySize) )
+
+class DictionaryStoreSizes(Mapping):
+    '''store[dictionaryType]: the dictionaries of one type, indexed by size.'''
+    
+    def __init__(self, store, dictionaryType):
+        self.store = store
+        self.dictionaryType = dictionaryType
+    
+    def __getitem__(self, dictionarySize):
+        if dictionarySize not in self.store.dictionarySizes:
+            raise KeyError(dictionarySize)
+        return self.store.getW(self.dictionaryType, dictionarySize)
     
-    if not ordered:
-        return dictionariesW
+    def __iter__(self):
+        return iter(self.store.dictionarySizes)
     
-    orderedDictionariesW = OrderedDict()
-    for dictionaryType, dictionaries in dictionariesW.items():
-        currentDictionaries = OrderedDict()
-        for dictionarySize, dictionary in dictionaries.items():
-            currentDictionaries[dictionarySize] = getOrderedDictionary(dictionary)
-        orderedDictionariesW[dictionaryType] = currentDictionaries
-    return orderedDictionariesW
+    def __len__(self):
+        return len(self.store.dictionarySizes)
     
 def getOrderedDictionary(W):
     numFreq, _ = W.shape
@@ -77,7 +191,8 @@ def loadPretrainedW(dictionarySize, retrainW=False):
             logging.info('GCCNMFPretraining: Pretrained W not found at %s, creating...' % pretrainedWFilePath)
         
         trainV = np.load(CHIME_DATASET_PATH)
-        W, _ = performKLNMF(trainV, dictionarySize, numIterations=100, sparsityAlpha=0, epsilon=1e-16, seedValue=0)
+        W, _, nmfStats = performKLNMFWithStats(trainV, dictionarySize, NUM_PRELEARNING_ITERATIONS, SPARSITY_ALPHA, epsilon=1e-16, seedValue=0, tolerance=PRELEARNING_TOLERANCE)
+        logging.info( 'GCCNMFPretraining: NMF stopped after %d iterations in %.1f s' % (nmfStats['numIterations'], nmfStats['totalTime']) )
         
         try:
             makedirs(PRETRAINED_W_DIR)
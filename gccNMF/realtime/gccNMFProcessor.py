@@ -25,27 +25,28 @@ SOFTWARE.
 '''
 
 import logging
-from time import sleep
 import numpy as np
 from numpy.fft import rfft
 from multiprocessing import Process
 
-from gccNMF.defs import SPEED_OF_SOUND_IN_METRES_PER_SECOND
+from gccNMF.defs import SPEED_OF_SOUND_IN_METRES_PER_SECOND, TARGET_MODE_BOXCAR, TARGET_MODE_MULTIPLE, TARGET_MODE_WINDOW_FUNCTION, GCC_PHAT_MODE_EXPLICIT, GCC_PHAT_MODE_FFT
+from gccNMF.gccNMFBackends import getBackend, getExpJOmegaTauTable, getFFTGCCTable
+from gccNMF.gccNMFFunctions import performKLNMFHUpdates
 
-TARGET_MODE_BOXCAR = 0
-TARGET_MODE_MULTIPLE = 1
-TARGET_MODE_WINDOW_FUNCTION = 2
+NMF_EPSILON = 1e-16
+DOORBELL_TIMEOUT_IN_SECONDS = 0.1
 
 class GCCNMFProcess(Process):
     def __init__(self, oladProcessor, sampleRate, windowSize, numTimePerChunk, dictionariesW, dictionaryType, dictionarySize, numHUpdates, microphoneSeparationInMetres, localizationEnabled, localizationWindowSize,
                  gccPHATHistory, tdoaHistory, inputSpectrogramHistory, outputSpectrogramHistory, coefficientMaskHistories, 
                  tdoaParametersQueue, tdoaParametersAck, togglePlayQueue, togglePlayAck, toggleSeparationQueue, toggleSeparationAck,
-                 processFramesEvent, processFramesDoneEvent, terminateEvent):
+                 inputRing, outputRing, terminateEvent, doorbell, inputRingDiscardQueue, backendName='numpy', gccPHATMode=GCC_PHAT_MODE_EXPLICIT, gccPHATUpsamplingFactor=4):
         super(GCCNMFProcess, self).__init__()
 
         self.oladProcessor = oladProcessor
         self.gccNMFProcessor = GCCNMFProcessor(sampleRate, windowSize, numTimePerChunk, dictionariesW, dictionaryType, dictionarySize, numHUpdates, microphoneSeparationInMetres,
-                                               localizationEnabled, localizationWindowSize, gccPHATHistory, tdoaHistory, inputSpectrogramHistory, outputSpectrogramHistory, coefficientMaskHistories)
+                                               localizationEnabled, localizationWindowSize, gccPHATHistory, tdoaHistory, inputSpectrogramHistory, outputSpectrogramHistory, coefficientMaskHistories,
+                                               backendName, gccPHATMode, gccPHATUpsamplingFactor)
         
         self.tdoaParametersQueue = tdoaParametersQueue
         self.tdoaParametersAck = tdoaParametersAck
@@ -54,54 +55,56 @@ class GCCNMFProcess(Process):
         self.toggleSeparationQueue = toggleSeparationQueue
         self.toggleSeparationAck = toggleSeparationAck
         
-        self.processFramesEvent = processFramesEvent
-        self.processFramesDoneEvent = processFramesDoneEvent
+        self.inputRing = inputRing
+        self.outputRing = outputRing
         self.terminateEvent = terminateEvent
+        self.doorbell = doorbell
+        self.inputRingDiscardQueue = inputRingDiscardQueue
         
     def run(self):
         #os.nice(-20)
         while True:
+            # producers ring the doorbell on every block, event set and queue put, so this blocks until there is work;
+            # the timeout only bounds the wait should a notification ever be missed
+            self.doorbell.acquire(timeout=DOORBELL_TIMEOUT_IN_SECONDS)
+            # a single pass handles all pending work, so drop the permits rung since; any rung after this pass starts wakes the next one
+            while self.doorbell.acquire(False):
+                pass
+            
             if self.terminateEvent.is_set():
                 logging.info('GCCNMFProcessor: received terminate')
                 return
             
-            wait = True
+            # only this process reads the input ring, so it also drops the stale blocks the audio process asks it to
+            while self.inputRingDiscardQueue.hasPending():
+                self.inputRing.discard( writeIndex=self.inputRingDiscardQueue.get() )
+            
+            # audio blocks first, control messages are not deadline bound
+            while self.inputRing.getNumAvailable() > 0:
+                self.inputRing.read(out=self.oladProcessor.inputFrames)
+                self.oladProcessor.processFrames(self.gccNMFProcessor.processFrames)
+                self.outputRing.write(self.oladProcessor.outputFrames)
             
-            if not self.tdoaParametersQueue.empty():
+            while self.tdoaParametersQueue.hasPending():
                 logging.debug('GCCNMFProcessor: received tdoaParams')
                 self.processTDOAParametersQueue()
                 logging.debug('AudioStreamProcessor: processed tdoaParams')
                 self.tdoaParametersAck.set()
                 logging.debug('AudioStreamProcessor: ack set')
-                wait = False
             
-            if not self.togglePlayQueue.empty():
+            while self.togglePlayQueue.hasPending():
                 logging.debug('GCCNMFProcessor: received togglePlayParams')
                 self.processTogglePlayQueue()
                 logging.debug('GCCNMFProcessor: processed togglePlayParams')
                 self.togglePlayAck.set()
                 logging.debug('GCCNMFProcessor: ack set')
-                wait = False
                 
-            if not self.toggleSeparationQueue.empty():
+            while self.toggleSeparationQueue.hasPending():
                 logging.debug('GCCNMFProcessor: received toggleSeparationParams')
                 self.processToggleSeparationQueue()
                 logging.debug('GCCNMFProcessor: processed toggleSeparationParams')
                 self.toggleSeparationAck.set()
                 logging.debug('GCCNMFProcessor: ack set')
-                wait = False
-            
-            if self.processFramesEvent.is_set():
-                self.processFramesEvent.clear()
-                #logging.info('GCCNMFProcessor: received processFramesEvent')
-                self.oladProcessor.processFrames(self.gccNMFProcessor.processFrames)
-                #logging.info('GCCNMFProcessor: setting processFramesDoneEvent')
-                self.processFramesDoneEvent.set()
-                #logging.info('GCCNMFProcessor: set processFramesDoneEvent')
-                wait = False
-            
-            if wait:
-                sleep(0.001)
     
     def processTDOAParametersQueue(self):
         parameters = self.tdoaParametersQueue.get()
@@ -125,11 +128,10 @@ class GCCNMFProcess(Process):
             self.gccNMFProcessor.setTargetTDOARange(targetTDOAIndex, targetTDOAEpsilon, targetTDOABeta, targetTDOANoiseFloor)
              
     def processTogglePlayQueue(self):
-        from theano.compile.sharedvalue import SharedVariable
-        
         parameters = self.togglePlayQueue.get()
         parametersRequiringReset = ['microphoneSeparationInMetres', 'numTDOAs', 'numSources', 'targetMode',
-                                    'dictionarySize', 'dictionaryType', 'gccPHATNLEnabled']
+                                    'dictionarySize', 'dictionaryType', 'gccPHATNLEnabled', 'backendName',
+                                    'gccPHATMode', 'gccPHATUpsamplingFactor']
 
         resetGCCNMFProcessor = False
         for parameterName, parameterValue in parameters.items():
@@ -139,18 +141,11 @@ class GCCNMFProcess(Process):
                 resetGCCNMFProcessor |= parameterName in parametersRequiringReset
             else:
                 currentParam = getattr(self.gccNMFProcessor, parameterName)
-                if issubclass(type(currentParam), SharedVariable):
-                    if currentParam.get_value() != parameterValue:
-                        logging.info('GCCNMFProcessor: setting %s: %s (shared)' % (parameterName, parameterValue))
-                        currentParam.set_value(parameterValue)
-                    else:
-                        logging.info('GCCNMFProcessor: %s unchanged: %s (shared)' % (parameterName, parameterValue))
+                if currentParam != parameterValue:
+                    logging.info('GCCNMFProcessor: setting %s: %s' % (parameterName, parameterValue))
+                    setattr(self.gccNMFProcessor, parameterName, parameterValue)
                 else:
-                    if currentParam != parameterValue:
-                        logging.info('GCCNMFProcessor: setting %s: %s' % (parameterName, parameterValue))
-                        setattr(self.gccNMFProcessor, parameterName, parameterValue)
-                    else:
-                        logging.info('GCCNMFProcessor: %s unchanged: %s' % (parameterName, parameterValue))
+                    logging.info('GCCNMFProcessor: %s unchanged: %s' % (parameterName, parameterValue))
                 resetGCCNMFProcessor |= parameterName in parametersRequiringReset
 
         if resetGCCNMFProcessor:
@@ -166,7 +161,8 @@ class GCCNMFProcess(Process):
     
 class GCCNMFProcessor(object):
     def __init__(self, sampleRate, windowSize, numTimePerChunk, dictionariesW, dictionaryType, dictionarySize, numHUpdates, microphoneSeparationInMetres,
-                 localizationEnabled, localizationWindowSize, gccPHATHistory=None, tdoaHistory=None, inputSpectrogramHistory=None, outputSpectrogramHistory=None, coefficientMaskHistories=None):
+                 localizationEnabled, localizationWindowSize, gccPHATHistory=None, tdoaHistory=None, inputSpectrogramHistory=None, outputSpectrogramHistory=None, coefficientMaskHistories=None, backendName='numpy',
+                 gccPHATMode=GCC_PHAT_MODE_EXPLICIT, gccPHATUpsamplingFactor=4):
         super(GCCNMFProcessor, self).__init__()
         
         self.sampleRate = sampleRate
@@ -175,7 +171,12 @@ class GCCNMFProcessor(object):
         self.dictionariesW = dictionariesW
         self.dictionaryType = dictionaryType
         self.dictionarySize = dictionarySize
+        self.numHUpdates = numHUpdates
         self.microphoneSeparationInMetres = microphoneSeparationInMetres
+        self.backendName = backendName
+        self.backend = None
+        self.gccPHATMode = gccPHATMode
+        self.gccPHATUpsamplingFactor = gccPHATUpsamplingFactor
         
         self.gccPHATHistory = gccPHATHistory
         self.tdoaHistory = tdoaHistory
@@ -192,20 +193,17 @@ class GCCNMFProcessor(object):
         self.localizationWindowSize = localizationWindowSize
         self.targetMode = TARGET_MODE_WINDOW_FUNCTION
         
-        from theano import shared
-        self.targetTDOAIndex = shared( np.float32(10.0) )
-        self.targetTDOAEpsilon = shared( np.float32(2.0) )
-        self.targetTDOABeta = shared( np.float32(1.0) )
-        self.targetTDOANoiseFloor = shared( np.float32(0.0) )
+        self.targetTDOAIndex = np.float32(10.0)
+        self.targetTDOAEpsilon = np.float32(2.0)
+        self.targetTDOABeta = np.float32(1.0)
+        self.targetTDOANoiseFloor = np.float32(0.0)
         
     def processFrames(self, windowedSamples):
-        self.complexMixtureSpectrogram[:] = rfft(windowedSamples * self.windowFunction, axis=1).astype(np.complex64)
-        self.spectrogram.set_value(self.complexMixtureSpectrogram)
-        #self.spectrogram.set_value( rfft(windowedSamples * self.windowFunction, axis=1).astype(np.complex64) )
+        self.complexMixtureSpectrogram[:] = rfft(windowedSamples * self.windowFunction, axis=1)
         
-        realGCC = self.getComplexGCC()[0].real
+        self.getSpectralCoherence()
         if self.separationEnabled:
-            [inputMask, coefficientMask] = self.getTFMask(realGCC)
+            [inputMask, coefficientMask] = self.getTFMask()
             outputSpectrogram = inputMask * self.complexMixtureSpectrogram
             
             if self.coefficientMaskHistories:
@@ -216,15 +214,13 @@ class GCCNMFProcessor(object):
         if self.inputSpectrogramHistory:
             self.inputSpectrogramHistory.set( -np.mean(np.abs(self.complexMixtureSpectrogram), axis=0) ** (1/3.0) )
         if self.gccPHATHistory:
-            self.gccPHATHistory.set( np.nanmean(realGCC, axis=0).T )
+            self.gccPHATHistory.set( self.getAngularSpectrogram() )
         if self.tdoaHistory:
             if self.localizationEnabled:
                 gccPHATHistory = self.gccPHATHistory.getUnraveledArray()
                 tdoaIndex = np.argmax( np.nanmean(gccPHATHistory[:, -self.localizationWindowSize:], axis=-1) )
-                #tdoaIndex = (self.targetTDOAIndex.get_value() + 1) % self.numTDOAs
-                #tdoaIndex = np.random.randint(0, self.numTDOAs+1)
-                self.targetTDOAIndex.set_value(tdoaIndex)
-            self.tdoaHistory.set( np.array( [[self.targetTDOAIndex.get_value()]] ) )
+                self.targetTDOAIndex = np.float32(tdoaIndex)
+            self.tdoaHistory.set( np.array( [[self.targetTDOAIndex]] ) )
         if self.outputSpectrogramHistory:
             self.outputSpectrogramHistory.set( -np.nanmean(np.abs(outputSpectrogram), axis=0) ** (1/3.0) )
         
@@ -232,45 +228,97 @@ class GCCNMFProcessor(object):
         
     def reset(self):
         logging.info('GCCNMFProcessor: resetting...')
-        self.buildTheanoFunctions()
+        self.initBuffers()
         logging.info('GCCNMFProcessor: done reset.')
     
-    def buildTheanoFunctions(self):
-        from theano import shared, tensor, function
+    def initBuffers(self):
+        self.backend = getBackend(self.backendName)
+        logging.info( 'GCCNMFProcessor: using %s backend' % self.backend.name )
         
-        self.W = self.dictionariesW[self.dictionaryType][self.dictionarySize]
+        self.W = np.ascontiguousarray(self.dictionariesW[self.dictionaryType][self.dictionarySize], np.float32)
         self.numFrequencies, self.numAtom = self.W.shape
         logging.info( 'Dictionary shape: %s' % str(self.W.shape))
         
         self.frequenciesInHz = np.linspace(0, self.sampleRate/2, self.numFrequencies).astype(np.float32)
         self.maxTDOA = self.microphoneSeparationInMetres / SPEED_OF_SOUND_IN_METRES_PER_SECOND
         self.hypothesisTDOAs = np.linspace(-self.maxTDOA, self.maxTDOA, self.numTDOAs).astype(np.float32)
-        self.expJOmegaTau = np.exp( np.outer(self.frequenciesInHz, -(2j * np.pi) * self.hypothesisTDOAs) ).astype(np.complex64)
-        self.omegaTau = np.outer(self.frequenciesInHz, -2 * np.pi * self.hypothesisTDOAs).astype(np.float32)
+        if self.gccPHATMode == GCC_PHAT_MODE_FFT:
+            self.fftGCCTable = getFFTGCCTable(self.frequenciesInHz, self.hypothesisTDOAs, self.gccPHATUpsamplingFactor, np.float32)
+        elif self.gccPHATMode == GCC_PHAT_MODE_EXPLICIT:
+            self.expJOmegaTau = np.exp( np.outer(self.frequenciesInHz, -(2j * np.pi) * self.hypothesisTDOAs) ).astype(np.complex64)
+            self.omegaTau = np.outer(self.frequenciesInHz, -2 * np.pi * self.hypothesisTDOAs).astype(np.float32)
+            self.expJOmegaTauTable = getExpJOmegaTauTable(self.expJOmegaTau)
+        else:
+            raise ValueError('GCCNMFProcessor: unknown gccPHATMode: %s' % self.gccPHATMode)
+        self.recV = np.sum(self.W, axis=-1)
         
-        self.complexMixtureSpectrogram = np.zeros( (2, self.numFrequencies, self.numTimePerChunk), 'complex64' )
-        self.spectrogram = shared(self.complexMixtureSpectrogram)
-        self.coherenceV = self.spectrogram[0] * self.spectrogram[1].conj() / np.abs(self.spectrogram[0]) / np.abs(self.spectrogram[1])                
-        self.complexGCC = self.coherenceV[:, :, np.newaxis] * self.expJOmegaTau[:, np.newaxis]
-        self.getComplexGCC = function([], [self.complexGCC])
+        self.complexMixtureSpectrogram = np.zeros( (2, self.numFrequencies, self.numTimePerChunk), np.complex64 )
+        self.coherenceV = np.zeros( (self.numFrequencies, self.numTimePerChunk), np.complex64 )
+        self.silentCoherenceBins = np.zeros( (self.numFrequencies, self.numTimePerChunk), bool )
+        self.numCoherenceBins = np.zeros(self.numTimePerChunk, np.int64)
+        self.angularSpectrogram = np.zeros( (self.numTDOAs, self.numTimePerChunk), np.float32 )
+        self.gccNMF = np.zeros( (self.numAtom, self.numTimePerChunk, self.numTDOAs), np.float32 )
+        self.HMask = np.zeros( (self.numAtom, self.numTimePerChunk), np.float32 )
+        self.recSource = np.zeros( (self.numFrequencies, self.numTimePerChunk), np.float32 )
+        self.tfMask = np.zeros( (self.numFrequencies, self.numTimePerChunk), np.float32 )
         
-        self.realGCC = tensor.tensor3('realGCC', dtype='float32')
-        #self.realGCC = self.complexGCC.real
-        self.gccNMF = tensor.dot( self.realGCC.T, self.W )
-        self.getGCCNMF = function(inputs=[self.realGCC], outputs=[self.gccNMF])
+        # H-only NMF buffers, columns ordered (channel, time) so that stereo activations are inferred in one pass
+        self.stereoV = np.zeros( (self.numFrequencies, 2, self.numTimePerChunk), np.float32 )
+        self.stereoH = np.ones( (self.numAtom, 2, self.numTimePerChunk), np.float32 )
+        self.stereoHNumerator = np.zeros_like(self.stereoH)
+        self.stereoRatio = np.zeros_like(self.stereoV)
+        self.stereoMaskedH = np.zeros_like(self.stereoH)
+        self.stereoRecSource = np.zeros_like(self.stereoV)
+        self.stereoTFMask = np.zeros_like(self.stereoV)
+    
+    def getSpectralCoherence(self):
+        # silent bins give 0/0 coherence: zero them so they drop out of the frequency sums, then average over the remaining bins
+        # (as np.nanmean over frequency did) rather than letting one silent bin turn the whole frame into NaN
+        with np.errstate(invalid='ignore'):
+            self.backend.getSpectralCoherence(self.complexMixtureSpectrogram, out=self.coherenceV)
+        np.isnan(self.coherenceV, out=self.silentCoherenceBins)
+        self.coherenceV[self.silentCoherenceBins] = 0
+        np.subtract( self.numFrequencies, np.count_nonzero(self.silentCoherenceBins, axis=0), out=self.numCoherenceBins )
+        np.maximum(self.numCoherenceBins, 1, out=self.numCoherenceBins)
+        return self.coherenceV
+    
+    def getAngularSpectrogram(self):
+        if self.gccPHATMode == GCC_PHAT_MODE_FFT:
+            self.backend.getAngularSpectrogramFFT(self.coherenceV, self.fftGCCTable, out=self.angularSpectrogram)
+        else:
+            self.backend.getAngularSpectrogram(self.coherenceV, self.expJOmegaTauTable, out=self.angularSpectrogram)
+        self.angularSpectrogram /= self.numCoherenceBins
+        return self.angularSpectrogram
+    
+    def getTFMask(self):
+        if self.gccPHATMode == GCC_PHAT_MODE_FFT:
+            self.backend.getGCCNMFFFT(self.coherenceV, self.fftGCCTable, self.W, out=self.gccNMF)
+        else:
+            self.backend.getGCCNMFFused(self.coherenceV, self.expJOmegaTauTable, self.W, out=self.gccNMF)
+        self.backend.getTDOAWindowMask(self.gccNMF, self.targetMode, self.targetTDOAIndex, self.targetTDOAEpsilon, self.targetTDOABeta, self.targetTDOANoiseFloor, out=self.HMask)
+        if self.numHUpdates > 0:
+            return [self.getActivationTFMask(), self.HMask]
+        self.backend.getReconstruction(self.W, self.HMask, out=self.recSource)
+        np.divide( self.recSource, self.recV[:, np.newaxis], out=self.tfMask )
+        return [self.tfMask, self.HMask]
+    
+    def getActivationTFMask(self):
+        # infer H for both channels (warm started from the previous chunk), then mask as W.(H * HMask) / W.H
+        numFrequencies, numAtom, numColumns = self.numFrequencies, self.numAtom, 2 * self.numTimePerChunk
+        np.abs( self.complexMixtureSpectrogram.transpose(1, 0, 2), out=self.stereoV )
+        np.maximum(self.stereoH, NMF_EPSILON, out=self.stereoH)
+        performKLNMFHUpdates( self.stereoV.reshape(numFrequencies, numColumns), self.W, self.stereoH.reshape(numAtom, numColumns), self.numHUpdates, 0, NMF_EPSILON,
+                              ratio=self.stereoRatio.reshape(numFrequencies, numColumns), hNumerator=self.stereoHNumerator.reshape(numAtom, numColumns) )
         
-        if self.targetMode == TARGET_MODE_BOXCAR:
-            self.HMask = tensor.switch( abs(tensor.argmax(self.gccNMF, axis=0).T - self.targetTDOAIndex) < self.targetTDOAEpsilon, 1.0, 0.0 )
-        elif self.targetMode == TARGET_MODE_WINDOW_FUNCTION:
-            self.HMask = tensor.exp( - (abs(tensor.argmax(self.gccNMF, axis=0).T - self.targetTDOAIndex) / self.targetTDOAEpsilon) ** self.targetTDOABeta ) / (1+self.targetTDOANoiseFloor) + self.targetTDOANoiseFloor
-            
-        self.recSource = tensor.dot( self.W, self.HMask )
-        self.recV = tensor.sum( self.W, axis=-1, keepdims=False )
-        self.tfMask = ( self.recSource.T / self.recV ).T
-        self.getTFMask = function(inputs=[self.realGCC], outputs=[self.tfMask, self.HMask])
+        np.multiply( self.stereoH, self.HMask[:, np.newaxis, :], out=self.stereoMaskedH )
+        self.backend.getReconstruction( self.W, self.stereoMaskedH.reshape(numAtom, numColumns), out=self.stereoRecSource.reshape(numFrequencies, numColumns) )
+        self.backend.getReconstruction( self.W, self.stereoH.reshape(numAtom, numColumns), out=self.stereoRatio.reshape(numFrequencies, numColumns) )
+        self.stereoRatio += NMF_EPSILON
+        np.divide( self.stereoRecSource, self.stereoRatio, out=self.stereoTFMask )
+        return self.stereoTFMask.transpose(1, 0, 2)
         
     def setTargetTDOARange(self, targetTDOAIndex, targetTDOAEpsilon, targetTDOABeta, targetTDOANoiseFloor):
-        self.targetTDOAIndex.set_value( np.float32(targetTDOAIndex) )
-        self.targetTDOAEpsilon.set_value( np.float32(targetTDOAEpsilon) )
-        self.targetTDOABeta.set_value( np.float32(targetTDOABeta) )
-        self.targetTDOANoiseFloor.set_value( np.float32(targetTDOANoiseFloor) )
\ No newline at end of file
+        self.targetTDOAIndex = np.float32(targetTDOAIndex)
+        self.targetTDOAEpsilon = np.float32(targetTDOAEpsilon)
+        self.targetTDOABeta = np.float32(targetTDOABeta)
+        self.targetTDOANoiseFloor = np.float32(targetTDOANoiseFloor)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+'''
+The MIT License (MIT)
+
+Copyright (c) 2016 Sean UN Wood
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: Sean UN Wood
+'''
+
+import os
+import json
+import logging
+import argparse
+import traceback
+from glob import glob
+from time import time
+from os.path import isdir, join, dirname, abspath, relpath, splitext, commonpath
+from multiprocessing import get_context
+import numpy as np
+
+from gccNMF.defs import DEFAULT_CONFIG_FILE, TARGET_MODE_WINDOW_FUNCTION
+from gccNMF.wavfile import WavReader, WavWriter
+from gccNMF.realtime.utils import CircularBuffer, OverlapAddProcessor
+from gccNMF.realtime.config import getGCCNMFConfigParams
+from gccNMF.realtime.gccNMFProcessor import GCCNMFProcessor
+from gccNMF.runBatchGCCNMF import blasNumThreadsEnvironment, initializeWorker
+
+ENHANCED_FILE_SUFFIX = '_enhanced.wav'
+TDOA_TRACK_FILE_SUFFIX = '_tdoa.csv'
+
+def getAudioPaths(inputPaths):
+    audioPaths = []
+    for inputPath in inputPaths:
+        audioPaths += sorted( glob( join(inputPath, '*.wav') ) ) if isdir(inputPath) else sorted( glob(inputPath) )
+    return sorted( set(audioPaths) )
+
+def getInputDir(audioPaths):
+    return commonpath( [dirname( abspath(audioPath) ) for audioPath in audioPaths] ) if audioPaths else None
+
+def getOutputFilePrefix(audioPath, outputDir, inputDir=None):
+    # outputs mirror the input files' paths below inputDir (their common directory), so that files with the same name do not collide
+    inputDir = dirname( abspath(audioPath) ) if inputDir is None else inputDir
+    return join( outputDir, splitext( relpath(abspath(audioPath), inputDir) )[0] )
+
+def createProcessors(params, numChannels, sampleRate, targetTDOAIndex=None):
+    # the same OverlapAddProcessor and GCCNMFProcessor as the realtime engine, driven in-process with plain arrays (and histories) instead of shared memory
+    inputFrames = np.zeros( (numChannels, params.blockSize), np.float32 )
+    outputFrames = np.zeros( (numChannels, params.blockSize), np.float32 )
+    oladProcessor = OverlapAddProcessor(numChannels, params.windowSize, params.hopSize, params.blockSize, params.windowsPerBlock, inputFrames, outputFrames)
+    
+    # localization tracks the target from the recent GCC-PHAT history, unless a fixed target is given
+    localizationEnabled = targetTDOAIndex is None
+    gccPHATHistory = CircularBuffer( (params.numTDOAs, params.numTDOAHistory) ) if localizationEnabled else None
+    tdoaHistory = CircularBuffer( (1, params.numTDOAHistory) ) if localizationEnabled else None
+    gccNMFProcessor = GCCNMFProcessor(sampleRate, params.windowSize, params.windowsPerBlock, params.dictionariesW, params.dictionaryType, params.dictionarySize,
+                                      params.numHUpdates, params.microphoneSeparationInMetres, localizationEnabled, params.localizationWindowSize,
+                                      gccPHATHistory, tdoaHistory, backendName=params.backendName, gccPHATMode=params.gccPHATMode,
+                                      gccPHATUpsamplingFactor=params.gccPHATUpsamplingFactor)
+    gccNMFProcessor.numTDOAs = params.numTDOAs
+    gccNMFProcessor.targetMode = TARGET_MODE_WINDOW_FUNCTION
+    gccNMFProcessor.setTargetTDOARange(params.numTDOAs / 2.0 if targetTDOAIndex is None else targetTDOAIndex,
+                                       params.targetTDOAEpsilon, params.targetTDOABeta, params.targetTDOANoiseFloor)
+    gccNMFProcessor.reset()
+    return oladProcessor, gccNMFProcessor, inputFrames, outputFrames
+
+def renderFile(audioPath, outputDir, params, targetTDOAIndex=None, inputDir=None):
+    startTime = time()
+    # the engine is two-channel, as when playing, multichannel recordings (e.g. CHiME arrays) are rendered from their first two channels
+    wavReader = WavReader(audioPath, channelIndexes=range(params.numChannels))
+    oladProcessor, gccNMFProcessor, inputFrames, outputFrames = createProcessors(params, wavReader.numChannels, wavReader.sampleRate, targetTDOAIndex)
+    
+    blockSize = params.blockSize
+    latencyInBlocks = oladProcessor.latencyInBlocks
+    numBlocks = -(-wavReader.numFrames // blockSize) + latencyInBlocks
+    tdoaIndexes = np.zeros(numBlocks, np.float32)
+    
+    outputFilePrefix = getOutputFilePrefix(audioPath, outputDir, inputDir)
+    os.makedirs( dirname(outputFilePrefix), exist_ok=True )
+    with WavWriter(outputFilePrefix + ENHANCED_FILE_SUFFIX, wavReader.sampleRate, wavReader.numChannels) as wavWriter:
+        for blockIndex in range(numBlocks):
+            wavReader.read(blockIndex * blockSize, blockSize, out=inputFrames)
+            oladProcessor.processFrames(gccNMFProcessor.processFrames)
+            tdoaIndexes[blockIndex] = gccNMFProcessor.targetTDOAIndex
+            
+            # drop the overlap-add latency so that the enhanced signal is aligned with the input
+            outputStartFrame = (blockIndex - latencyInBlocks) * blockSize
+            if outputStartFrame >= 0:
+                wavWriter.write( outputFrames[:, :wavReader.numFrames - outputStartFrame] )
+    
+    # TDOA of each block, timestamped at the end of the block it was estimated from
+    tdoaIndexes = tdoaIndexes[:numBlocks - latencyInBlocks]
+    blockEndTimes = np.minimum( (np.arange(len(tdoaIndexes)) + 1) * blockSize, wavReader.numFrames ) / float(wavReader.sampleRate)
+    tdoasInSeconds = np.interp( tdoaIndexes, np.arange(params.numTDOAs), gccNMFProcessor.hypothesisTDOAs )
+    np.savetxt( outputFilePrefix + TDOA_TRACK_FILE_SUFFIX, np.column_stack( [blockEndTimes, tdoaIndexes, tdoasInSeconds] ),
+                fmt=['%.6f', '%.3f', '%.9f'], delimiter=',', header='timeInSeconds,tdoaIndex,tdoaInSeconds', comments='' )
+    
+    processingTime = time() - startTime
+    durationInSeconds = wavReader.numFrames / float(wavReader.sampleRate)
+    return {'audioPath': audioPath, 'outputFilePrefix': outputFilePrefix, 'durationInSeconds': durationInSeconds, 'processingTime': processingTime}
+
+def renderFileTask(arguments):
+    audioPath, outputDir, configPath, overrides, targetTDOAIndex, inputDir = arguments
+    try:
+        params = getGCCNMFConfigParams(audioPath, configPath, overrides)
+        return renderFile(audioPath, outputDir, params, targetTDOAIndex, inputDir)
+    except Exception:
+        return {'audioPath': audioPath, 'error': traceback.format_exc()}
+
+def renderFiles(inputPaths, outputDir, configPath=DEFAULT_CONFIG_FILE, overrides=None, targetTDOAIndex=None, numWorkers=1, numBLASThreads=1):
+    audioPaths = getAudioPaths(inputPaths)
+    if not os.path.exists(outputDir):
+        os.makedirs(outputDir)
+    inputDir = getInputDir(audioPaths)
+    tasks = [(audioPath, outputDir, configPath, overrides, targetTDOAIndex, inputDir) for audioPath in audioPaths]
+    logging.info( 'RenderRealtimeGCCNMF: rendering %d files with %d workers' % (len(tasks), numWorkers) )
+    
+    if numWorkers <= 1:
+        records = [renderFileTask(task) for task in tasks]
+    else:
+        with blasNumThreadsEnvironment(numBLASThreads):
+            pool = get_context('spawn').Pool(numWorkers, initializer=initializeWorker, initargs=(numBLASThreads,))
+            try:
+                records = pool.map(renderFileTask, tasks)
+            finally:
+                pool.close()
+                pool.join()
+    
+    for record in records:
+        if 'error' in record:
+            logging.error( 'RenderRealtimeGCCNMF: %s failed:\n%s' % (record['audioPath'], record['error']) )
+        else:
+            logging.info( 'RenderRealtimeGCCNMF: %s: %.1f s of audio in %.2f s (%.1fx realtime)'
+                          % (record['audioPath'], record['durationInSeconds'], record['processingTime'], record['durationInSeconds'] / record['processingTime']) )
+    return records
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description='Faster than realtime file-to-file rendering with the real-time GCC-NMF engine')
+    parser.add_argument('inputPaths', help='wav files, directories or glob patterns', nargs='+')
+    parser.add_argument('-o', '--output-dir', help='directory for the *%s and *%s outputs' % (ENHANCED_FILE_SUFFIX, TDOA_TRACK_FILE_SUFFIX), required=True)
+    parser.add_argument('-c', '--config', help='config file path', default=DEFAULT_CONFIG_FILE)
+    parser.add_argument('--parameters', help='JSON object overriding config parameters, e.g. {"dictionarySize": 128}', default='{}')
+    parser.add_argument('--target-tdoa-index', help='fixed target TDOA index, the target is localized continuously if omitted', type=float, default=None)
+    parser.add_argument('--num-workers', help='number of files rendered in parallel', type=int, default=1)
+    parser.add_argument('--num-blas-threads', help='BLAS threads per worker', type=int, default=1)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    
+    args = parseArguments()
+    renderFiles(args.inputPaths, args.output_dir, args.config, json.loads(args.parameters), args.target_tdoa_index, args.num_workers, args.num_blas_threads)
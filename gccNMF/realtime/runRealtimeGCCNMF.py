@@ -27,68 +27,90 @@ SOFTWARE.
 '''
 
 import logging
-import ctypes
 import numpy as np
 
-from multiprocessing import Event, Queue, Array, freeze_support
+from multiprocessing import Event, Queue, Semaphore, freeze_support
 
 from gccNMF.defs import DEFAULT_AUDIO_FILE, DEFAULT_CONFIG_FILE
-from gccNMF.realtime.utils import SharedMemoryCircularBuffer, OverlapAddProcessor
+from gccNMF.realtime.utils import SharedMemoryCircularBuffer, SharedMemoryBlockRing, OverlapAddProcessor, NotifyingEvent, NotifyingQueue, getSharedMemoryName, releaseSharedBuffers
 from gccNMF.realtime.config import getGCCNMFConfigParams, parseArguments
 from gccNMF.realtime.audioProcessor import PyAudioStreamProcessor as AudioStreamProcessor
 from gccNMF.realtime.gccNMFProcessor import GCCNMFProcess
+from gccNMF.realtime.gccNMFPretraining import getDictionaryStore
 
 class RealtimeGCCNMF(object):
     def __init__(self, audioPath=DEFAULT_AUDIO_FILE, configPath=DEFAULT_CONFIG_FILE):
-        params = getGCCNMFConfigParams(audioPath, configPath)
+        params = getGCCNMFConfigParams(audioPath, configPath, buildDictionaries=False)
         
         logging.info('RealtimeGCCNMF: Starting with audio path: %s' % params.audioPath)
         
         self.initQueuesAndEvents()
-        self.initSharedArrays(params)
-        self.initHistoryBuffers(params)
-        self.initProcesses(params)
-        
-        self.run(params)
+        try:
+            self.initSharedArrays(params)
+            self.initHistoryBuffers(params)
+            self.initProcesses(params)
+            
+            self.run(params)
+        finally:
+            self.releaseSharedMemory()
     
     def initQueuesAndEvents(self):
+        # everything the GCCNMF process waits for (audio blocks, control messages, terminate) rings its doorbell, so it can block instead of polling
+        self.gccNMFProcessDoorbell = Semaphore(0)
+        
         self.togglePlayAudioProcessQueue = Queue()
         self.togglePlayAudioProcessAck = Event()
-        self.togglePlayGCCNMFProcessQueue = Queue()
+        self.togglePlayGCCNMFProcessQueue = NotifyingQueue(self.gccNMFProcessDoorbell)
         self.togglePlayGCCNMFProcessAck = Event()
-        self.toggleSeparationGCCNMFProcessQueue = Queue()
+        self.toggleSeparationGCCNMFProcessQueue = NotifyingQueue(self.gccNMFProcessDoorbell)
         self.toggleSeparationGCCNMFProcessAck = Event()
-        self.tdoaParamsGCCNMFProcessQueue = Queue()
+        self.tdoaParamsGCCNMFProcessQueue = NotifyingQueue(self.gccNMFProcessDoorbell)
         self.tdoaParamsGCCNMFProcessAck = Event()
+        self.inputRingDiscardQueue = NotifyingQueue(self.gccNMFProcessDoorbell)
+        
+        self.terminateEvent = NotifyingEvent(self.gccNMFProcessDoorbell)
+    
+    def initSharedArrays(self, params):
+        # named shared memory segments, e.g. gccNMF_<pid>_gccPHATHistory, which monitoring processes can attach to by name
+        self.sharedMemoryPrefix = params.sharedMemoryPrefix
+        self.sharedMemoryDType = np.dtype(params.sharedMemoryDType)
+        logging.info( 'RealtimeGCCNMF: shared memory segments: %s_*, dtype: %s' % (self.sharedMemoryPrefix, self.sharedMemoryDType.name) )
         
-        self.processFramesEvent = Event()
-        self.processFramesDoneEvent = Event()
-        self.terminateEvent = Event()
+        # audio blocks pass through lock-free rings, so the audio callback never waits on the processing process
+        self.inputRing = self.createSharedBuffer( SharedMemoryBlockRing, 'inputRing', params.ringBufferDepth, (params.numChannels, params.blockSize) )
+        self.outputRing = self.createSharedBuffer( SharedMemoryBlockRing, 'outputRing', params.ringBufferDepth, (params.numChannels, params.blockSize) )
+        self.inputFrames = np.zeros( (params.numChannels, params.blockSize), self.sharedMemoryDType )
+        self.dictionariesW = getDictionaryStore( params.windowSize, params.dictionarySizes, getSharedMemoryName(self.sharedMemoryPrefix, 'W') )
+        self.outputFrames = np.zeros( (params.numChannels, params.blockSize), self.sharedMemoryDType )
     
-    def initSharedArrays(self, params):    
-        inputFramesArray = Array(ctypes.c_double, params.numChannels*params.blockSize)
-        self.inputFrames = np.frombuffer(inputFramesArray.get_obj()).reshape( (params.numChannels, -1) )
-        outputFramesArray = Array(ctypes.c_double, params.numChannels*params.blockSize)
-        self.outputFrames = np.frombuffer(outputFramesArray.get_obj()).reshape( (params.numChannels, -1) )
+    def createSharedBuffer(self, bufferClass, label, *args):
+        return bufferClass( *args, dtype=self.sharedMemoryDType, name=getSharedMemoryName(self.sharedMemoryPrefix, label) )
         
     def initHistoryBuffers(self, params):
-        self.gccPHATHistory = SharedMemoryCircularBuffer( (params.numTDOAs, params.numTDOAHistory) )
-        self.tdoaHistory = SharedMemoryCircularBuffer( (1, params.numTDOAHistory) )
-        self.inputSpectrogramHistory = SharedMemoryCircularBuffer( (params.numFreq, params.numSpectrogramHistory) )
-        self.outputSpectrogramHistory = SharedMemoryCircularBuffer( (params.numFreq, params.numSpectrogramHistory) )
+        self.gccPHATHistory = self.createSharedBuffer( SharedMemoryCircularBuffer, 'gccPHATHistory', (params.numTDOAs, params.numTDOAHistory) )
+        self.tdoaHistory = self.createSharedBuffer( SharedMemoryCircularBuffer, 'tdoaHistory', (1, params.numTDOAHistory) )
+        self.inputSpectrogramHistory = self.createSharedBuffer( SharedMemoryCircularBuffer, 'inputSpectrogramHistory', (params.numFreq, params.numSpectrogramHistory) )
+        self.outputSpectrogramHistory = self.createSharedBuffer( SharedMemoryCircularBuffer, 'outputSpectrogramHistory', (params.numFreq, params.numSpectrogramHistory) )
         self.coefficientMaskHistories = {}
         for size in params.dictionarySizes:
-            self.coefficientMaskHistories[size] = SharedMemoryCircularBuffer( (size, params.numSpectrogramHistory) )
+            self.coefficientMaskHistories[size] = self.createSharedBuffer( SharedMemoryCircularBuffer, 'coefficientMaskHistory%d' % size, (size, params.numSpectrogramHistory) )
+    
+    def releaseSharedMemory(self):
+        # also called after a failed start, when only some of the buffers exist
+        sharedBufferNames = ['dictionariesW', 'inputRing', 'outputRing', 'gccPHATHistory', 'tdoaHistory',
+                             'inputSpectrogramHistory', 'outputSpectrogramHistory', 'coefficientMaskHistories']
+        releaseSharedBuffers( [getattr(self, sharedBufferName, None) for sharedBufferName in sharedBufferNames] )
         
     def initProcesses(self, params):
         self.audioProcess = AudioStreamProcessor(params.numChannels, params.sampleRate, params.windowSize, params.hopSize, params.blockSize, params.deviceIndex,
                                                  self.togglePlayAudioProcessQueue, self.togglePlayAudioProcessAck,
-                                                 self.inputFrames, self.outputFrames, self.processFramesEvent, self.processFramesDoneEvent, self.terminateEvent)
+                                                 self.inputRing, self.outputRing, self.gccNMFProcessDoorbell, self.inputRingDiscardQueue, self.terminateEvent, params.numLatencyBlocks)
         self.oladProcessor = OverlapAddProcessor(params.numChannels, params.windowSize, params.hopSize, params.blockSize, params.windowsPerBlock, self.inputFrames, self.outputFrames)
-        self.gccNMFProcess = GCCNMFProcess(self.oladProcessor, params.sampleRate, params.windowSize, params.windowsPerBlock, params.dictionariesW, params.dictionaryType, params.dictionarySize, params.numHUpdates, params.microphoneSeparationInMetres, params.localizationEnabled, params.localizationWindowSize,
+        self.gccNMFProcess = GCCNMFProcess(self.oladProcessor, params.sampleRate, params.windowSize, params.windowsPerBlock, self.dictionariesW, params.dictionaryType, params.dictionarySize, params.numHUpdates, params.microphoneSeparationInMetres, params.localizationEnabled, params.localizationWindowSize,
                                            self.gccPHATHistory, self.tdoaHistory, self.inputSpectrogramHistory, self.outputSpectrogramHistory, self.coefficientMaskHistories,
                                            self.tdoaParamsGCCNMFProcessQueue, self.tdoaParamsGCCNMFProcessAck, self.togglePlayGCCNMFProcessQueue, self.togglePlayGCCNMFProcessAck, self.toggleSeparationGCCNMFProcessQueue, self.toggleSeparationGCCNMFProcessAck,
-                                           self.processFramesEvent, self.processFramesDoneEvent, self.terminateEvent)
+                                           self.inputRing, self.outputRing, self.terminateEvent, self.gccNMFProcessDoorbell, self.inputRingDiscardQueue,
+                                           params.backendName, params.gccPHATMode, params.gccPHATUpsamplingFactor)
         self.audioProcess.start()
         self.gccNMFProcess.start()
     
@@ -98,7 +120,7 @@ class RealtimeGCCNMF(object):
             from gccNMF.realtime.gccNMFInterface import RealtimeGCCNMFInterfaceWindow
             
             app = QtGui.QApplication([])
-            gccNMFInterfaceWindow = RealtimeGCCNMFInterfaceWindow(params.audioPath, params.numTDOAs, params.gccPHATNLAlpha, params.gccPHATNLEnabled, params.dictionariesW, params.dictionarySize,
+            gccNMFInterfaceWindow = RealtimeGCCNMFInterfaceWindow(params.audioPath, params.numTDOAs, params.gccPHATNLAlpha, params.gccPHATNLEnabled, self.dictionariesW, params.dictionarySize,
                                                                   params.dictionarySizes, params.dictionaryType, params.numHUpdates, params.localizationEnabled, params.localizationWindowSize,
                                                                   self.gccPHATHistory, self.tdoaHistory, self.inputSpectrogramHistory, self.outputSpectrogramHistory, self.coefficientMaskHistories,
                                                                   self.togglePlayAudioProcessQueue, self.togglePlayAudioProcessAck,
@@ -125,6 +147,7 @@ class RealtimeGCCNMFNoGUI(RealtimeGCCNMF):
     
     def initHistoryBuffers(self, params):
         self.gccPHATHistory = None
+        self.tdoaHistory = None
         self.inputSpectrogramHistory = None
         self.outputSpectrogramHistory = None
         self.coefficientMaskHistories = None
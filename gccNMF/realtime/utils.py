@@ -24,24 +24,195 @@ SOFTWARE.
 @author: Sean UN Wood
 '''
 
-import ctypes
-from time import time
+from time import time, sleep
 import numpy as np
-from numpy import prod, frombuffer, concatenate, exp, abs
-from multiprocessing import Array, Value
+from numpy import prod, concatenate, exp, abs
+from numpy.lib.stride_tricks import as_strided
+from multiprocessing import get_context, queues, synchronize, shared_memory, resource_tracker
 import logging
 
-class SharedMemoryCircularBuffer():
-    def __init__(self, shape, initValue=0):
-        self.array = Array( ctypes.c_double, int(prod(shape)) )
-        self.values = frombuffer(self.array.get_obj()).reshape(shape)
-        self.values[:] = initValue
-        
+DEFAULT_SHARED_MEMORY_DTYPE = np.float32
+# int64 header: counters (circular buffer index, ring indexes and overrun/underrun counts), then dtype, number of dimensions and shape
+SHARED_MEMORY_NUM_COUNTERS = 4
+SHARED_MEMORY_MAX_NUM_DIMENSIONS = 4
+SHARED_MEMORY_HEADER_SIZE = SHARED_MEMORY_NUM_COUNTERS + 2 + SHARED_MEMORY_MAX_NUM_DIMENSIONS
+SHARED_MEMORY_ATTACH_INTERVAL_IN_SECONDS = 0.001
+SHARED_MEMORY_ATTACH_TIMEOUT_IN_SECONDS = 10.0
+
+class NotifyingEvent(synchronize.Event):
+    '''multiprocessing Event that also rings a shared doorbell semaphore when set,
+    so that a consumer can block on the doorbell instead of polling is_set().'''
+    
+    def __init__(self, doorbell, ctx=None):
+        super(NotifyingEvent, self).__init__(ctx=ctx or get_context())
+        self.doorbell = doorbell
+    
+    def set(self):
+        super(NotifyingEvent, self).set()
+        self.doorbell.release()
+
+class NotifyingQueue(queues.Queue):
+    '''multiprocessing Queue that rings a shared doorbell semaphore on put.
+    Queue.empty() can lag behind put() (items are flushed by a feeder thread), so consumers
+    acquire the pending semaphore without blocking to learn that an item is on its way, then get() it.'''
+    
+    def __init__(self, doorbell, maxsize=0, ctx=None):
+        ctx = ctx or get_context()
+        super(NotifyingQueue, self).__init__(maxsize, ctx=ctx)
+        self.doorbell = doorbell
+        self.pending = ctx.Semaphore(0)
+    
+    def put(self, obj, block=True, timeout=None):
+        super(NotifyingQueue, self).put(obj, block, timeout)
+        self.pending.release()
+        self.doorbell.release()
+    
+    def hasPending(self):
+        return self.pending.acquire(False)
+    
+    def __getstate__(self):
+        return super(NotifyingQueue, self).__getstate__() + (self.doorbell, self.pending)
+    
+    def __setstate__(self, state):
+        super(NotifyingQueue, self).__setstate__(state[:-2])
+        self.doorbell, self.pending = state[-2:]
+
+class SharedMemoryArray(object):
+    '''numpy array in a named multiprocessing.shared_memory segment.
+    
+    The segment starts with a small int64 header holding the array's dtype and shape (so that other processes, including
+    external monitors, can attach by name alone) and a few counters used as indexes by the buffers built on top of it.
+    Pickling only transfers the name, the receiving process attaches to the same memory. A segment is visible by name before
+    its creator has sized it and written the header (the dtype last), so attaching waits for both.'''
+    
+    def __init__(self, shape=None, dtype=DEFAULT_SHARED_MEMORY_DTYPE, name=None, create=True, track=True):
+        if create:
+            dtype = np.dtype(dtype)
+            shape = tuple( int(dimension) for dimension in shape )
+            if len(shape) > SHARED_MEMORY_MAX_NUM_DIMENSIONS:
+                raise ValueError('SharedMemoryArray: at most %d dimensions supported, got shape %s' % (SHARED_MEMORY_MAX_NUM_DIMENSIONS, str(shape)))
+            self.sharedMemory = shared_memory.SharedMemory( name=name, create=True, size=SHARED_MEMORY_HEADER_SIZE * 8 + max(1, int(prod(shape)) * dtype.itemsize) )
+            self.header = np.ndarray( (SHARED_MEMORY_HEADER_SIZE,), np.int64, self.sharedMemory.buf )
+            self.header[:] = 0
+            self.header[SHARED_MEMORY_NUM_COUNTERS + 1] = len(shape)
+            self.header[SHARED_MEMORY_NUM_COUNTERS + 2:SHARED_MEMORY_NUM_COUNTERS + 2 + len(shape)] = shape
+            self.header[SHARED_MEMORY_NUM_COUNTERS] = ord(dtype.char)
+        else:
+            self.attach(name, track)
+        self.owner = create
+        self.initValues()
+    
+    def attach(self, name, track=True):
+        startTime = time()
+        while True:
+            try:
+                self.sharedMemory = attachSharedMemory(name, track)
+            except ValueError:
+                # created but not sized yet (mmap of an empty file)
+                self.sharedMemory = None
+            if self.sharedMemory is not None and self.sharedMemory.size >= SHARED_MEMORY_HEADER_SIZE * 8:
+                self.header = np.ndarray( (SHARED_MEMORY_HEADER_SIZE,), np.int64, self.sharedMemory.buf )
+                while self.header[SHARED_MEMORY_NUM_COUNTERS] == 0 and time() - startTime < SHARED_MEMORY_ATTACH_TIMEOUT_IN_SECONDS:
+                    sleep(SHARED_MEMORY_ATTACH_INTERVAL_IN_SECONDS)
+                if self.header[SHARED_MEMORY_NUM_COUNTERS] != 0:
+                    return
+                self.header = None
+            if time() - startTime >= SHARED_MEMORY_ATTACH_TIMEOUT_IN_SECONDS:
+                if self.sharedMemory is not None:
+                    self.sharedMemory.close()
+                raise TimeoutError('SharedMemoryArray: %s was not initialized within %.1f s' % (name, SHARED_MEMORY_ATTACH_TIMEOUT_IN_SECONDS))
+            if self.sharedMemory is not None:
+                self.sharedMemory.close()
+            sleep(SHARED_MEMORY_ATTACH_INTERVAL_IN_SECONDS)
+    
+    def initValues(self):
+        dtype = np.dtype( chr(self.header[SHARED_MEMORY_NUM_COUNTERS]) )
+        numDimensions = self.header[SHARED_MEMORY_NUM_COUNTERS + 1]
+        shape = tuple( int(dimension) for dimension in self.header[SHARED_MEMORY_NUM_COUNTERS + 2:SHARED_MEMORY_NUM_COUNTERS + 2 + numDimensions] )
+        self.counters = self.header[:SHARED_MEMORY_NUM_COUNTERS]
+        self.values = np.ndarray( shape, dtype, self.sharedMemory.buf, offset=SHARED_MEMORY_HEADER_SIZE * 8 )
+    
+    @property
+    def name(self):
+        return self.sharedMemory.name
+    
+    def __getstate__(self):
+        return {'name': self.name}
+    
+    def __setstate__(self, state):
+        self.attach(state['name'])
+        self.owner = False
+        self.initValues()
+    
+    def release(self):
+        # numpy views must be dropped before the segment's buffer can be closed; the creating process also unlinks it
+        self.values = self.header = self.counters = None
+        try:
+            self.sharedMemory.close()
+        except BufferError:
+            logging.warning( 'SharedMemoryArray: %s still referenced, not closed' % self.name )
+        if self.owner:
+            self.sharedMemory.unlink()
+
+def attachSharedMemory(name, track=True):
+    # processes started by this package share the creator's resource tracker; anything else (e.g. a monitoring process)
+    # should attach with track=False, otherwise its own tracker would unlink the segment when it exits
+    if track:
+        return shared_memory.SharedMemory(name=name)
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        sharedMemory = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(sharedMemory._name, 'shared_memory')
+        return sharedMemory
+
+def unlinkSharedMemory(name):
+    # unlinks a segment by name, if it exists
+    try:
+        sharedMemory = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return False
+    sharedMemory.close()
+    sharedMemory.unlink()
+    return True
+
+def getSharedMemoryName(namePrefix, label):
+    return None if namePrefix is None else '%s_%s' % (namePrefix, label)
+
+def releaseSharedBuffers(sharedBuffers):
+    # shared buffers, dicts of them (e.g. coefficientMaskHistories) or None
+    for sharedBuffer in sharedBuffers:
+        if isinstance(sharedBuffer, dict):
+            releaseSharedBuffers( sharedBuffer.values() )
+        elif sharedBuffer is not None:
+            sharedBuffer.release()
+
+class SharedMemoryCounter(object):
+    '''Value-like view (.value) of one of a SharedMemoryArray's header counters (or of any int64 array).'''
+    
+    def __init__(self, counters, index):
+        self.counters = counters
+        self.index = index
+    
+    @property
+    def value(self):
+        return int(self.counters[self.index])
+    
+    @value.setter
+    def value(self, value):
+        self.counters[self.index] = value
+
+class CircularBuffer(object):
+    '''Circular buffer over the last axis of an array in process memory, see SharedMemoryCircularBuffer to share one between processes.'''
+    
+    def __init__(self, shape, initValue=0, dtype=DEFAULT_SHARED_MEMORY_DTYPE):
+        self.values = np.full(shape, initValue, dtype)
         self.numValues = self.values.shape[-1]
-        
-        self.index = Value(ctypes.c_int)    
-        self.index.value = 0
-        
+        self.index = SharedMemoryCounter( np.zeros(1, np.int64), 0 )
+    
+    def release(self):
+        self.values = self.index = None
+    
     def set(self, newValues, index=None):
         index = self.index.value if index is None else index 
         numNewValues = newValues.shape[-1]
@@ -64,12 +235,117 @@ class SharedMemoryCircularBuffer():
         return self.values[..., index]
 
     def getUnraveledArray(self):
-        return concatenate( [self.values[:, self.index.value:], self.values[:, :self.index.value]], axis=-1 ) 
+        index = self.index.value
+        return concatenate( [self.values[:, index:], self.values[:, :index]], axis=-1 ) 
         
     def size(self):
         return self.values.shape[-1]
 
+class SharedMemoryCircularBuffer(CircularBuffer):
+    def __init__(self, shape, initValue=0, dtype=DEFAULT_SHARED_MEMORY_DTYPE, name=None):
+        self.array = SharedMemoryArray(shape, dtype, name)
+        self.initViews()
+        self.values[:] = initValue
+    
+    @classmethod
+    def attach(cls, name, track=False):
+        circularBuffer = cls.__new__(cls)
+        circularBuffer.array = SharedMemoryArray(name=name, create=False, track=track)
+        circularBuffer.initViews()
+        return circularBuffer
+    
+    def initViews(self):
+        self.values = self.array.values
+        self.numValues = self.values.shape[-1]
+        self.index = SharedMemoryCounter(self.array.counters, 0)
+    
+    def __getstate__(self):
+        return {'array': self.array}
+    
+    def __setstate__(self, state):
+        self.array = state['array']
+        self.initViews()
+    
+    def release(self):
+        self.values = self.index = None
+        self.array.release()
+
+class SharedMemoryBlockRing(object):
+    '''Single-producer/single-consumer ring of fixed-size blocks in shared memory.
+    
+    The write and read indexes are monotonic counters, each only ever stored by one side (writeIndex by the producer,
+    readIndex by the consumer), so neither side takes a lock or waits: a full ring drops the new block and counts an
+    overrun, an empty ring counts an underrun. A block is copied into its slot before writeIndex is advanced, so the
+    consumer never sees a partially written block.'''
+    
+    def __init__(self, numBlocks, blockShape, dtype=DEFAULT_SHARED_MEMORY_DTYPE, name=None):
+        self.array = SharedMemoryArray( (numBlocks,) + tuple(blockShape), dtype, name )
+        self.initViews()
+    
+    @classmethod
+    def attach(cls, name, track=False):
+        ring = cls.__new__(cls)
+        ring.array = SharedMemoryArray(name=name, create=False, track=track)
+        ring.initViews()
+        return ring
+    
+    def initViews(self):
+        self.blocks = self.array.values
+        self.numBlocks = self.blocks.shape[0]
+        self.blockShape = self.blocks.shape[1:]
+        self.writeIndex, self.readIndex, self.numOverruns, self.numUnderruns = [SharedMemoryCounter(self.array.counters, index) for index in range(4)]
+    
+    def __getstate__(self):
+        return {'array': self.array}
+    
+    def __setstate__(self, state):
+        self.array = state['array']
+        self.initViews()
+    
+    def release(self):
+        self.blocks = self.writeIndex = self.readIndex = self.numOverruns = self.numUnderruns = None
+        self.array.release()
+    
+    def getNumAvailable(self):
+        return self.writeIndex.value - self.readIndex.value
+    
+    def write(self, block):
+        # producer side only
+        writeIndex = self.writeIndex.value
+        if writeIndex - self.readIndex.value >= self.numBlocks:
+            self.numOverruns.value += 1
+            return False
+        self.blocks[writeIndex % self.numBlocks] = block
+        self.writeIndex.value = writeIndex + 1
+        return True
+    
+    def read(self, out):
+        # consumer side only
+        readIndex = self.readIndex.value
+        if readIndex == self.writeIndex.value:
+            self.numUnderruns.value += 1
+            return False
+        out[:] = self.blocks[readIndex % self.numBlocks]
+        self.readIndex.value = readIndex + 1
+        return True
+    
+    def discard(self, numBlocksToKeep=0, writeIndex=None):
+        # consumer side only, drops all but the newest numBlocksToKeep pending blocks (of those written before writeIndex, if given);
+        # a producer wanting stale blocks dropped sends its current writeIndex to the consumer instead
+        if writeIndex is None:
+            writeIndex = self.writeIndex.value
+        self.readIndex.value = max(self.readIndex.value, writeIndex - numBlocksToKeep)
+    
+    def getCounters(self):
+        return self.numOverruns.value, self.numUnderruns.value
+
 class OverlapAddProcessor(object):
+    '''Streaming STFT framing and overlap-add around a frame processing function.
+    
+    Samples are kept in circular buffers, so nothing is shifted per block: the input ring is mirrored (each block is written
+    twice, bufferSize samples apart) so that the most recent windows are always one contiguous strided view, and processed
+    windows are overlap-added with one vectorised addition per hop-sized window segment, independently of windowsPerBlock.'''
+    
     def __init__(self, numChannels, windowSize, hopSize, blockSize, windowsPerBlock, inputFrames, outputFrames):
         super(OverlapAddProcessor, self).__init__()
         
@@ -83,36 +359,62 @@ class OverlapAddProcessor(object):
         self.inputFrames = inputFrames
         self.outputFrames = outputFrames
         
-        # Buffers        
-        self.numBlocksPerBuffer = 8
+        # windows are front-padded to a whole number of hops, so that each block's windows cover numSegmentsPerBlock hop-aligned segments
+        self.numSegmentsPerWindow = -(-windowSize // hopSize)
+        self.numSegmentsPerBlock = windowsPerBlock + self.numSegmentsPerWindow - 1
+        self.windowsSpanSize = windowSize + (windowsPerBlock - 1) * hopSize
         
-        self.inputBufferIndex = 0
-        self.inputBufferSize = self.blockSize * self.numBlocksPerBuffer
-        self.inputBuffer = np.zeros( (self.numChannels, self.inputBufferSize), np.float32 ) 
-
-        self.outputBufferIndex = 0
-        self.outputBufferSize = self.blockSize * self.numBlocksPerBuffer
-        self.outputBuffer = np.zeros( (self.numChannels, self.outputBufferSize), np.float32 )        
+        # output lags input by whole blocks: two, as in the original engine, or as many as it takes for the last window overlapping a block
+        # to have been added, so that only complete samples are output when windows span more than two blocks
+        self.latencyInBlocks = max(2, -(-(windowSize - 1) // blockSize))
+        
+        # Buffers
+        self.numBlocksPerBuffer = -(-max(self.numSegmentsPerBlock * hopSize, (self.latencyInBlocks + 1) * blockSize) // blockSize)
+        self.bufferSize = self.blockSize * self.numBlocksPerBuffer
+        self.sampleIndex = 0
         
-        self.windowedSamples = np.zeros( (self.numChannels, self.windowSize, self.windowsPerBlock), np.float32 )
+        self.inputBuffer = np.zeros( (self.numChannels, 2 * self.bufferSize), np.float32 )
+        self.outputBuffer = np.zeros( (self.numChannels, self.bufferSize), np.float32 )
+        self.outputSegments = self.outputBuffer.reshape( (self.numChannels, -1, self.hopSize) )
+        
+        # read-only window views for each of the block positions in the ring
+        channelStride, sampleStride = self.inputBuffer.strides
+        self.windowedSamplesViews = [as_strided( self.inputBuffer[:, self.bufferSize + (blockIndex + 1) * self.blockSize - self.windowsSpanSize:],
+                                                 shape=(self.numChannels, self.windowSize, self.windowsPerBlock),
+                                                 strides=(channelStride, sampleStride, self.hopSize * sampleStride), writeable=False )
+                                     for blockIndex in range(self.numBlocksPerBuffer)]
+        
+        # windows not spanning a whole number of hops are copied into a front-padded buffer before being split into segments
+        self.paddedFrames = None
+        if self.windowSize % self.hopSize != 0:
+            self.paddedFrames = np.zeros( (self.numChannels, self.numSegmentsPerWindow * self.hopSize, self.windowsPerBlock), np.float32 )
+        self.overlapAddedSegments = np.zeros( (self.numChannels, self.numSegmentsPerBlock, self.hopSize), np.float32 )
     
     def processFrames(self, processFramesFunction):
-        #startTime = time()
-        self.inputBuffer[:, :-self.blockSize] = self.inputBuffer[:, self.blockSize:]
-        self.inputBuffer[:, -self.blockSize:] = self.inputFrames
+        blockIndex = (self.sampleIndex // self.blockSize) % self.numBlocksPerBuffer
+        writeIndex = blockIndex * self.blockSize
+        self.inputBuffer[:, writeIndex:writeIndex+self.blockSize] = self.inputFrames
+        self.inputBuffer[:, self.bufferSize+writeIndex:self.bufferSize+writeIndex+self.blockSize] = self.inputFrames
+        self.sampleIndex += self.blockSize
+        self.outputBuffer[:, writeIndex:writeIndex+self.blockSize] = 0
+        
+        processedFrames = processFramesFunction(self.windowedSamplesViews[blockIndex])
         
-        self.outputBuffer[:, :-self.blockSize] = self.outputBuffer[:, self.blockSize:]
-        self.outputBuffer[:, -self.blockSize:] = 0
+        if self.paddedFrames is not None:
+            self.paddedFrames[:, -self.windowSize:] = processedFrames
+            processedFrames = self.paddedFrames
         
-        windowIndexes = np.arange(self.inputBufferSize - self.windowSize - (self.windowsPerBlock-1)*self.hopSize, self.inputBufferSize-self.windowSize +1, self.hopSize)
-        for i, windowIndex in enumerate(windowIndexes):
-            self.windowedSamples[..., i] = self.inputBuffer[:, windowIndex:windowIndex+self.windowSize]
+        # as in batchSTFT.overlapAdd, one vectorised addition over all of the block's windows per hop-sized window segment
+        frameSegments = processedFrames.reshape( (self.numChannels, self.numSegmentsPerWindow, self.hopSize, self.windowsPerBlock) )
+        self.overlapAddedSegments[:] = 0
+        for segmentIndex in range(self.numSegmentsPerWindow):
+            self.overlapAddedSegments[:, segmentIndex:segmentIndex+self.windowsPerBlock] += frameSegments[:, segmentIndex].transpose(0, 2, 1)
         
-        processedFrames = processFramesFunction(self.windowedSamples)
+        numRingSegments = self.outputSegments.shape[1]
+        startSegment = ( (self.sampleIndex // self.hopSize) - self.numSegmentsPerBlock ) % numRingSegments
+        numSegmentsAtEnd = min(self.numSegmentsPerBlock, numRingSegments - startSegment)
+        self.outputSegments[:, startSegment:startSegment+numSegmentsAtEnd] += self.overlapAddedSegments[:, :numSegmentsAtEnd]
+        self.outputSegments[:, :self.numSegmentsPerBlock-numSegmentsAtEnd] += self.overlapAddedSegments[:, numSegmentsAtEnd:]
         
-        for i, windowIndex in enumerate(windowIndexes):
-            self.outputBuffer[:, windowIndex:windowIndex+self.windowSize] += processedFrames[..., i]
-            
-        self.outputFrames[:] = self.outputBuffer[:, -3*self.blockSize:-2*self.blockSize]
-        #totalTime = time() - startTime
-        #logging.info('processFrames took %f' % totalTime)
\ No newline at end of file
+        readIndex = (self.sampleIndex - (self.latencyInBlocks + 1) * self.blockSize) % self.bufferSize
+        self.outputFrames[:] = self.outputBuffer[:, readIndex:readIndex+self.blockSize]
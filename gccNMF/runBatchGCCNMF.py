@@ -0,0 +1,193 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2016 Sean UN Wood
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: Sean UN Wood
+'''
+
+import os
+import json
+import logging
+import argparse
+import traceback
+from glob import glob
+from time import time
+from os.path import isdir, join, exists, getsize
+from contextlib import contextmanager
+from multiprocessing import get_context
+
+MIXTURE_FILE_SUFFIX = '_mix.wav'
+BLAS_NUM_THREADS_VARIABLES = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+def getMixtureFilePrefixes(inputPaths):
+    mixtureFileNames = []
+    for inputPath in inputPaths:
+        if isdir(inputPath):
+            mixtureFileNames += sorted( glob( join(inputPath, '*' + MIXTURE_FILE_SUFFIX) ) )
+        else:
+            mixtureFileNames += sorted( glob(inputPath) )
+    mixtureFilePrefixes = [mixtureFileName[:-len(MIXTURE_FILE_SUFFIX)] for mixtureFileName in mixtureFileNames if mixtureFileName.endswith(MIXTURE_FILE_SUFFIX)]
+    return sorted( set(mixtureFilePrefixes) )
+
+def getManifestKey(mixtureFilePrefix, parameters):
+    # a mixture processed with other parameters is not finished for these ones
+    return (mixtureFilePrefix, json.dumps(parameters, sort_keys=True))
+
+def loadManifest(manifestPath):
+    # manifest is a JSON lines file with one record per processed mixture and parameters, appended as results arrive
+    manifest = {}
+    if manifestPath is None or not exists(manifestPath):
+        return manifest
+    with open(manifestPath, 'r') as manifestFile:
+        for line in manifestFile:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logging.warning('runBatchGCCNMF: skipping truncated manifest line: %s' % line.strip())
+                continue
+            manifest[ getManifestKey(record['mixtureFilePrefix'], record['parameters']) ] = record
+    return manifest
+
+def openManifest(manifestPath):
+    # a record truncated by an interrupted run is terminated, so that the next record starts on its own line
+    isTruncated = False
+    if exists(manifestPath) and getsize(manifestPath) > 0:
+        with open(manifestPath, 'rb') as manifestFile:
+            manifestFile.seek(-1, os.SEEK_END)
+            isTruncated = manifestFile.read(1) != b'\n'
+    manifestFile = open(manifestPath, 'a')
+    if isTruncated:
+        manifestFile.write('\n')
+    return manifestFile
+
+def appendManifestRecord(manifestFile, record):
+    manifestFile.write( json.dumps(record) + '\n' )
+    manifestFile.flush()
+    os.fsync( manifestFile.fileno() )
+
+@contextmanager
+def blasNumThreadsEnvironment(numBLASThreads):
+    # must be set before numpy is imported in the worker processes (started with spawn, inheriting this environment),
+    # so it is kept for as long as the pool may start workers, then the caller's environment is restored
+    previousValues = {variableName: os.environ.get(variableName) for variableName in BLAS_NUM_THREADS_VARIABLES}
+    for variableName in BLAS_NUM_THREADS_VARIABLES:
+        os.environ[variableName] = str(numBLASThreads)
+    try:
+        yield
+    finally:
+        for variableName, previousValue in previousValues.items():
+            if previousValue is None:
+                os.environ.pop(variableName, None)
+            else:
+                os.environ[variableName] = previousValue
+
+def initializeWorker(numBLASThreads):
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(numBLASThreads)
+    except ImportError:
+        pass
+
+def separateMixture(arguments):
+    mixtureFilePrefix, parameters = arguments
+    from gccNMF.runGCCNMF import runGCCNMF
+    
+    startTime = time()
+    record = {'mixtureFilePrefix': mixtureFilePrefix, 'parameters': parameters}
+    try:
+        runGCCNMF(mixtureFilePrefix, **parameters)
+        record['status'] = STATUS_DONE
+    except Exception:
+        record['status'] = STATUS_FAILED
+        record['error'] = traceback.format_exc()
+    record['processingTime'] = time() - startTime
+    return record
+
+def runBatchGCCNMF(inputPaths, parameters, numWorkers=1, numBLASThreads=1, manifestPath=None, retryFailed=False):
+    mixtureFilePrefixes = getMixtureFilePrefixes(inputPaths)
+    manifest = loadManifest(manifestPath)
+    skippedStatuses = [STATUS_DONE] if retryFailed else [STATUS_DONE, STATUS_FAILED]
+    pendingMixtureFilePrefixes = [mixtureFilePrefix for mixtureFilePrefix in mixtureFilePrefixes
+                                  if manifest.get( getManifestKey(mixtureFilePrefix, parameters), {} ).get('status') not in skippedStatuses]
+    logging.info( 'runBatchGCCNMF: %d mixtures found, %d already in manifest, %d to process with %d workers'
+                  % (len(mixtureFilePrefixes), len(mixtureFilePrefixes) - len(pendingMixtureFilePrefixes), len(pendingMixtureFilePrefixes), numWorkers) )
+    
+    tasks = [(mixtureFilePrefix, parameters) for mixtureFilePrefix in pendingMixtureFilePrefixes]
+    records = []
+    manifestFile = openManifest(manifestPath) if manifestPath is not None else None
+    try:
+        with blasNumThreadsEnvironment(numBLASThreads):
+            pool = get_context('spawn').Pool(numWorkers, initializer=initializeWorker, initargs=(numBLASThreads,))
+            try:
+                for record in pool.imap_unordered(separateMixture, tasks):
+                    records.append(record)
+                    if manifestFile:
+                        appendManifestRecord(manifestFile, record)
+                    if record['status'] == STATUS_DONE:
+                        logging.info( 'runBatchGCCNMF: [%d/%d] %s done in %.1f s' % (len(records), len(tasks), record['mixtureFilePrefix'], record['processingTime']) )
+                    else:
+                        logging.error( 'runBatchGCCNMF: [%d/%d] %s failed:\n%s' % (len(records), len(tasks), record['mixtureFilePrefix'], record['error']) )
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        if manifestFile:
+            manifestFile.close()
+    return records
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description='Batch GCC-NMF separation of *%s files' % MIXTURE_FILE_SUFFIX)
+    parser.add_argument('inputPaths', help='directories containing *%s files, or glob patterns' % MIXTURE_FILE_SUFFIX, nargs='+')
+    parser.add_argument('--window-size', type=int, default=1024)
+    parser.add_argument('--hop-size', type=int, default=128)
+    parser.add_argument('--num-tdoas', type=int, default=128)
+    parser.add_argument('--microphone-separation', help='microphone separation in metres', type=float, default=1.0)
+    parser.add_argument('--num-targets', help='number of sources, estimated from the angular spectrum if omitted (requires scikit-learn)', type=int, default=None)
+    parser.add_argument('--dictionary-size', type=int, default=128)
+    parser.add_argument('--num-iterations', type=int, default=100)
+    parser.add_argument('--backend', help='compute backend (numpy, numba or torch)', default='numpy')
+    parser.add_argument('--parameters', help='JSON object of additional runGCCNMF keyword arguments', default='{}')
+    parser.add_argument('--num-workers', type=int, default=os.cpu_count())
+    parser.add_argument('--num-blas-threads', help='BLAS threads per worker', type=int, default=1)
+    parser.add_argument('--manifest', help='JSON lines manifest used to skip finished mixtures when resuming', default=None)
+    parser.add_argument('--retry-failed', help='reprocess mixtures recorded as failed in the manifest', action='store_true')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    
+    args = parseArguments()
+    parameters = {'windowSize': args.window_size,
+                  'hopSize': args.hop_size,
+                  'numTDOAs': args.num_tdoas,
+                  'microphoneSeparationInMetres': args.microphone_separation,
+                  'numTargets': args.num_targets,
+                  'dictionarySize': args.dictionary_size,
+                  'numIterations': args.num_iterations,
+                  'backendName': args.backend}
+    parameters.update( json.loads(args.parameters) )
+    
+    records = runBatchGCCNMF(args.inputPaths, parameters, args.num_workers, args.num_blas_threads, args.manifest, args.retry_failed)
+    numFailed = len( [record for record in records if record['status'] != STATUS_DONE] )
+    logging.info( 'runBatchGCCNMF: %d processed, %d failed' % (len(records), numFailed) )
@@ -24,34 +24,106 @@ SOFTWARE.
 @author: Sean UN Wood
 '''
 
-from gccNMFFunctions import *
-from gccNMFPlotting import *
+from gccNMF.gccNMFFunctions import *
+from gccNMF.realtime.gccNMFPretraining import getDictionariesW
+from gccNMF.gccNMFCache import ArrayCache, getFileHash, getWindowHash, getCachedArrays
+from gccNMF.gccNMFProfiling import getStageProfiler
+from gccNMF.runStreamingGCCNMF import runStreamingGCCNMF
+from gccNMF.wavfile import CLIP_PROTECTION_RESCALE
 
-def runGCCNMF(mixtureFilePrefix, windowSize, hopSize, numTDOAs, microphoneSeparationInMetres, numTargets=None, windowFunction=hanning):
+def runGCCNMF(mixtureFilePrefix, windowSize, hopSize, numTDOAs, microphoneSeparationInMetres, numTargets=None, windowFunction=hanning, backendName='numpy',
+              dictionarySize=128, numIterations=100, sparsityAlpha=0, nmfTolerance=None, nmfObjectiveInterval=None, numNMFThreads=1,
+              onlineNMF=False, numFramesPerNMFBlock=2048, numHIterations=10, numOnlineNMFPasses=1,
+              pretrainedW=False, hTolerance=None, cacheDir=None, cacheMaxSizeInBytes=None, profile=False, profileMemory=True, profileReportPath=None):
     maxTDOA = microphoneSeparationInMetres / SPEED_OF_SOUND_IN_METRES_PER_SECOND
     tdoasInSeconds = linspace(-maxTDOA, maxTDOA, numTDOAs).astype(float32)
     
     mixtureFileName = getMixtureFileName(mixtureFilePrefix)
-    stereoSamples, sampleRate = loadMixtureSignal(mixtureFileName)
-    complexMixtureSpectrogram = computeComplexMixtureSpectrogram(stereoSamples, windowSize, hopSize, windowFunction)
+    profiler = getStageProfiler(profile, profileMemory)
+    
+    def getProfileReport(numTargetsFound, sampleRate):
+        profiler.stop()
+        if not profile:
+            return None
+        profiler.metadata = {'mixtureFileName': mixtureFileName,
+                             'durationInSeconds': WavReader(mixtureFileName).numFrames / float(sampleRate),
+                             'parameters': {'windowSize': windowSize, 'hopSize': hopSize, 'numTDOAs': numTDOAs, 'numTargets': numTargetsFound,
+                                            'dictionarySize': dictionarySize, 'numIterations': numIterations, 'backendName': backendName,
+                                            'onlineNMF': onlineNMF, 'pretrainedW': pretrainedW, 'cached': cache is not None}}
+        profiler.logReport()
+        if profileReportPath is not None:
+            profiler.saveReport(profileReportPath)
+        return profiler.getReport()
+    
+    if onlineNMF:
+        # out-of-core: every stage streams blocks of numFramesPerNMFBlock frames, so memory does not grow with the file length
+        # (and there are no full-length intermediates to cache); outputs are rescaled on clipping, as wavwrite does
+        cache = None
+        with profiler.stage('streaming'):
+            _, targetTDOAIndexes = runStreamingGCCNMF(mixtureFilePrefix, windowSize, hopSize, numTDOAs, microphoneSeparationInMetres, numTargets, windowFunction,
+                                                      backendName, dictionarySize, numFramesPerNMFBlock, numHIterations, sparsityAlpha, hTolerance,
+                                                      numOnlineNMFPasses, clipProtectionMode=CLIP_PROTECTION_RESCALE)
+        return getProfileReport( len(targetTDOAIndexes), getSampleRate(mixtureFileName) )
+    
+    cache = ArrayCache(cacheDir, cacheMaxSizeInBytes) if cacheDir is not None else None
+    inputHash = getFileHash(mixtureFileName) if cache is not None else None
+    
+    def computeSpectrogram():
+        with profiler.stage('load'):
+            stereoSamples, _ = loadMixtureSignal(mixtureFileName)
+        with profiler.stage('stft'):
+            return [ computeComplexMixtureSpectrogram(stereoSamples, windowSize, hopSize, windowFunction) ]
+    
+    stftParameters = {'windowSize': windowSize, 'hopSize': hopSize, 'windowFunction': getWindowHash(windowFunction, windowSize)}
+    [complexMixtureSpectrogram] = getCachedArrays(cache, inputHash, 'stft', stftParameters, ['complexMixtureSpectrogram'], computeSpectrogram)
+    sampleRate = getSampleRate(mixtureFileName)
     numChannels, numFrequencies, numTime = complexMixtureSpectrogram.shape
     frequenciesInHz = linspace(0, sampleRate / 2.0, numFrequencies)
     
-    V = concatenate( abs(complexMixtureSpectrogram), axis=-1 )
-    W, H = performKLNMF(V, dictionarySize=128, numIterations=100, sparsityAlpha=0)
-    stereoH = array( hsplit(H, numChannels) )
+    def computeNMF():
+        if pretrainedW:
+            W = getDictionariesW(windowSize, [dictionarySize], dictionaryTypes=['Pretrained'])['Pretrained'][dictionarySize]
+            V = concatenate( abs(complexMixtureSpectrogram), axis=-1 )
+            stereoH = array( hsplit( getKLNMFActivations(V, W, numHIterations, sparsityAlpha, tolerance=hTolerance), numChannels ) )
+        else:
+            V = concatenate( abs(complexMixtureSpectrogram), axis=-1 )
+            W, H, nmfStats = performKLNMFWithStats(V, dictionarySize, numIterations, sparsityAlpha, tolerance=nmfTolerance, objectiveInterval=nmfObjectiveInterval, numThreads=numNMFThreads)
+            logging.info( 'runGCCNMF: NMF stopped after %d iterations (%.3f s per iteration)' % (nmfStats['numIterations'], nmfStats['timePerIteration']) )
+            stereoH = array( hsplit(H, numChannels) )
+        return [W, stereoH]
     
-    spectralCoherenceV = complexMixtureSpectrogram[0] * complexMixtureSpectrogram[1].conj() / abs(complexMixtureSpectrogram[0]) / abs(complexMixtureSpectrogram[1])
-    angularSpectrogram = getAngularSpectrogram(spectralCoherenceV, frequenciesInHz, microphoneSeparationInMetres, numTDOAs)
-    meanAngularSpectrum = mean(angularSpectrogram, axis=-1) 
-    targetTDOAIndexes = estimateTargetTDOAIndexesFromAngularSpectrum(meanAngularSpectrum, microphoneSeparationInMetres, numTDOAs, numTargets)
-
-    targetTDOAGCCNMFs = getTargetTDOAGCCNMFs(spectralCoherenceV, microphoneSeparationInMetres, numTDOAs, frequenciesInHz, targetTDOAIndexes, W, stereoH)
-    targetCoefficientMasks = getTargetCoefficientMasks(targetTDOAGCCNMFs, numTargets)
-    targetSpectrogramEstimates = getTargetSpectrogramEstimates(targetCoefficientMasks, complexMixtureSpectrogram, W, stereoH)
-    targetSignalEstimates = getTargetSignalEstimates(targetSpectrogramEstimates, windowSize, hopSize, windowFunction)
+    nmfParameters = dict( stftParameters, dictionarySize=dictionarySize, sparsityAlpha=sparsityAlpha, onlineNMF=onlineNMF, pretrainedW=pretrainedW )
+    if pretrainedW:
+        nmfParameters.update( {'numHIterations': numHIterations, 'hTolerance': hTolerance} )
+    else:
+        # numNMFThreads only changes floating point summation order, so it is not part of the key
+        nmfParameters.update( {'numIterations': numIterations, 'nmfTolerance': nmfTolerance, 'nmfObjectiveInterval': nmfObjectiveInterval} )
+    with profiler.stage('nmf'):
+        W, stereoH = getCachedArrays(cache, inputHash, 'nmf', nmfParameters, ['W', 'stereoH'], computeNMF)
+    
+    with profiler.stage('coherence'):
+        spectralCoherenceV = getSpectralCoherenceV(complexMixtureSpectrogram, backendName)
+    angularSpectrogramParameters = dict( stftParameters, numTDOAs=numTDOAs, microphoneSeparationInMetres=microphoneSeparationInMetres )
+    with profiler.stage('angularSpectrogram'):
+        [angularSpectrogram] = getCachedArrays( cache, inputHash, 'angularSpectrogram', angularSpectrogramParameters, ['angularSpectrogram'],
+                                                lambda: [ getAngularSpectrogram(spectralCoherenceV, frequenciesInHz, microphoneSeparationInMetres, numTDOAs, backendName) ] )
+    with profiler.stage('localization'):
+        meanAngularSpectrum = mean(angularSpectrogram, axis=-1) 
+        targetTDOAIndexes = estimateTargetTDOAIndexesFromAngularSpectrum(meanAngularSpectrum, microphoneSeparationInMetres, numTDOAs, numTargets)
     
-    saveTargetSignalEstimates(targetSignalEstimates, sampleRate, mixtureFileNamePrefix)
+    with profiler.stage('gccNMF'):
+        targetTDOAGCCNMFs = getTargetTDOAGCCNMFs(spectralCoherenceV, microphoneSeparationInMetres, numTDOAs, frequenciesInHz, targetTDOAIndexes, W, stereoH, backendName)
+    with profiler.stage('masks'):
+        targetCoefficientMasks = getTargetCoefficientMasks(targetTDOAGCCNMFs, len(targetTDOAIndexes), backendName)
+    with profiler.stage('reconstruction'):
+        targetSpectrogramEstimates = getTargetSpectrogramEstimates(targetCoefficientMasks, complexMixtureSpectrogram, W, stereoH, backendName)
+    with profiler.stage('istft'):
+        targetSignalEstimates = getTargetSignalEstimates(targetSpectrogramEstimates, windowSize, hopSize, windowFunction)
+    
+    with profiler.stage('save'):
+        saveTargetSignalEstimates(targetSignalEstimates, sampleRate, mixtureFilePrefix)
+    
+    return getProfileReport( len(targetTDOAIndexes), sampleRate )
 
 if __name__ == '__main__':
     # Preprocessing params
@@ -63,10 +135,34 @@ if __name__ == '__main__':
     # TDOA params
     numTDOAs = 128
     
+    # Compute backend (numpy, numba or torch)
+    backendName = 'numpy'
+    
     # NMF params
     dictionarySize = 128
     numIterations = 100
     sparsityAlpha = 0
+    nmfTolerance = None # relative change in KL objective below which NMF stops early, None for fixed iterations
+    nmfObjectiveInterval = None # iterations between objective evaluations, None for every 10 when nmfTolerance is set and never otherwise
+    numNMFThreads = 1 # > 1 partitions the columns of V across a thread pool
+    
+    # Online NMF params (the whole pipeline streams blocks of STFT frames from disk, see runStreamingGCCNMF.py)
+    onlineNMF = False
+    numFramesPerNMFBlock = 2048
+    numHIterations = 10
+    numOnlineNMFPasses = 1
+    
+    # Pretrained W params (H-only updates with the realtime dictionaries, see realtime/gccNMFPretraining.py)
+    pretrainedW = False
+    hTolerance = None
+    
+    # Cache params (STFT, NMF and angular spectrogram reused across runs on the same input file)
+    cacheDir = None
+    cacheMaxSizeInBytes = 10 * 2**30
+    
+    # Profiling params (per-stage wall time, CPU time and peak memory, saved as JSON)
+    profile = False
+    profileReportPath = None
     
     # Input params    
     mixtureFileNamePrefix = '../data/dev1_female3_liverec_130ms_1m'
@@ -74,4 +170,8 @@ if __name__ == '__main__':
     numSources = 3
     
     runGCCNMF( mixtureFileNamePrefix, windowSize, hopSize, numTDOAs,
-               microphoneSeparationInMetres, numSources, windowFunction )
\ No newline at end of file
+               microphoneSeparationInMetres, numSources, windowFunction, backendName,
+               dictionarySize, numIterations, sparsityAlpha, nmfTolerance, nmfObjectiveInterval, numNMFThreads,
+               onlineNMF, numFramesPerNMFBlock, numHIterations, numOnlineNMFPasses,
+               pretrainedW, hTolerance, cacheDir, cacheMaxSizeInBytes,
+               profile, profileReportPath=profileReportPath )
\ No newline at end of file
@@ -0,0 +1,85 @@
+'''
+The MIT License (MIT)
+
+Copyright (c) 2016 Sean UN Wood
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: Sean UN Wood
+'''
+
+from gccNMF.gccNMFFunctions import *
+from gccNMF.wavfile import CLIP_PROTECTION_LIMITER
+
+def runStreamingGCCNMF(mixtureFilePrefix, windowSize, hopSize, numTDOAs, microphoneSeparationInMetres, numTargets=None, windowFunction=hanning, backendName='numpy',
+                       dictionarySize=128, numFramesPerBlock=1024, numHIterations=50, sparsityAlpha=0, hTolerance=None, numOnlineNMFPasses=1,
+                       W=None, targetTDOAIndexes=None, threaded=False, maxQueueSize=2, clipProtectionMode=CLIP_PROTECTION_LIMITER):
+    '''Out-of-core runGCCNMF: every stage works on blocks of numFramesPerBlock STFT frames, so peak memory does not depend on the file length.
+    Unless given, the target TDOAs and W are estimated in a first pass over the file (mean angular spectrum and online NMF;
+    estimating the number of targets when numTargets is None requires scikit-learn),
+    and the separation pass then streams read -> STFT -> coherence -> H / GCC-NMF / masks -> ISTFT -> write, with each stage
+    running in its own thread when threaded is set.'''
+    mixtureFileName = getMixtureFileName(mixtureFilePrefix)
+    sampleRate = getSampleRate(mixtureFileName)
+    frequenciesInHz = linspace(0, sampleRate / 2.0, windowSize // 2 + 1)
+    getBlocks = lambda: getComplexMixtureSpectrogramBlocks(mixtureFileName, windowSize, hopSize, windowFunction, numFramesPerBlock)
+    
+    if targetTDOAIndexes is None:
+        meanAngularSpectrum = getMeanAngularSpectrumFromBlocks(getBlocks(), frequenciesInHz, microphoneSeparationInMetres, numTDOAs, backendName)
+        targetTDOAIndexes = estimateTargetTDOAIndexesFromAngularSpectrum(meanAngularSpectrum, microphoneSeparationInMetres, numTDOAs, numTargets)
+    if W is None:
+        getVBlocks = lambda: ( concatenate( abs(complexMixtureSpectrogramBlock), axis=-1 ) for complexMixtureSpectrogramBlock in getBlocks() )
+        W, _ = performOnlineKLNMF(getVBlocks, dictionarySize, numHIterations, sparsityAlpha, numPasses=numOnlineNMFPasses)
+    
+    threadStage = (lambda blocks: getThreadedIterator(blocks, maxQueueSize)) if threaded else (lambda blocks: blocks)
+    complexMixtureSpectrogramBlocks = threadStage( getBlocks() )
+    targetSpectrogramEstimateBlocks = threadStage( getTargetSpectrogramEstimateBlocks(complexMixtureSpectrogramBlocks, frequenciesInHz, microphoneSeparationInMetres, numTDOAs,
+                                                                                      targetTDOAIndexes, W, numHIterations, sparsityAlpha, hTolerance, backendName) )
+    targetSignalEstimateBlocks = threadStage( getTargetSignalEstimateBlocks(targetSpectrogramEstimateBlocks, windowSize, hopSize, windowFunction) )
+    saveTargetSignalEstimateBlocks(targetSignalEstimateBlocks, sampleRate, mixtureFilePrefix, clipProtectionMode)
+    return W, targetTDOAIndexes
+
+if __name__ == '__main__':
+    # Preprocessing params
+    windowSize = 1024
+    hopSize = 128
+    windowFunction = hanning
+    
+    # TDOA params
+    numTDOAs = 128
+    
+    # Compute backend (numpy, numba or torch)
+    backendName = 'numpy'
+    
+    # NMF params
+    dictionarySize = 128
+    numHIterations = 50
+    sparsityAlpha = 0
+    
+    # Streaming params
+    numFramesPerBlock = 1024
+    threaded = True
+    
+    # Input params
+    mixtureFileNamePrefix = '../data/dev1_female3_liverec_130ms_1m'
+    microphoneSeparationInMetres = 1.0
+    numSources = 3
+    
+    runStreamingGCCNMF( mixtureFileNamePrefix, windowSize, hopSize, numTDOAs, microphoneSeparationInMetres, numSources, windowFunction, backendName,
+                        dictionarySize, numFramesPerBlock, numHIterations, sparsityAlpha, threaded=threaded )
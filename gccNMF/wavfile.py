@@ -24,12 +24,21 @@ SOFTWARE.
 @author: Sean UN Wood
 '''
 
+import os
+import struct
 import numpy as np
 import contextlib
 from scipy.io import wavfile
+from scipy.ndimage import minimum_filter1d, uniform_filter1d
 import logging
 
 CLIP_PROTECTION_MAX_SAMPLE_VALUE = 0.99
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+CLIP_PROTECTION_LIMITER = 'limiter'
+CLIP_PROTECTION_RESCALE = 'rescale'
+CLIP_PROTECTION_NONE = 'none'
 
 def wavread(filePath):
     sampleRate, samples_pcm = wavfile.read(filePath)
@@ -46,6 +55,208 @@ def wavwrite(samples_float32, filePath, sampleRate, clipProtection=True):
             raise ValueError('wavwrite: max abs signal value exceeds 1')
     samples_pcm = float2pcm( samples_float32.astype(np.float32) )
     wavfile.write( filePath, sampleRate, samples_pcm.T )
+
+class WavReader(object):
+    '''Memory-mapped PCM WAV reader (16, 24 or 32-bit integer samples).
+    
+    Only the requested windows are converted to float, optionally into a caller-owned buffer,
+    so neither the file nor its decoded samples are ever held in memory as a whole.'''
+    
+    def __init__(self, filePath, channelIndexes=None):
+        self.filePath = filePath
+        self.parseHeader()
+        
+        self.channelIndexes = list(range(self.numFileChannels)) if channelIndexes is None else list(channelIndexes)
+        self.numChannels = len(self.channelIndexes)
+        if not all( [0 <= channelIndex < self.numFileChannels for channelIndex in self.channelIndexes] ):
+            raise ValueError('WavReader: channel indexes %s out of range for %d channel file' % (str(self.channelIndexes), self.numFileChannels))
+        
+        if self.bitsPerSample == 24:
+            self.samples = np.memmap(filePath, dtype=np.uint8, mode='r', offset=self.dataOffset, shape=(self.numFrames, self.blockAlign))
+            self.scratch = np.zeros(0, '<i4')
+        else:
+            sampleDType = '<i%d' % (self.bitsPerSample // 8)
+            self.samples = np.memmap(filePath, dtype=sampleDType, mode='r', offset=self.dataOffset, shape=(self.numFrames, self.numFileChannels))
+        self.scale = 1.0 / 2 ** (self.bitsPerSample - 1) if self.bitsPerSample != 24 else 1.0 / 2 ** 31
+    
+    def parseHeader(self):
+        with open(self.filePath, 'rb') as wavFile:
+            riffHeader = wavFile.read(12)
+            if len(riffHeader) < 12 or riffHeader[:4] != b'RIFF' or riffHeader[8:12] != b'WAVE':
+                raise ValueError('WavReader: %s is not a RIFF WAVE file' % self.filePath)
+            
+            formatChunk = None
+            while True:
+                chunkHeader = wavFile.read(8)
+                if len(chunkHeader) < 8:
+                    raise ValueError('WavReader: no data chunk found in %s' % self.filePath)
+                chunkID, chunkSize = chunkHeader[:4], struct.unpack('<I', chunkHeader[4:])[0]
+                if chunkID == b'fmt ':
+                    formatChunk = wavFile.read(chunkSize)
+                    wavFile.seek(chunkSize % 2, 1)
+                elif chunkID == b'data':
+                    self.dataOffset = wavFile.tell()
+                    fileSize = os.fstat( wavFile.fileno() ).st_size
+                    dataSize = min(chunkSize, fileSize - self.dataOffset)
+                    break
+                else:
+                    wavFile.seek(chunkSize + chunkSize % 2, 1)
+        
+        if formatChunk is None:
+            raise ValueError('WavReader: no fmt chunk found in %s' % self.filePath)
+        audioFormat, self.numFileChannels, self.sampleRate, _, self.blockAlign, self.bitsPerSample = struct.unpack('<HHIIHH', formatChunk[:16])
+        if audioFormat == WAVE_FORMAT_EXTENSIBLE and len(formatChunk) >= 26:
+            audioFormat = struct.unpack('<H', formatChunk[24:26])[0]
+        if audioFormat != WAVE_FORMAT_PCM or self.bitsPerSample not in [16, 24, 32]:
+            raise ValueError('WavReader: unsupported format in %s (format %d, %d bits), expected 16, 24 or 32-bit PCM' % (self.filePath, audioFormat, self.bitsPerSample))
+        self.numFrames = dataSize // self.blockAlign
+    
+    def __len__(self):
+        return self.numFrames
+    
+    def read(self, startFrame=0, numFrames=None, out=None):
+        '''Returns frames [startFrame, startFrame + numFrames) of the selected channels as (numChannels, numFrames) floats in [-1, 1).
+        If out is given, samples are written there (zero padded past the end of the file) and no memory is allocated for 16 and 32-bit files.'''
+        if numFrames is None:
+            numFrames = self.numFrames - startFrame if out is None else out.shape[-1]
+        if out is None:
+            out = np.empty( (self.numChannels, numFrames), np.float32 )
+        numAvailableFrames = max( 0, min(numFrames, self.numFrames - startFrame) )
+        
+        if self.bitsPerSample == 24:
+            if self.scratch.size < numAvailableFrames * self.numFileChannels:
+                self.scratch = np.zeros(numAvailableFrames * self.numFileChannels, '<i4')
+            scratch = self.scratch[:numAvailableFrames * self.numFileChannels]
+            pcm24to32( self.samples[startFrame:startFrame + numAvailableFrames].reshape(-1), self.numFileChannels, out=scratch )
+            samples = scratch.reshape(numAvailableFrames, self.numFileChannels)
+        else:
+            samples = self.samples[startFrame:startFrame + numAvailableFrames]
+        
+        if self.channelIndexes == list( range(self.numFileChannels) ):
+            out[:, :numAvailableFrames] = samples.T
+        else:
+            for outputIndex, channelIndex in enumerate(self.channelIndexes):
+                out[outputIndex, :numAvailableFrames] = samples[:, channelIndex]
+        out[:, :numAvailableFrames] *= self.scale
+        out[:, numAvailableFrames:numFrames] = 0
+        return out
+    
+    def close(self):
+        self.samples = None
+
+class WavWriter(object):
+    '''Streaming 16, 24 or 32-bit PCM WAV writer: blocks of (numChannels, numSamples) float samples are appended as they are produced,
+    and the RIFF and data chunk sizes are patched into the header on close.
+    
+    Clip protection modes:
+        CLIP_PROTECTION_LIMITER: lookahead limiter keeping samples below CLIP_PROTECTION_MAX_SAMPLE_VALUE, gain smoothed over lookaheadSize samples
+        CLIP_PROTECTION_RESCALE: two passes over a float32 memmap, rescaling the whole signal as wavwrite does
+        CLIP_PROTECTION_NONE: raises ValueError for samples at or above 1'''
+    
+    def __init__(self, filePath, sampleRate, numChannels, bitsPerSample=16, clipProtectionMode=CLIP_PROTECTION_LIMITER, lookaheadSize=256, blockSize=2**16):
+        if bitsPerSample not in [16, 24, 32]:
+            raise ValueError('WavWriter: unsupported bits per sample: %d' % bitsPerSample)
+        if clipProtectionMode not in [CLIP_PROTECTION_LIMITER, CLIP_PROTECTION_RESCALE, CLIP_PROTECTION_NONE]:
+            raise ValueError('WavWriter: unknown clip protection mode: %s' % str(clipProtectionMode))
+        
+        self.filePath = filePath
+        self.sampleRate = sampleRate
+        self.numChannels = numChannels
+        self.bitsPerSample = bitsPerSample
+        self.clipProtectionMode = clipProtectionMode
+        self.blockSize = blockSize
+        self.numFrames = 0
+        
+        self.wavFile = open(filePath, 'wb')
+        self.writeHeader()
+        
+        if clipProtectionMode == CLIP_PROTECTION_LIMITER:
+            self.lookaheadSize = lookaheadSize
+            self.contextSize = 3 * lookaheadSize // 2 + 1
+            self.pendingSamples = np.zeros( (numChannels, 0), np.float32 )
+            self.previousTargetGains = np.ones(self.contextSize, np.float32)
+        elif clipProtectionMode == CLIP_PROTECTION_RESCALE:
+            self.temporaryFilePath = filePath + '.%d.f32' % os.getpid()
+            self.temporaryFile = open(self.temporaryFilePath, 'wb')
+            self.maxAbsValue = 0.0
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        self.close()
+    
+    def writeHeader(self):
+        bytesPerSample = self.bitsPerSample // 8
+        dataSize = self.numFrames * self.numChannels * bytesPerSample
+        self.wavFile.seek(0)
+        self.wavFile.write( b'RIFF' + struct.pack('<I', 36 + dataSize) + b'WAVE' )
+        self.wavFile.write( b'fmt ' + struct.pack('<IHHIIHH', 16, WAVE_FORMAT_PCM, self.numChannels, self.sampleRate,
+                                                  self.sampleRate * self.numChannels * bytesPerSample, self.numChannels * bytesPerSample, self.bitsPerSample) )
+        self.wavFile.write( b'data' + struct.pack('<I', dataSize) )
+    
+    def write(self, samples):
+        samples = np.asarray(samples, np.float32).reshape(self.numChannels, -1)
+        if self.clipProtectionMode == CLIP_PROTECTION_LIMITER:
+            self.writeLimited(samples)
+        elif self.clipProtectionMode == CLIP_PROTECTION_RESCALE:
+            if samples.size:
+                self.maxAbsValue = max( self.maxAbsValue, float( np.max(np.abs(samples)) ) )
+            self.temporaryFile.write( np.ascontiguousarray(samples.T).tobytes() )
+        else:
+            if samples.size and np.max(np.abs(samples)) >= 1:
+                raise ValueError('WavWriter: max abs signal value exceeds 1')
+            self.writePCM(samples)
+    
+    def writePCM(self, samples):
+        if self.bitsPerSample == 24:
+            pcm = np.ascontiguousarray( float2pcm(samples.T, 'int32') ).view(np.uint8).reshape(-1, 4)[:, 1:]
+        else:
+            pcm = float2pcm(samples.T, 'int%d' % self.bitsPerSample)
+        self.wavFile.write( np.ascontiguousarray(pcm).tobytes() )
+        self.numFrames += samples.shape[-1]
+    
+    def writeLimited(self, samples, flush=False):
+        # gains are the per-sample target gains min-filtered over +/- lookaheadSize then averaged over +/- lookaheadSize / 2,
+        # so every applied gain is at most the target gain of its own sample and samples never exceed the threshold
+        pendingSamples = np.concatenate( [self.pendingSamples, samples], axis=-1 )
+        peakValues = np.max( np.abs(pendingSamples), axis=0 )
+        targetGains = np.minimum( 1, CLIP_PROTECTION_MAX_SAMPLE_VALUE / np.maximum(peakValues, CLIP_PROTECTION_MAX_SAMPLE_VALUE) )
+        futureGains = np.ones(self.contextSize, np.float32) if flush else np.zeros(0, np.float32)
+        contextGains = np.concatenate( [self.previousTargetGains, targetGains, futureGains] )
+        
+        numReadySamples = pendingSamples.shape[-1] if flush else max(0, pendingSamples.shape[-1] - self.contextSize)
+        if numReadySamples == 0:
+            self.pendingSamples = pendingSamples
+            return
+        gains = minimum_filter1d(contextGains, 2 * self.lookaheadSize + 1, mode='nearest')
+        gains = uniform_filter1d(gains, self.lookaheadSize + 1 - self.lookaheadSize % 2, mode='nearest')
+        gains = np.minimum( gains[self.contextSize:self.contextSize + numReadySamples], targetGains[:numReadySamples] )
+        self.writePCM( pendingSamples[:, :numReadySamples] * gains )
+        
+        self.previousTargetGains = contextGains[numReadySamples:numReadySamples + self.contextSize]
+        self.pendingSamples = pendingSamples[:, numReadySamples:]
+    
+    def close(self):
+        if self.wavFile is None:
+            return
+        if self.clipProtectionMode == CLIP_PROTECTION_LIMITER:
+            self.writeLimited( np.zeros( (self.numChannels, 0), np.float32 ), flush=True )
+        elif self.clipProtectionMode == CLIP_PROTECTION_RESCALE:
+            self.temporaryFile.close()
+            scale = CLIP_PROTECTION_MAX_SAMPLE_VALUE / self.maxAbsValue if self.maxAbsValue >= 1 else 1.0
+            if scale != 1.0:
+                logging.warning('WavWriter: max abs signal value exceeds 1, rescaling to %2f' % CLIP_PROTECTION_MAX_SAMPLE_VALUE)
+            if os.path.getsize(self.temporaryFilePath):
+                floatSamples = np.memmap(self.temporaryFilePath, dtype=np.float32, mode='r').reshape(-1, self.numChannels)
+                for startIndex in range(0, floatSamples.shape[0], self.blockSize):
+                    self.writePCM( floatSamples[startIndex:startIndex + self.blockSize].T * scale )
+                del floatSamples
+            os.remove(self.temporaryFilePath)
+        
+        self.writeHeader()
+        self.wavFile.close()
+        self.wavFile = None
     
 """
 Helper functions for working with audio files in NumPy.
@@ -131,7 +342,7 @@ def float2pcm(sig, dtype='int16'):
     return (sig * abs_max + offset).clip(i.min, i.max).astype(dtype)
 
 
-def pcm24to32(data, channels=1, normalize=True):
+def pcm24to32(data, channels=1, normalize=True, out=None):
     """Convert 24-bit PCM data to 32-bit.
 
     Parameters
@@ -155,20 +366,28 @@ def pcm24to32(data, channels=1, normalize=True):
         value was padded with zero-bits in the least significant byte
         (``normalize=True``) or in the most significant byte
         (``normalize=False``).
+    out : numpy.ndarray, optional
+        C-contiguous *int32* array with ``len(data) // 3`` elements, reused
+        instead of allocating a new one.
 
     """
     if len(data) % 3 != 0:
         raise ValueError('Size of data must be a multiple of 3 bytes')
 
-    out = np.zeros(len(data) // 3, dtype='<i4')
+    if out is None:
+        out = np.zeros(len(data) // 3, dtype='<i4')
+    elif out.size != len(data) // 3 or out.dtype != np.dtype('<i4'):
+        raise ValueError("'out' must be an int32 array with len(data) // 3 elements")
     out.shape = -1, channels
     temp = out.view('uint8').reshape(-1, 4)
     if normalize:
         # write to last 3 columns, leave LSB at zero
         columns = slice(1, None)
+        temp[:, 0] = 0
     else:
         # write to first 3 columns, leave MSB at zero
         columns = slice(None, -1)
+        temp[:, -1] = 0
     temp[:, columns] = np.frombuffer(data, dtype='uint8').reshape(-1, 3)
     return out
 
@@ -0,0 +1,75 @@
+'''
+Generates baselineGCCNMFProcessor.npz, the reference outputs of the original Theano GCCNMFProcessor used by test_baselineReference.py.
+It must be run against the baseline tree, in an environment where Theano is importable, e.g.:
+
+    git archive 0f8bca3 gccNMF | tar -x -C /tmp/baseline
+    THEANO_FLAGS="cxx=,blas.ldflags=" python tests/data/generateBaselineReference.py /tmp/baseline
+
+Inputs are stored alongside the outputs so that the test does not depend on the random number generator.
+'''
+
+import sys
+import argparse
+import numpy as np
+from os.path import join, dirname
+
+SAMPLE_RATE = 16000
+WINDOW_SIZE = 256
+NUM_TIME_PER_CHUNK = 4
+NUM_CHUNKS = 3
+DICTIONARY_SIZE = 8
+NUM_TDOAS = 16
+MICROPHONE_SEPARATION_IN_METRES = 0.1
+DELAY_IN_SAMPLES = 1
+TARGET_TDOA_PARAMETERS = [NUM_TDOAS * 0.3, 2.0, 2.0, 0.1]
+REFERENCE_FILE_NAME = 'baselineGCCNMFProcessor.npz'
+
+def getInputs(seedValue=0):
+    # a low-pass and a high-pass noise source at opposite delays, so that atoms covering different bands localize to different TDOAs,
+    # framed as the OverlapAddProcessor does
+    randomState = np.random.RandomState(seedValue)
+    hopSize = WINDOW_SIZE // 2
+    numFrames = NUM_CHUNKS * NUM_TIME_PER_CHUNK
+    numSamples = (numFrames + 1) * hopSize
+    lowPassSource = np.convolve( randomState.randn(numSamples + 2*DELAY_IN_SAMPLES + 7), np.ones(8) / 2.0, mode='valid' )
+    highPassSource = np.diff( randomState.randn(numSamples + 2*DELAY_IN_SAMPLES + 1) )
+    stereoSignal = np.vstack( [lowPassSource[2*DELAY_IN_SAMPLES:] + highPassSource[:numSamples], lowPassSource[:numSamples] + highPassSource[2*DELAY_IN_SAMPLES:]] )
+    stereoSignal += 0.01 * randomState.randn(*stereoSignal.shape)
+    frames = np.stack( [stereoSignal[:, frameIndex*hopSize:frameIndex*hopSize+WINDOW_SIZE] for frameIndex in range(numFrames)], axis=-1 )
+    windowedSamplesChunks = frames.reshape(2, WINDOW_SIZE, NUM_CHUNKS, NUM_TIME_PER_CHUNK).transpose(2, 0, 1, 3)
+    # each atom covers one frequency band
+    numFrequencies = WINDOW_SIZE // 2 + 1
+    atomBands = np.minimum( np.arange(numFrequencies) * DICTIONARY_SIZE // numFrequencies, DICTIONARY_SIZE - 1 )
+    W = 0.1 * randomState.rand(numFrequencies, DICTIONARY_SIZE) + (atomBands[:, np.newaxis] == np.arange(DICTIONARY_SIZE))
+    return np.ascontiguousarray(windowedSamplesChunks, np.float32), W.astype(np.float32)
+
+def getReferenceOutputs(GCCNMFProcessor, targetMode, windowedSamplesChunks, W):
+    gccNMFProcessor = GCCNMFProcessor(SAMPLE_RATE, WINDOW_SIZE, NUM_TIME_PER_CHUNK, {'Random': {DICTIONARY_SIZE: W}}, 'Random', DICTIONARY_SIZE, 0,
+                                      MICROPHONE_SEPARATION_IN_METRES, False, 6)
+    gccNMFProcessor.numTDOAs = NUM_TDOAS
+    gccNMFProcessor.targetMode = targetMode
+    gccNMFProcessor.reset()
+    gccNMFProcessor.setTargetTDOARange(*TARGET_TDOA_PARAMETERS)
+
+    outputs = {'gccPHAT': [], 'coefficientMask': [], 'outputFrames': []}
+    for windowedSamples in windowedSamplesChunks:
+        outputs['outputFrames'].append( gccNMFProcessor.processFrames(windowedSamples) )
+        realGCC = gccNMFProcessor.getComplexGCC()[0].real
+        outputs['gccPHAT'].append( np.nanmean(realGCC, axis=0).T )
+        outputs['coefficientMask'].append( gccNMFProcessor.getTFMask(realGCC)[1] )
+    return {outputName: np.array(outputValues, np.float32) for outputName, outputValues in outputs.items()}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate the baseline GCCNMFProcessor reference outputs (requires Theano)')
+    parser.add_argument('baselineDir', help='directory containing the baseline gccNMF package')
+    args = parser.parse_args()
+
+    sys.path.insert(0, args.baselineDir)
+    from gccNMF.realtime.gccNMFProcessor import GCCNMFProcessor, TARGET_MODE_BOXCAR, TARGET_MODE_WINDOW_FUNCTION
+
+    windowedSamplesChunks, W = getInputs()
+    referenceArrays = {'windowedSamplesChunks': windowedSamplesChunks, 'W': W}
+    for targetModeName, targetMode in [('boxcar', TARGET_MODE_BOXCAR), ('windowFunction', TARGET_MODE_WINDOW_FUNCTION)]:
+        for outputName, outputValues in getReferenceOutputs(GCCNMFProcessor, targetMode, windowedSamplesChunks, W).items():
+            referenceArrays['%s_%s' % (targetModeName, outputName)] = outputValues
+    np.savez_compressed( join(dirname(__file__), REFERENCE_FILE_NAME), **referenceArrays )
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from os.path import join, dirname
+
+from gccNMF.defs import TARGET_MODE_BOXCAR, TARGET_MODE_WINDOW_FUNCTION
+from gccNMF.gccNMFBackends import BACKENDS
+from gccNMF.realtime.gccNMFProcessor import GCCNMFProcessor
+
+# outputs of the original Theano GCCNMFProcessor, see data/generateBaselineReference.py
+REFERENCE_PATH = join(dirname(__file__), 'data', 'baselineGCCNMFProcessor.npz')
+SAMPLE_RATE = 16000
+NUM_TDOAS = 16
+MICROPHONE_SEPARATION_IN_METRES = 0.1
+TARGET_TDOA_PARAMETERS = [NUM_TDOAS * 0.3, 2.0, 2.0, 0.1]
+BACKEND_MODULES = {'numba': 'numba', 'torch': 'torch'}
+
+def getOutputs(backendName, targetMode, windowedSamplesChunks, W):
+    numChunks, _, windowSize, numTimePerChunk = windowedSamplesChunks.shape
+    dictionarySize = W.shape[1]
+    gccNMFProcessor = GCCNMFProcessor(SAMPLE_RATE, windowSize, numTimePerChunk, {'Random': {dictionarySize: W}}, 'Random', dictionarySize, 0,
+                                      MICROPHONE_SEPARATION_IN_METRES, False, 6, backendName=backendName)
+    gccNMFProcessor.numTDOAs = NUM_TDOAS
+    gccNMFProcessor.targetMode = targetMode
+    gccNMFProcessor.reset()
+    gccNMFProcessor.setTargetTDOARange(*TARGET_TDOA_PARAMETERS)
+    
+    outputs = {'gccPHAT': [], 'coefficientMask': [], 'outputFrames': []}
+    for windowedSamples in windowedSamplesChunks:
+        outputs['outputFrames'].append( gccNMFProcessor.processFrames(windowedSamples) )
+        outputs['gccPHAT'].append( gccNMFProcessor.getAngularSpectrogram().copy() )
+        outputs['coefficientMask'].append( gccNMFProcessor.HMask.copy() )
+    return {outputName: np.array(outputValues) for outputName, outputValues in outputs.items()}
+
+@pytest.mark.parametrize('targetModeName, targetMode', [('boxcar', TARGET_MODE_BOXCAR), ('windowFunction', TARGET_MODE_WINDOW_FUNCTION)])
+@pytest.mark.parametrize('backendName', list(BACKENDS.keys()))
+def testMatchesBaselineEngine(backendName, targetModeName, targetMode):
+    if backendName in BACKEND_MODULES:
+        pytest.importorskip(BACKEND_MODULES[backendName])
+    reference = np.load(REFERENCE_PATH)
+    outputs = getOutputs(backendName, targetMode, reference['windowedSamplesChunks'], reference['W'])
+    
+    np.testing.assert_allclose( outputs['gccPHAT'], reference['%s_gccPHAT' % targetModeName], atol=1e-5 )
+    np.testing.assert_allclose( outputs['coefficientMask'], reference['%s_coefficientMask' % targetModeName], atol=1e-6 )
+    np.testing.assert_allclose( outputs['outputFrames'], reference['%s_outputFrames' % targetModeName], atol=1e-5 )
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from gccNMF.batchSTFT import batchSTFT, batchISTFT, overlapAdd
+from gccNMF.librosaSTFT import stft, istft
+
+WINDOW_SIZE = 256
+HOP_SIZE = 64
+NUM_SAMPLES = 4000
+
+def getSignals(leadingShape=(3, 2), seedValue=0):
+    return np.random.RandomState(seedValue).randn( *(leadingShape + (NUM_SAMPLES,)) ).astype(np.float32)
+
+def testBatchSTFTMatchesLibrosa():
+    signals = getSignals()
+    spectrograms = batchSTFT(signals, WINDOW_SIZE, HOP_SIZE, np.hanning)
+    for targetIndex in range(signals.shape[0]):
+        for channelIndex in range(signals.shape[1]):
+            spectrogram = stft(signals[targetIndex, channelIndex].copy(), WINDOW_SIZE, HOP_SIZE, WINDOW_SIZE, np.hanning, center=False)
+            np.testing.assert_allclose(spectrograms[targetIndex, channelIndex], spectrogram, atol=1e-4)
+
+def testBatchISTFTMatchesLibrosa():
+    spectrograms = batchSTFT(getSignals(), WINDOW_SIZE, HOP_SIZE, np.hanning)
+    signals = batchISTFT(spectrograms, WINDOW_SIZE, HOP_SIZE, np.hanning)
+    for targetIndex in range(spectrograms.shape[0]):
+        for channelIndex in range(spectrograms.shape[1]):
+            signal = istft(spectrograms[targetIndex, channelIndex], HOP_SIZE, WINDOW_SIZE, np.hanning, center=False)
+            np.testing.assert_allclose(signals[targetIndex, channelIndex], signal, atol=1e-5)
+
+@pytest.mark.parametrize('hopSize', [HOP_SIZE, 100])
+def testRoundTripReconstructsSignals(hopSize):
+    signals = getSignals()
+    reconstructedSignals = batchISTFT( batchSTFT(signals, WINDOW_SIZE, hopSize, np.hanning), WINDOW_SIZE, hopSize, np.hanning )
+    
+    # normalize by the overlap-added squared window, away from the edges where it vanishes
+    numFrames = 1 + (NUM_SAMPLES - WINDOW_SIZE) // hopSize
+    windowSums = overlapAdd( np.tile(np.hanning(WINDOW_SIZE) ** 2, (numFrames, 1)), hopSize )
+    interior = slice(WINDOW_SIZE, len(windowSums) - WINDOW_SIZE)
+    np.testing.assert_allclose( reconstructedSignals[..., interior] / windowSums[interior], signals[..., interior], atol=1e-4 )
+
+@pytest.mark.parametrize('hopSize', [HOP_SIZE, 100])
+def testOverlapAddMatchesLoop(hopSize):
+    frames = np.random.RandomState(1).randn(3, 20, WINDOW_SIZE)
+    signals = np.zeros( (3, WINDOW_SIZE + hopSize * 19) )
+    for frameIndex in range(20):
+        signals[:, frameIndex*hopSize:frameIndex*hopSize+WINDOW_SIZE] += frames[:, frameIndex]
+    np.testing.assert_allclose(overlapAdd(frames, hopSize), signals)
+
+def testBatchSTFTRejectsInvalidInputs():
+    with pytest.raises(ValueError):
+        batchSTFT( np.zeros(WINDOW_SIZE - 1, np.float32), WINDOW_SIZE, HOP_SIZE )
+    with pytest.raises(ValueError):
+        batchSTFT( np.zeros(NUM_SAMPLES, np.float32), WINDOW_SIZE, HOP_SIZE, np.hanning(WINDOW_SIZE // 2) )
@@ -0,0 +1,157 @@
+import numpy as np
+import pytest
+
+from gccNMF.defs import GCC_PHAT_MODE_EXPLICIT, GCC_PHAT_MODE_FFT
+from gccNMF.gccNMFBackends import BACKENDS, getBackend, getExpJOmegaTauTable
+from gccNMF.gccNMFFunctions import (getSpectralCoherenceV, getAngularSpectrogram, getTargetTDOAGCCNMFs, getTargetCoefficientMasks,
+                                    getTargetSpectrogramEstimates, getTDOAsInSeconds, getFrequenciesInHz)
+
+SAMPLE_RATE = 16000
+NUM_FREQUENCIES = 65
+NUM_TIME = 40
+NUM_TDOAS = 24
+DICTIONARY_SIZE = 6
+MICROPHONE_SEPARATION_IN_METRES = 0.1
+TARGET_TDOA_INDEXES = [5, 17]
+BACKEND_MODULES = {'numba': 'numba', 'torch': 'torch'}
+
+@pytest.fixture(params=list(BACKENDS.keys()))
+def backendName(request):
+    if request.param in BACKEND_MODULES:
+        pytest.importorskip(BACKEND_MODULES[request.param])
+    return request.param
+
+def getInputs(seedValue=0):
+    randomState = np.random.RandomState(seedValue)
+    spectrogramShape = (2, NUM_FREQUENCIES, NUM_TIME)
+    complexMixtureSpectrogram = (randomState.randn(*spectrogramShape) + 1j * randomState.randn(*spectrogramShape)).astype(np.complex64)
+    W = randomState.rand(NUM_FREQUENCIES, DICTIONARY_SIZE).astype(np.float32)
+    stereoH = randomState.rand(2, DICTIONARY_SIZE, NUM_TIME).astype(np.float32)
+    return complexMixtureSpectrogram, W, stereoH
+
+# reference implementations, as in the original gccNMFFunctions
+def getReferenceCoherenceV(complexMixtureSpectrogram):
+    return complexMixtureSpectrogram[0] * complexMixtureSpectrogram[1].conj() / np.abs(complexMixtureSpectrogram[0]) / np.abs(complexMixtureSpectrogram[1])
+
+def getReferenceExpJOmegaTau(frequenciesInHz):
+    return np.exp( np.outer(frequenciesInHz, -(2j * np.pi) * getTDOAsInSeconds(MICROPHONE_SEPARATION_IN_METRES, NUM_TDOAS)) )
+
+def getReferenceAngularSpectrogram(coherenceV, frequenciesInHz):
+    FREQ, TIME, TDOA = range(3)
+    return np.sum( np.einsum( coherenceV, [FREQ, TIME], getReferenceExpJOmegaTau(frequenciesInHz), [FREQ, TDOA], [TDOA, FREQ, TIME] ).real, axis=1 )
+
+def getReferenceTargetTDOAGCCNMFs(coherenceV, frequenciesInHz, W, targetTDOAIndexes=TARGET_TDOA_INDEXES):
+    expJOmegaTau = getReferenceExpJOmegaTau(frequenciesInHz)
+    TIME, FREQ, ATOM = range(3)
+    targetTDOAGCCNMFs = np.empty( (len(targetTDOAIndexes), W.shape[1], coherenceV.shape[1]), np.float32 )
+    for targetIndex, targetTDOAIndex in enumerate(targetTDOAIndexes):
+        gccChunk = np.einsum( coherenceV, [FREQ, TIME], expJOmegaTau[:, targetTDOAIndex], [FREQ], [FREQ, TIME] )
+        targetTDOAGCCNMFs[targetIndex] = np.einsum( W, [FREQ, ATOM], gccChunk, [FREQ, TIME], [ATOM, TIME] ).real
+    return targetTDOAGCCNMFs
+
+def getReferenceTargetCoefficientMasks(targetTDOAGCCNMFs, numTargets):
+    nanArgMax = np.nanargmax(targetTDOAGCCNMFs, axis=0)
+    targetCoefficientMasks = np.zeros_like(targetTDOAGCCNMFs)
+    for targetIndex in range(numTargets):
+        targetCoefficientMasks[targetIndex][np.where(nanArgMax == targetIndex)] = 1
+    return targetCoefficientMasks
+
+def getReferenceTargetSpectrogramEstimates(targetCoefficientMasks, complexMixtureSpectrogram, W, stereoH):
+    targetSpectrogramEstimates = np.zeros( (targetCoefficientMasks.shape[0],) + complexMixtureSpectrogram.shape, np.complex64 )
+    for targetIndex, targetCoefficientMask in enumerate(targetCoefficientMasks):
+        for channelIndex, coefficients in enumerate(stereoH):
+            targetSpectrogramEstimates[targetIndex, channelIndex] = np.dot(W, coefficients * targetCoefficientMask)
+    return targetSpectrogramEstimates * np.exp( 1j * np.angle(complexMixtureSpectrogram) )
+
+def testGetBackendReturnsSharedInstance(backendName):
+    assert getBackend(backendName) is getBackend(backendName.upper())
+    with pytest.raises(ValueError):
+        getBackend('unknown')
+
+def testGCCNMFMatchesReference(backendName):
+    complexMixtureSpectrogram, W, stereoH = getInputs()
+    frequenciesInHz = getFrequenciesInHz(SAMPLE_RATE, NUM_FREQUENCIES)
+    
+    coherenceV = getSpectralCoherenceV(complexMixtureSpectrogram, backendName)
+    referenceCoherenceV = getReferenceCoherenceV(complexMixtureSpectrogram)
+    np.testing.assert_allclose(coherenceV, referenceCoherenceV, atol=1e-6)
+    
+    angularSpectrogram = getAngularSpectrogram(coherenceV, frequenciesInHz, MICROPHONE_SEPARATION_IN_METRES, NUM_TDOAS, backendName)
+    np.testing.assert_allclose( angularSpectrogram, getReferenceAngularSpectrogram(referenceCoherenceV, frequenciesInHz), atol=1e-4 )
+    
+    targetTDOAGCCNMFs = getTargetTDOAGCCNMFs(coherenceV, MICROPHONE_SEPARATION_IN_METRES, NUM_TDOAS, frequenciesInHz, TARGET_TDOA_INDEXES, W, stereoH, backendName)
+    referenceTargetTDOAGCCNMFs = getReferenceTargetTDOAGCCNMFs(referenceCoherenceV, frequenciesInHz, W)
+    np.testing.assert_allclose(targetTDOAGCCNMFs, referenceTargetTDOAGCCNMFs, atol=1e-4)
+    
+    numTargets = len(TARGET_TDOA_INDEXES)
+    targetCoefficientMasks = getTargetCoefficientMasks(referenceTargetTDOAGCCNMFs, numTargets, backendName)
+    np.testing.assert_array_equal( targetCoefficientMasks, getReferenceTargetCoefficientMasks(referenceTargetTDOAGCCNMFs, numTargets) )
+    
+    targetSpectrogramEstimates = getTargetSpectrogramEstimates(targetCoefficientMasks, complexMixtureSpectrogram, W, stereoH, backendName)
+    referenceTargetSpectrogramEstimates = getReferenceTargetSpectrogramEstimates(targetCoefficientMasks, complexMixtureSpectrogram, W, stereoH)
+    np.testing.assert_allclose(targetSpectrogramEstimates, referenceTargetSpectrogramEstimates, rtol=1e-5, atol=1e-5)
+
+@pytest.mark.parametrize('seedValue', range(4))
+def testTargetStagesMatchPerTargetLoops(backendName, seedValue):
+    # batched GCC-NMF, masks and reconstruction against the original loops over targets and channels, for 1 to 4 targets
+    complexMixtureSpectrogram, W, stereoH = getInputs(seedValue)
+    randomState = np.random.RandomState(seedValue)
+    targetTDOAIndexes = sorted( randomState.choice(NUM_TDOAS, seedValue + 1, replace=False) )
+    # silent bins take a zero phase, as exp(1j * angle(0)) == 1
+    complexMixtureSpectrogram[:, randomState.rand(NUM_FREQUENCIES, NUM_TIME) < 0.05] = 0
+    frequenciesInHz = getFrequenciesInHz(SAMPLE_RATE, NUM_FREQUENCIES)
+    coherenceV = getReferenceCoherenceV(complexMixtureSpectrogram + 1e-3).astype(np.complex64)
+    
+    targetTDOAGCCNMFs = getTargetTDOAGCCNMFs(coherenceV, MICROPHONE_SEPARATION_IN_METRES, NUM_TDOAS, frequenciesInHz, targetTDOAIndexes, W, stereoH, backendName)
+    referenceTargetTDOAGCCNMFs = getReferenceTargetTDOAGCCNMFs(coherenceV, frequenciesInHz, W, targetTDOAIndexes)
+    assert targetTDOAGCCNMFs.dtype == np.float32
+    np.testing.assert_allclose(targetTDOAGCCNMFs, referenceTargetTDOAGCCNMFs, atol=1e-4)
+    
+    # NaNs (e.g. from silent frames) are ignored by the argmax unless a coefficient is NaN for every target
+    numTargets = len(targetTDOAIndexes)
+    if numTargets > 1:
+        referenceTargetTDOAGCCNMFs[0, randomState.rand(DICTIONARY_SIZE, NUM_TIME) < 0.1] = np.nan
+    targetCoefficientMasks = getTargetCoefficientMasks(referenceTargetTDOAGCCNMFs, numTargets, backendName)
+    referenceTargetCoefficientMasks = getReferenceTargetCoefficientMasks(referenceTargetTDOAGCCNMFs, numTargets)
+    np.testing.assert_array_equal(targetCoefficientMasks, referenceTargetCoefficientMasks)
+    
+    targetSpectrogramEstimates = getTargetSpectrogramEstimates(referenceTargetCoefficientMasks, complexMixtureSpectrogram, W, stereoH, backendName)
+    referenceTargetSpectrogramEstimates = getReferenceTargetSpectrogramEstimates(referenceTargetCoefficientMasks, complexMixtureSpectrogram, W, stereoH)
+    assert targetSpectrogramEstimates.shape == (numTargets, 2, NUM_FREQUENCIES, NUM_TIME)
+    np.testing.assert_allclose(targetSpectrogramEstimates, referenceTargetSpectrogramEstimates, rtol=1e-5, atol=1e-5)
+
+@pytest.mark.parametrize('gccPHATMode', [GCC_PHAT_MODE_EXPLICIT, GCC_PHAT_MODE_FFT])
+@pytest.mark.parametrize('maxMemoryInBytes, numThreads', [(1, 1), (1, 3), (4096, 2), (16384, 1), (16384, 4), (None, 3)])
+def testBlockedAngularSpectrogramMatchesUnblocked(backendName, gccPHATMode, maxMemoryInBytes, numThreads, monkeypatch):
+    complexMixtureSpectrogram, _, _ = getInputs()
+    frequenciesInHz = getFrequenciesInHz(SAMPLE_RATE, NUM_FREQUENCIES)
+    coherenceV = getSpectralCoherenceV(complexMixtureSpectrogram, backendName)
+    angularSpectrogram = getAngularSpectrogram(coherenceV, frequenciesInHz, MICROPHONE_SEPARATION_IN_METRES, NUM_TDOAS, backendName,
+                                               gccPHATMode=gccPHATMode)
+    
+    # record the blocks the time axis is split into
+    backend = getBackend(backendName)
+    blockMethodName = 'getAngularSpectrogramFFT' if gccPHATMode == GCC_PHAT_MODE_FFT else 'getAngularSpectrogram'
+    getBlockAngularSpectrogram = getattr(backend, blockMethodName)
+    blockSizes = []
+    def getRecordedBlockAngularSpectrogram(coherenceV, *args, **kwargs):
+        blockSizes.append(coherenceV.shape[1])
+        return getBlockAngularSpectrogram(coherenceV, *args, **kwargs)
+    monkeypatch.setattr(backend, blockMethodName, getRecordedBlockAngularSpectrogram)
+    
+    blockedAngularSpectrogram = getAngularSpectrogram(coherenceV, frequenciesInHz, MICROPHONE_SEPARATION_IN_METRES, NUM_TDOAS, backendName,
+                                                      maxMemoryInBytes=maxMemoryInBytes, numThreads=numThreads, gccPHATMode=gccPHATMode)
+    assert len(blockSizes) > 1
+    assert sum(blockSizes) == NUM_TIME
+    np.testing.assert_allclose(blockedAngularSpectrogram, angularSpectrogram, atol=1e-5)
+
+def testFusedGCCNMFMatchesUnfused(backendName):
+    backend = getBackend(backendName)
+    complexMixtureSpectrogram, W, _ = getInputs()
+    coherenceV = backend.getSpectralCoherence(complexMixtureSpectrogram)
+    expJOmegaTau = getReferenceExpJOmegaTau( getFrequenciesInHz(SAMPLE_RATE, NUM_FREQUENCIES) ).astype(np.complex64)
+    
+    gccNMF = backend.getGCCNMF( backend.getGCCPHAT(coherenceV, expJOmegaTau), W )
+    # a block size smaller than one frame's GCC-PHAT exercises the blocking
+    fusedGCCNMF = backend.getGCCNMFFused( coherenceV, getExpJOmegaTauTable(expJOmegaTau), W, maxBlockSize=NUM_FREQUENCIES * NUM_TDOAS * 3 )
+    np.testing.assert_allclose(fusedGCCNMF, gccNMF, atol=1e-4)
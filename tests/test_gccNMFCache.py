@@ -0,0 +1,111 @@
+import os
+import numpy as np
+import pytest
+from glob import glob
+from functools import partial
+from os.path import join
+
+from gccNMF import gccNMFCache
+from gccNMF.gccNMFCache import ArrayCache, getCacheKey, getWindowHash, getCachedArrays
+from gccNMF.runGCCNMF import runGCCNMF
+from gccNMF.gccNMFFunctions import getSourceEstimateFileName
+from gccNMF.wavfile import wavread, wavwrite
+
+ARRAY_SIZE = 1000
+SAMPLE_RATE = 16000
+
+class ComputeCounter(object):
+    def __init__(self, *arrays):
+        self.arrays = list(arrays)
+        self.numCalls = 0
+    
+    def __call__(self):
+        self.numCalls += 1
+        return self.arrays
+
+def getArray(value):
+    return np.full(ARRAY_SIZE, value, np.float32)
+
+def testMissComputesThenHitLoads(tmpdir):
+    cache = ArrayCache( str(tmpdir) )
+    computeArrays = ComputeCounter( getArray(1), getArray(2) )
+    for _ in range(2):
+        arrays = getCachedArrays(cache, 'inputHash', 'stage', {'a': 1}, ['x', 'y'], computeArrays)
+        np.testing.assert_array_equal(arrays[0], getArray(1))
+        np.testing.assert_array_equal(arrays[1], getArray(2))
+    assert computeArrays.numCalls == 1
+    # a missing array of an entry is a miss
+    os.remove( cache.getArrayPath( getCacheKey('inputHash', 'stage', {'a': 1}), 'y' ) )
+    getCachedArrays(cache, 'inputHash', 'stage', {'a': 1}, ['x', 'y'], computeArrays)
+    assert computeArrays.numCalls == 2
+    
+    computeArrays = ComputeCounter( getArray(3) )
+    assert getCachedArrays(None, 'inputHash', 'stage', {}, ['x'], computeArrays) == computeArrays.arrays
+    assert computeArrays.numCalls == 1
+
+def testKeyDependsOnInputStageAndParameters():
+    key = getCacheKey('inputHash', 'stft', {'windowSize': 1024, 'hopSize': 128})
+    assert getCacheKey('inputHash', 'stft', {'hopSize': 128, 'windowSize': 1024}) == key
+    assert len( {key, getCacheKey('otherInputHash', 'stft', {'windowSize': 1024, 'hopSize': 128}),
+                 getCacheKey('inputHash', 'nmf', {'windowSize': 1024, 'hopSize': 128}),
+                 getCacheKey('inputHash', 'stft', {'windowSize': 1024, 'hopSize': 256})} ) == 4
+
+def testWindowHashDependsOnSamplesOnly():
+    windowHash = getWindowHash(np.hanning, 256)
+    assert getWindowHash(np.hanning(256), 256) == windowHash
+    assert getWindowHash(lambda windowSize: np.hanning(windowSize), 256) == windowHash
+    assert getWindowHash(np.hanning, 512) != windowHash
+    assert getWindowHash(np.hamming, 256) != windowHash
+    assert getWindowHash( partial(np.kaiser, beta=8), 256 ) != getWindowHash( partial(np.kaiser, beta=4), 256 )
+
+def testLeastRecentlyUsedEntriesAreEvictedFirst(tmpdir):
+    cache = ArrayCache( str(tmpdir) )
+    for keyIndex, key in enumerate(['a', 'b', 'c']):
+        cache.put(key, ['x'], [getArray(keyIndex)])
+        os.utime( cache.getArrayPath(key, 'x'), (100 * (keyIndex + 1), 100 * (keyIndex + 1)) )
+    entrySize = os.path.getsize( cache.getArrayPath('a', 'x') )
+    
+    # a hit makes 'a' the most recently used, so 'b' then 'c' are evicted to fit two entries
+    assert cache.get('a', ['x']) is not None
+    cache.maxSizeInBytes = int(2.5 * entrySize)
+    cache.put('d', ['x'], [getArray(3)])
+    assert [cache.get(key, ['x']) is not None for key in ['a', 'b', 'c', 'd']] == [True, False, False, True]
+    assert cache.getSizeInBytes() == 2 * entrySize
+
+def testInterruptedWriteLeavesEntryIntact(tmpdir, monkeypatch):
+    cache = ArrayCache( str(tmpdir) )
+    cache.put('a', ['x'], [getArray(1)])
+    
+    def interruptedSave(arrayFile, array):
+        arrayFile.write(b'\x93NUMPY')
+        raise KeyboardInterrupt()
+    monkeypatch.setattr(gccNMFCache.np, 'save', interruptedSave)
+    with pytest.raises(KeyboardInterrupt):
+        cache.put('a', ['x'], [getArray(2)])
+    monkeypatch.undo()
+    
+    np.testing.assert_array_equal( cache.get('a', ['x'])[0], getArray(1) )
+    assert glob( join(str(tmpdir), '*.tmp') ) == []
+
+def testRunGCCNMFReusesCachedStages(tmpdir, monkeypatch):
+    mixtureFilePrefix = join(str(tmpdir), 'test')
+    stereoSamples = 0.1 * np.random.RandomState(0).randn(2, SAMPLE_RATE)
+    stereoSamples[1, 3:] += stereoSamples[0, :-3]
+    wavwrite(stereoSamples.astype(np.float32), mixtureFilePrefix + '_mix.wav', SAMPLE_RATE)
+    cacheDir = str( tmpdir.join('cache') )
+    parameters = {'windowSize': 256, 'hopSize': 64, 'numTDOAs': 16, 'microphoneSeparationInMetres': 0.1, 'numTargets': 2,
+                  'windowFunction': partial(np.kaiser, beta=8), 'dictionarySize': 8, 'numIterations': 5, 'cacheDir': cacheDir}
+    
+    runGCCNMF(mixtureFilePrefix, **parameters)
+    cacheFileNames = sorted( os.listdir(cacheDir) )
+    targetSignalEstimates = wavread( getSourceEstimateFileName(mixtureFilePrefix, 0) )[0]
+    
+    computedStages = []
+    monkeypatch.setattr( ArrayCache, 'put', lambda cache, key, arrayNames, arrays: computedStages.append(key) )
+    runGCCNMF(mixtureFilePrefix, **parameters)
+    assert computedStages == []
+    assert sorted( os.listdir(cacheDir) ) == cacheFileNames
+    np.testing.assert_array_equal( wavread( getSourceEstimateFileName(mixtureFilePrefix, 0) )[0], targetSignalEstimates )
+    
+    runGCCNMF( mixtureFilePrefix, **dict(parameters, windowFunction=partial(np.kaiser, beta=4)) )
+    assert [key.split('_')[0] for key in computedStages] == ['stft', 'nmf', 'angularSpectrogram']
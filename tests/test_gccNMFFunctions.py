@@ -0,0 +1,173 @@
+import numpy as np
+import pytest
+from os.path import join, exists
+
+from gccNMF.gccNMFFunctions import (performKLNMF, performKLNMFWithStats, performOnlineKLNMF, getKLNMFActivations, performKLNMFHUpdates, computeComplexMixtureSpectrogram,
+                                    getComplexMixtureSpectrogramBlocks, getSourceEstimateFileName, estimateTargetTDOAIndexesFromAngularSpectrum,
+                                    DEFAULT_NMF_OBJECTIVE_INTERVAL)
+from gccNMF.runStreamingGCCNMF import runStreamingGCCNMF
+from gccNMF.wavfile import wavwrite, wavread
+
+NUM_FREQUENCIES = 40
+NUM_TIME = 600
+DICTIONARY_SIZE = 4
+NUM_ITERATIONS = 30
+SPARSITY_ALPHA = 0.1
+NUM_FRAMES_PER_BLOCK = 100
+SAMPLE_RATE = 16000
+WINDOW_SIZE = 256
+HOP_SIZE = 64
+
+def getV(seedValue=0):
+    # low rank, non-negative V
+    randomState = np.random.RandomState(seedValue)
+    W = randomState.rand(NUM_FREQUENCIES, DICTIONARY_SIZE) ** 3
+    H = randomState.rand(DICTIONARY_SIZE, NUM_TIME) ** 3
+    return ( np.dot(W, H) + 1e-3 ).astype(np.float32)
+
+def getKLDivergence(V, W, H):
+    reconstruction = np.dot(W, H)
+    return float( np.sum( V * np.log(V / reconstruction) - V + reconstruction ) )
+
+def performReferenceKLNMF(V, dictionarySize, numIterations, sparsityAlpha, epsilon=1e-16, seedValue=0):
+    # as in the original gccNMFFunctions
+    np.random.seed(seedValue)
+    W = np.random.random( (V.shape[0], dictionarySize) ).astype(np.float32) + epsilon
+    H = np.random.random( (dictionarySize, V.shape[1]) ).astype(np.float32) + epsilon
+    for iterationIndex in range(numIterations):
+        H *= np.dot( W.T, V / np.dot(W, H) ) / ( np.sum(W, axis=0)[:, np.newaxis] + sparsityAlpha + epsilon )
+        W *= np.dot( V / np.dot(W, H), H.T ) / np.sum(H, axis=1)
+        dictionaryAtomNorms = np.sqrt( np.sum(W**2, 0) )
+        W /= dictionaryAtomNorms
+        H *= dictionaryAtomNorms[:, np.newaxis]
+    return W, H
+
+def getAngularSpectrum(peakIndexes, numTDOAs=32):
+    angularSpectrum = np.full(numTDOAs, 0.1)
+    angularSpectrum[peakIndexes] = np.arange(1, len(peakIndexes) + 1)
+    return angularSpectrum
+
+def testTargetTDOAsAreTheLargestPeaks():
+    angularSpectrum = getAngularSpectrum([20, 5, 12])
+    assert estimateTargetTDOAIndexesFromAngularSpectrum(angularSpectrum, 0.1, 32, 2) == [5, 12]
+    with pytest.raises(ValueError):
+        estimateTargetTDOAIndexesFromAngularSpectrum(angularSpectrum, 0.1, 32, 4)
+
+def testNumTargetsIsEstimatedWithoutNumSources():
+    pytest.importorskip('sklearn')
+    angularSpectrum = getAngularSpectrum([3, 9, 20, 26])
+    angularSpectrum[[3, 9]] = 0.2
+    assert estimateTargetTDOAIndexesFromAngularSpectrum(angularSpectrum, 0.1, 32, None) == [20, 26]
+
+@pytest.mark.parametrize('numThreads', [1, 2, 3])
+def testKLNMFMatchesReference(numThreads):
+    V = getV()
+    referenceW, referenceH = performReferenceKLNMF(V, DICTIONARY_SIZE, NUM_ITERATIONS, SPARSITY_ALPHA)
+    W, H = performKLNMF(V, DICTIONARY_SIZE, NUM_ITERATIONS, SPARSITY_ALPHA, numThreads=numThreads)
+    np.testing.assert_allclose(W, referenceW, rtol=1e-4, atol=1e-6)
+    np.testing.assert_allclose(H, referenceH, rtol=1e-4, atol=1e-6)
+
+def testParallelKLNMFObjectivesMatchSerial():
+    V = getV()
+    _, _, serialStats = performKLNMFWithStats(V, DICTIONARY_SIZE, NUM_ITERATIONS, SPARSITY_ALPHA, objectiveInterval=5)
+    _, _, parallelStats = performKLNMFWithStats(V, DICTIONARY_SIZE, NUM_ITERATIONS, SPARSITY_ALPHA, objectiveInterval=5, numThreads=2)
+    assert parallelStats['numThreads'] == 2
+    assert len(parallelStats['objectives']) == NUM_ITERATIONS // 5
+    np.testing.assert_allclose(parallelStats['objectives'], serialStats['objectives'], rtol=1e-4)
+
+@pytest.mark.parametrize('numThreads', [1, 2])
+def testKLNMFStopsOnceConverged(numThreads):
+    V = getV()
+    W, H, stats = performKLNMFWithStats(V, DICTIONARY_SIZE, 1000, 0, tolerance=1e-3, objectiveInterval=5, numThreads=numThreads)
+    assert stats['converged']
+    assert stats['numIterations'] < 1000
+    assert getKLDivergence(V, W, H) < 0.01 * np.sum(V)
+
+@pytest.mark.parametrize('numThreads', [1, 2])
+def testKLNMFObjectiveOnlyEvaluatedWhenNeeded(numThreads):
+    V = getV()
+    _, _, stats = performKLNMFWithStats(V, DICTIONARY_SIZE, NUM_ITERATIONS, SPARSITY_ALPHA, numThreads=numThreads)
+    assert stats['objectives'] == []
+    _, _, stats = performKLNMFWithStats(V, DICTIONARY_SIZE, NUM_ITERATIONS, SPARSITY_ALPHA, tolerance=1e-12, numThreads=numThreads)
+    assert len(stats['objectives']) == NUM_ITERATIONS // DEFAULT_NMF_OBJECTIVE_INTERVAL
+
+def performReferenceKLNMFHUpdates(V, W, H, numIterations, sparsityAlpha, epsilon=1e-16):
+    # the H half of performReferenceKLNMF, with W fixed
+    for iterationIndex in range(numIterations):
+        H *= np.dot( W.T, V / np.dot(W, H) ) / ( np.sum(W, axis=0)[:, np.newaxis] + sparsityAlpha + epsilon )
+    return H
+
+def testHUpdatesMatchKLNMFWithFixedW():
+    V = getV()
+    W, _ = performKLNMF(V, DICTIONARY_SIZE, NUM_ITERATIONS, SPARSITY_ALPHA)
+    H = getKLNMFActivations(V, W, NUM_ITERATIONS, SPARSITY_ALPHA)
+    referenceH = np.random.RandomState(0).random_sample( (DICTIONARY_SIZE, NUM_TIME) ).astype(np.float32) + 1e-16
+    np.testing.assert_allclose( H, performReferenceKLNMFHUpdates(V, W, referenceH, NUM_ITERATIONS, SPARSITY_ALPHA), rtol=1e-4, atol=1e-6 )
+
+def testHUpdatesStopEarlyWithSilentColumns():
+    V = getV()
+    W, _ = performKLNMF(V, DICTIONARY_SIZE, NUM_ITERATIONS, SPARSITY_ALPHA)
+    V[:, 10:20] = 0
+    initialH = np.random.RandomState(0).random_sample( (DICTIONARY_SIZE, NUM_TIME) ).astype(np.float32) + 1e-16
+    with np.errstate(divide='raise', invalid='raise'):
+        H = performKLNMFHUpdates(V, W, initialH.copy(), 1000, SPARSITY_ALPHA, tolerance=1e-3)
+    assert np.all( np.isfinite(H) ) and np.all(H[:, 10:20] == 0)
+    assert not np.array_equal( H, performKLNMFHUpdates(V, W, initialH.copy(), 1000, SPARSITY_ALPHA) )
+
+def getVBlocks(V):
+    return lambda: ( V[:, startIndex:startIndex+NUM_FRAMES_PER_BLOCK] for startIndex in range(0, V.shape[1], NUM_FRAMES_PER_BLOCK) )
+
+def testOnlineKLNMFApproachesBatchFit():
+    V = getV()
+    numIterations = 200
+    randomW = np.random.RandomState(1).rand(NUM_FREQUENCIES, DICTIONARY_SIZE).astype(np.float32)
+    randomDivergence = getKLDivergence( V, randomW, getKLNMFActivations(V, randomW, numIterations, 0) )
+    
+    onlineDivergences = []
+    for numPasses in [1, 3]:
+        W, stats = performOnlineKLNMF(getVBlocks(V), DICTIONARY_SIZE, numHIterations=30, numPasses=numPasses)
+        assert stats['numBlocks'] == numPasses * NUM_TIME // NUM_FRAMES_PER_BLOCK
+        np.testing.assert_allclose( np.sqrt( np.sum(W**2, axis=0) ), 1, rtol=1e-5 )
+        onlineDivergences.append( getKLDivergence( V, W, getKLNMFActivations(V, W, numIterations, 0) ) )
+    batchW, batchH = performKLNMF(V, DICTIONARY_SIZE, numIterations, 0)
+    
+    assert getKLDivergence(V, batchW, batchH) < onlineDivergences[1] < onlineDivergences[0] < 0.05 * randomDivergence
+
+def testOnlineKLNMFRequiresBlocks():
+    with pytest.raises(ValueError):
+        performOnlineKLNMF(lambda: [], DICTIONARY_SIZE)
+
+def writeStereoMixture(tmpdir, durationInSeconds=1.0, delayInSamples=3, seedValue=0):
+    randomState = np.random.RandomState(seedValue)
+    numSamples = int(durationInSeconds * SAMPLE_RATE)
+    sources = 0.1 * randomState.randn(2, numSamples + delayInSamples)
+    stereoSamples = np.vstack( [sources[0, delayInSamples:] + sources[1, :numSamples], sources[0, :numSamples] + sources[1, delayInSamples:]] )
+    mixtureFilePrefix = join(str(tmpdir), 'test')
+    wavwrite(stereoSamples.astype(np.float32), mixtureFilePrefix + '_mix.wav', SAMPLE_RATE)
+    return mixtureFilePrefix
+
+def testSpectrogramBlocksMatchFullSpectrogram(tmpdir):
+    mixtureFilePrefix = writeStereoMixture(tmpdir)
+    stereoSamples, _ = wavread(mixtureFilePrefix + '_mix.wav')
+    complexMixtureSpectrogram = computeComplexMixtureSpectrogram(stereoSamples, WINDOW_SIZE, HOP_SIZE, np.hanning)
+    
+    complexMixtureSpectrogramBlocks = list( getComplexMixtureSpectrogramBlocks(mixtureFilePrefix + '_mix.wav', WINDOW_SIZE, HOP_SIZE, np.hanning, NUM_FRAMES_PER_BLOCK) )
+    assert all( [block.shape[-1] <= NUM_FRAMES_PER_BLOCK for block in complexMixtureSpectrogramBlocks] )
+    np.testing.assert_allclose( np.concatenate(complexMixtureSpectrogramBlocks, axis=-1), complexMixtureSpectrogram, atol=1e-5 )
+
+def testThreadedStreamingMatchesUnthreaded(tmpdir):
+    mixtureFilePrefix = writeStereoMixture(tmpdir)
+    targetSignalEstimates = []
+    for threaded in [False, True]:
+        runStreamingGCCNMF(mixtureFilePrefix, WINDOW_SIZE, HOP_SIZE, 32, 0.1, 2, dictionarySize=8, numFramesPerBlock=NUM_FRAMES_PER_BLOCK,
+                           numHIterations=10, threaded=threaded)
+        sourceEstimateFileNames = [getSourceEstimateFileName(mixtureFilePrefix, targetIndex) for targetIndex in range(2)]
+        assert all( [exists(sourceEstimateFileName) for sourceEstimateFileName in sourceEstimateFileNames] )
+        targetSignalEstimates.append( [wavread(sourceEstimateFileName)[0] for sourceEstimateFileName in sourceEstimateFileNames] )
+    np.testing.assert_array_equal(targetSignalEstimates[0], targetSignalEstimates[1])
+
+def testStreamingGCCNMFRaisesWhenTargetsAreNotFound(tmpdir):
+    mixtureFilePrefix = writeStereoMixture(tmpdir)
+    with pytest.raises(ValueError):
+        runStreamingGCCNMF(mixtureFilePrefix, WINDOW_SIZE, HOP_SIZE, 32, 0.1, 32, dictionarySize=8, numFramesPerBlock=NUM_FRAMES_PER_BLOCK, numHIterations=10)
+    assert not exists( getSourceEstimateFileName(mixtureFilePrefix, 0) )
@@ -0,0 +1,152 @@
+import pickle
+import numpy as np
+import pytest
+from os import getpid
+from threading import Timer
+from multiprocessing import get_context, shared_memory
+
+from gccNMF.realtime import gccNMFPretraining
+from gccNMF.runGCCNMF import runGCCNMF
+from gccNMF.wavfile import wavwrite
+from gccNMF.realtime.gccNMFPretraining import DictionaryStore, DICTIONARY_STATE_FAILED, DICTIONARY_STATE_READY
+from gccNMF.realtime.utils import SharedMemoryArray, attachSharedMemory, SHARED_MEMORY_NUM_COUNTERS, SHARED_MEMORY_HEADER_SIZE
+
+WINDOW_SIZE = 64
+DICTIONARY_SIZES = [4, 8]
+NAME_PREFIX = 'gccNMFTest_%d_' % getpid()
+
+def segmentExists(name):
+    try:
+        attachSharedMemory(name, track=False).close()
+        return True
+    except FileNotFoundError:
+        return False
+
+def getSpectralCentroids(W):
+    return np.sum( np.arange(W.shape[0])[:, np.newaxis] * W, axis=0 ) / np.sum(W, axis=0)
+
+def buildDictionary(store, dictionaryType, dictionarySize):
+    store[dictionaryType][dictionarySize]
+    store.release()
+
+@pytest.fixture
+def store():
+    store = DictionaryStore(WINDOW_SIZE, DICTIONARY_SIZES, ['Random'], NAME_PREFIX)
+    yield store
+    store.release()
+
+def testDictionariesAreBuiltLazily(store):
+    names = [store.getName('Random', dictionarySize) for dictionarySize in DICTIONARY_SIZES]
+    assert not any( [segmentExists(name) for name in names] )
+    
+    W = store['Random'][8]
+    assert W.shape == (WINDOW_SIZE // 2 + 1, 8)
+    assert not W.flags.writeable
+    assert np.all( np.diff( getSpectralCentroids(W) ) >= 0 )
+    assert store['Random'][8] is W
+    assert [segmentExists(name) for name in names] == [False, True]
+    
+    with pytest.raises(KeyError):
+        store['Pretrained']
+    with pytest.raises(KeyError):
+        store['Random'][16]
+    assert list(store) == ['Random'] and list(store['Random']) == DICTIONARY_SIZES
+
+def testAttachedStoreSharesDictionariesAndOwnerUnlinks(store):
+    W = store['Random'][4]
+    attachedStore = pickle.loads( pickle.dumps(store) )
+    np.testing.assert_array_equal(attachedStore['Random'][4], W)
+    
+    # a dictionary first used by an attached store is built by it, but only unlinked by the owner;
+    # views into released segments are no longer valid, so keep a copy
+    attachedW = attachedStore['Random'][8].copy()
+    attachedStore.release()
+    name = store.getName('Random', 8)
+    assert segmentExists(name)
+    np.testing.assert_array_equal(store['Random'][8], attachedW)
+    
+    store.release()
+    assert not any( [segmentExists( store.getName('Random', dictionarySize) ) for dictionarySize in DICTIONARY_SIZES] )
+
+def testDictionaryBuiltInAnotherProcess(store):
+    process = get_context('spawn').Process(target=buildDictionary, args=(store, 'Random', 8))
+    process.start()
+    process.join(30)
+    assert process.exitcode == 0
+    
+    name = store.getName('Random', 8)
+    assert segmentExists(name)
+    assert store['Random'][8].shape == (WINDOW_SIZE // 2 + 1, 8)
+    store.release()
+    assert not segmentExists(name)
+
+def testFailedBuildIsReported(store, monkeypatch):
+    def getDictionaryW(*args, **kwargs):
+        raise IOError('no training data')
+    monkeypatch.setattr(gccNMFPretraining, 'getDictionaryW', getDictionaryW)
+    with pytest.raises(IOError):
+        store['Random'][4]
+    assert not segmentExists( store.getName('Random', 4) )
+    
+    # a segment left failed by another process raises instead of waiting forever
+    failedArray = SharedMemoryArray( (WINDOW_SIZE // 2 + 1, 8), np.float32, store.getName('Random', 8) )
+    try:
+        failedArray.counters[0] = DICTIONARY_STATE_FAILED
+        with pytest.raises(ValueError):
+            store['Random'][8]
+    finally:
+        failedArray.release()
+
+def testAttachWaitsForZeroedHeader(store):
+    # another process lost the race between creating the segment and writing its header
+    shape = (WINDOW_SIZE // 2 + 1, 4)
+    sharedMemory = shared_memory.SharedMemory( store.getName('Random', 4), create=True, size=SHARED_MEMORY_HEADER_SIZE * 8 + int(np.prod(shape)) * 4 )
+    header = np.ndarray( (SHARED_MEMORY_HEADER_SIZE,), np.int64, sharedMemory.buf )
+    values = np.ndarray( shape, np.float32, sharedMemory.buf, offset=SHARED_MEMORY_HEADER_SIZE * 8 )
+    header[:] = 0
+    expectedW = np.random.RandomState(0).rand(*shape).astype(np.float32)
+    
+    def initialize():
+        header[SHARED_MEMORY_NUM_COUNTERS + 1] = len(shape)
+        header[SHARED_MEMORY_NUM_COUNTERS + 2:SHARED_MEMORY_NUM_COUNTERS + 4] = shape
+        header[SHARED_MEMORY_NUM_COUNTERS] = ord('f')
+        values[:] = expectedW
+        header[0] = DICTIONARY_STATE_READY
+    timer = Timer(0.1, initialize)
+    timer.start()
+    try:
+        np.testing.assert_array_equal(store['Random'][4], expectedW)
+    finally:
+        timer.join()
+        store.release()
+        del header, values
+        sharedMemory.close()
+
+def testAttachWaitsWhileBuilding(store):
+    buildingArray = SharedMemoryArray( (WINDOW_SIZE // 2 + 1, 8), np.float32, store.getName('Random', 8) )
+    buildingArray.owner = False
+    expectedW = np.random.RandomState(0).rand(WINDOW_SIZE // 2 + 1, 8).astype(np.float32)
+    
+    def build():
+        buildingArray.values[:] = expectedW
+        buildingArray.counters[0] = DICTIONARY_STATE_READY
+    timer = Timer(0.1, build)
+    timer.start()
+    try:
+        np.testing.assert_array_equal(store['Random'][8], expectedW)
+    finally:
+        timer.join()
+        store.release()
+        buildingArray.release()
+
+def testRunGCCNMFOnlyBuildsThePretrainedDictionary(tmpdir, monkeypatch):
+    builtDictionaries = []
+    def getDictionaryW(windowSize, dictionaryType, dictionarySize, ordered=False):
+        builtDictionaries.append( (dictionaryType, dictionarySize) )
+        return np.random.RandomState(0).rand(windowSize // 2 + 1, dictionarySize).astype(np.float32)
+    monkeypatch.setattr(gccNMFPretraining, 'getDictionaryW', getDictionaryW)
+    
+    mixtureFilePrefix = str( tmpdir.join('test') )
+    wavwrite( 0.1 * np.random.RandomState(0).randn(2, 4000).astype(np.float32), mixtureFilePrefix + '_mix.wav', 16000 )
+    runGCCNMF(mixtureFilePrefix, WINDOW_SIZE, WINDOW_SIZE // 4, 16, 0.1, 2, dictionarySize=8, pretrainedW=True, numHIterations=2)
+    assert builtDictionaries == [('Pretrained', 8)]
@@ -0,0 +1,136 @@
+import numpy as np
+from multiprocessing import Event, Semaphore
+
+from gccNMF.defs import TARGET_MODE_WINDOW_FUNCTION
+from gccNMF.realtime.gccNMFProcessor import GCCNMFProcess, GCCNMFProcessor, NMF_EPSILON
+from gccNMF.realtime.utils import NotifyingQueue
+
+SAMPLE_RATE = 16000
+WINDOW_SIZE = 1024
+NUM_TIME_PER_CHUNK = 4
+DICTIONARY_SIZE = 16
+NUM_TDOAS = 32
+
+def createProcessor(backendName='numpy', seedValue=0, numHUpdates=0):
+    W = np.random.RandomState(seedValue).rand(WINDOW_SIZE // 2 + 1, DICTIONARY_SIZE).astype(np.float32)
+    gccNMFProcessor = GCCNMFProcessor(SAMPLE_RATE, WINDOW_SIZE, NUM_TIME_PER_CHUNK, {'Random': {DICTIONARY_SIZE: W}}, 'Random', DICTIONARY_SIZE, numHUpdates, 0.1,
+                                      False, 6, backendName=backendName)
+    gccNMFProcessor.numTDOAs = NUM_TDOAS
+    gccNMFProcessor.targetMode = TARGET_MODE_WINDOW_FUNCTION
+    gccNMFProcessor.setTargetTDOARange(NUM_TDOAS / 2.0, NUM_TDOAS / 10.0, 2.0, 0.0)
+    gccNMFProcessor.reset()
+    return gccNMFProcessor
+
+def testAngularSpectrogramIgnoresSilentBins():
+    gccNMFProcessor = createProcessor()
+    randomState = np.random.RandomState(1)
+    spectrogramShape = gccNMFProcessor.complexMixtureSpectrogram.shape
+    complexMixtureSpectrogram = (randomState.randn(*spectrogramShape) + 1j * randomState.randn(*spectrogramShape)).astype(np.complex64)
+    complexMixtureSpectrogram[1, 5, 0] = 0
+    complexMixtureSpectrogram[:, 7, 2] = 0
+    gccNMFProcessor.complexMixtureSpectrogram[:] = complexMixtureSpectrogram
+    
+    gccNMFProcessor.getSpectralCoherence()
+    angularSpectrogram = gccNMFProcessor.getAngularSpectrogram()
+    
+    # baseline: GCC-PHAT averaged over frequency with nanmean, silent bins giving NaN coherence
+    with np.errstate(invalid='ignore'):
+        crossSpectrum = complexMixtureSpectrogram[0].astype(np.complex128) * complexMixtureSpectrogram[1].conj()
+        coherenceV = crossSpectrum / np.abs(crossSpectrum)
+    expectedAngularSpectrogram = np.nanmean( np.real(coherenceV[:, :, np.newaxis] * gccNMFProcessor.expJOmegaTau[:, np.newaxis]), axis=0 ).T
+    
+    assert np.all( np.isfinite(angularSpectrogram) )
+    np.testing.assert_allclose(angularSpectrogram, expectedAngularSpectrogram, rtol=1e-4, atol=1e-5)
+
+def testSilentBinsKeepMasksFinite():
+    gccNMFProcessor = createProcessor()
+    windowedSamples = np.random.RandomState(2).randn(2, WINDOW_SIZE, NUM_TIME_PER_CHUNK).astype(np.float32)
+    windowedSamples[1, :, 1] = 0
+    
+    outputFrames = gccNMFProcessor.processFrames(windowedSamples)
+    
+    assert np.all( np.isfinite(outputFrames) )
+    assert np.all( np.isfinite(gccNMFProcessor.getAngularSpectrogram()) )
+
+def testActivationTFMaskMatchesReference():
+    numHUpdates = 5
+    gccNMFProcessor = createProcessor(numHUpdates=numHUpdates)
+    randomState = np.random.RandomState(3)
+    spectrogramShape = gccNMFProcessor.complexMixtureSpectrogram.shape
+    complexMixtureSpectrogram = (randomState.randn(*spectrogramShape) + 1j * randomState.randn(*spectrogramShape)).astype(np.complex64)
+    complexMixtureSpectrogram[1, :, 2] = 0
+    gccNMFProcessor.complexMixtureSpectrogram[:] = complexMixtureSpectrogram
+    gccNMFProcessor.stereoH[:] = randomState.rand(*gccNMFProcessor.stereoH.shape)
+    gccNMFProcessor.HMask[:] = randomState.rand(*gccNMFProcessor.HMask.shape)
+    
+    # baseline: KL H updates of each channel, warm started from the previous chunk's H, then W.(H * HMask) / W.H
+    W = gccNMFProcessor.W.astype(np.float64)
+    expectedTFMask = np.empty(spectrogramShape, np.float64)
+    for channelIndex in range(2):
+        V = np.abs(complexMixtureSpectrogram[channelIndex]).astype(np.float64)
+        H = gccNMFProcessor.stereoH[:, channelIndex].astype(np.float64)
+        for _ in range(numHUpdates):
+            H *= np.dot( W.T, V / (np.dot(W, H) + NMF_EPSILON) ) / ( np.sum(W, axis=0)[:, np.newaxis] + NMF_EPSILON )
+        expectedTFMask[channelIndex] = np.dot(W, H * gccNMFProcessor.HMask) / (np.dot(W, H) + NMF_EPSILON)
+    
+    with np.errstate(divide='raise', invalid='raise'):
+        tfMask = gccNMFProcessor.getActivationTFMask()
+    assert tfMask.shape == spectrogramShape
+    np.testing.assert_allclose(tfMask, expectedTFMask, rtol=1e-3, atol=1e-5)
+
+def testActivationMasksKeepOutputFinite():
+    gccNMFProcessor = createProcessor(numHUpdates=3)
+    windowedSamples = np.random.RandomState(4).randn(2, WINDOW_SIZE, NUM_TIME_PER_CHUNK).astype(np.float32)
+    windowedSamples[:, :, 1] = 0
+    for _ in range(3):
+        outputFrames = gccNMFProcessor.processFrames(windowedSamples)
+        assert np.all( np.isfinite(outputFrames) )
+    assert np.all( np.isfinite(gccNMFProcessor.stereoH) )
+
+class TerminateAfterPasses(object):
+    def __init__(self, numPasses):
+        self.numPasses = numPasses
+    
+    def is_set(self):
+        self.numPasses -= 1
+        return self.numPasses < 0
+
+class EmptyInputRing(object):
+    def getNumAvailable(self):
+        return 0
+
+class ProcessLoop(object):
+    # the state GCCNMFProcess.run touches, without the audio engine behind it
+    def __init__(self, numPasses):
+        self.doorbell = Semaphore(0)
+        self.terminateEvent = TerminateAfterPasses(numPasses)
+        self.inputRing = EmptyInputRing()
+        self.inputRingDiscardQueue = NotifyingQueue(self.doorbell)
+        self.receivedParameters = []
+        for queueName in ['tdoaParametersQueue', 'togglePlayQueue', 'toggleSeparationQueue']:
+            setattr(self, queueName, NotifyingQueue(self.doorbell))
+            setattr(self, queueName.replace('Queue', 'Ack'), Event())
+    
+    def processTDOAParametersQueue(self):
+        self.receivedParameters.append( self.tdoaParametersQueue.get() )
+    
+    def processTogglePlayQueue(self):
+        self.receivedParameters.append( self.togglePlayQueue.get() )
+    
+    def processToggleSeparationQueue(self):
+        self.receivedParameters.append( self.toggleSeparationQueue.get() )
+
+def testProcessPassHandlesAllPendingWorkAndDrainsDoorbell():
+    processLoop = ProcessLoop(numPasses=1)
+    for parameterIndex in range(3):
+        processLoop.tdoaParametersQueue.put( {'targetTDOAIndex': parameterIndex} )
+    processLoop.togglePlayQueue.put( {'playing': True} )
+    for _ in range(5):
+        processLoop.doorbell.release()
+    
+    GCCNMFProcess.run(processLoop)
+    assert processLoop.receivedParameters == [{'targetTDOAIndex': 0}, {'targetTDOAIndex': 1}, {'targetTDOAIndex': 2}, {'playing': True}]
+    assert processLoop.tdoaParametersAck.is_set() and processLoop.togglePlayAck.is_set()
+    assert not processLoop.toggleSeparationAck.is_set()
+    # the stale permits are gone, so the next pass waits for new work
+    assert not processLoop.doorbell.acquire(False)
@@ -0,0 +1,29 @@
+import tracemalloc
+
+import pytest
+
+from gccNMF.gccNMFProfiling import StageProfiler
+
+def testFailingStageStopsTracing():
+    assert not tracemalloc.is_tracing()
+    profiler = StageProfiler()
+    with profiler.stage('completed'):
+        pass
+    assert tracemalloc.is_tracing()
+    
+    with pytest.raises(ValueError):
+        with profiler.stage('failed'):
+            raise ValueError('stage failed')
+    assert not tracemalloc.is_tracing()
+    assert [stageReport['name'] for stageReport in profiler.stages] == ['completed', 'failed']
+
+def testFailingStageKeepsCallersTracing():
+    tracemalloc.start()
+    try:
+        profiler = StageProfiler()
+        with pytest.raises(ValueError):
+            with profiler.stage('failed'):
+                raise ValueError('stage failed')
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from gccNMF.defs import GCC_PHAT_MODE_FFT
+from gccNMF.gccNMFBackends import BACKENDS, getBackend, getExpJOmegaTauTable, getFFTGCCTable
+from gccNMF.gccNMFFunctions import getSpectralCoherenceV, getAngularSpectrogram, getFrequenciesInHz
+
+SAMPLE_RATE = 16000
+NUM_FREQUENCIES = 129
+NUM_TIME = 20
+DICTIONARY_SIZE = 5
+UPSAMPLING_FACTOR = 4
+MICROPHONE_SEPARATION_IN_METRES = 0.1
+NUM_TDOAS = 32
+BACKEND_MODULES = {'numba': 'numba', 'torch': 'torch'}
+
+@pytest.fixture(params=list(BACKENDS.keys()))
+def backendName(request):
+    if request.param in BACKEND_MODULES:
+        pytest.importorskip(BACKEND_MODULES[request.param])
+    return request.param
+
+def getCoherenceV(delayInSamples=None, seedValue=0):
+    randomState = np.random.RandomState(seedValue)
+    spectrogramShape = (2, NUM_FREQUENCIES, NUM_TIME)
+    complexMixtureSpectrogram = randomState.randn(*spectrogramShape) + 1j * randomState.randn(*spectrogramShape)
+    if delayInSamples is not None:
+        frequenciesInHz = getFrequenciesInHz(SAMPLE_RATE, NUM_FREQUENCIES)
+        complexMixtureSpectrogram[1] = complexMixtureSpectrogram[0] * np.exp( 2j * np.pi * frequenciesInHz * delayInSamples / SAMPLE_RATE )[:, np.newaxis]
+    return getSpectralCoherenceV(complexMixtureSpectrogram)
+
+def testFFTGCCPHATIsExactOnTheUpsampledLagGrid(backendName):
+    # TDOAs falling on the upsampled lags need no interpolation, so both modes evaluate the same sum
+    backend = getBackend(backendName)
+    coherenceV = getCoherenceV()
+    frequenciesInHz = getFrequenciesInHz(SAMPLE_RATE, NUM_FREQUENCIES)
+    tdoasInSeconds = np.arange(-8, 9) / float(SAMPLE_RATE * UPSAMPLING_FACTOR)
+    expJOmegaTau = np.exp( np.outer(frequenciesInHz, -(2j * np.pi) * tdoasInSeconds) )
+    fftGCCTable = getFFTGCCTable(frequenciesInHz, tdoasInSeconds, UPSAMPLING_FACTOR)
+    W = np.random.RandomState(1).rand(NUM_FREQUENCIES, DICTIONARY_SIZE)
+    
+    np.testing.assert_allclose( backend.getAngularSpectrogramFFT(coherenceV, fftGCCTable),
+                                backend.getAngularSpectrogram(coherenceV, getExpJOmegaTauTable(expJOmegaTau)), atol=1e-8 )
+    np.testing.assert_allclose( backend.getGCCNMFFFT(coherenceV, fftGCCTable, W),
+                                backend.getGCCNMF(backend.getGCCPHAT(coherenceV, expJOmegaTau), W), atol=1e-8 )
+
+def testFFTGCCPHATConvergesWithUpsampling():
+    coherenceV = getCoherenceV(delayInSamples=1.3)
+    frequenciesInHz = getFrequenciesInHz(SAMPLE_RATE, NUM_FREQUENCIES)
+    angularSpectrogram = getAngularSpectrogram(coherenceV, frequenciesInHz, MICROPHONE_SEPARATION_IN_METRES, NUM_TDOAS)
+    
+    maxErrors = []
+    for upsamplingFactor in [1, 4, 16]:
+        fftAngularSpectrogram = getAngularSpectrogram(coherenceV, frequenciesInHz, MICROPHONE_SEPARATION_IN_METRES, NUM_TDOAS,
+                                                      gccPHATMode=GCC_PHAT_MODE_FFT, upsamplingFactor=upsamplingFactor)
+        maxErrors.append( np.max( np.abs(fftAngularSpectrogram - angularSpectrogram) ) )
+        if upsamplingFactor > 1:
+            assert np.argmax( np.mean(fftAngularSpectrogram, axis=-1) ) == np.argmax( np.mean(angularSpectrogram, axis=-1) )
+    assert maxErrors[0] > maxErrors[1] > maxErrors[2]
+    assert maxErrors[2] < 0.01 * np.max( np.abs(angularSpectrogram) )
+
+def testFFTGCCTableRejectsTDOAsBeyondTheWindow():
+    frequenciesInHz = getFrequenciesInHz(SAMPLE_RATE, NUM_FREQUENCIES)
+    with pytest.raises(ValueError):
+        getFFTGCCTable(frequenciesInHz, [-NUM_FREQUENCIES / float(SAMPLE_RATE), 0.0], UPSAMPLING_FACTOR)
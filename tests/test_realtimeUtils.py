@@ -0,0 +1,182 @@
+import numpy as np
+import pytest
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+from gccNMF.realtime.utils import OverlapAddProcessor, SharedMemoryBlockRing
+
+NUM_CHANNELS = 2
+NUM_BLOCKS = 40
+RING_BLOCK_SHAPE = (NUM_CHANNELS, 8)
+
+class BaselineOverlapAddProcessor(object):
+    # the original shifting implementation
+    def __init__(self, numChannels, windowSize, hopSize, blockSize, windowsPerBlock, inputFrames, outputFrames, latencyInBlocks=2):
+        self.windowSize = windowSize
+        self.latencyInBlocks = latencyInBlocks
+        self.blockSize = blockSize
+        self.inputFrames = inputFrames
+        self.outputFrames = outputFrames
+        self.bufferSize = blockSize * 8
+        self.inputBuffer = np.zeros( (numChannels, self.bufferSize), np.float32 )
+        self.outputBuffer = np.zeros( (numChannels, self.bufferSize), np.float32 )
+        self.windowedSamples = np.zeros( (numChannels, windowSize, windowsPerBlock), np.float32 )
+        self.windowIndexes = np.arange(self.bufferSize - windowSize - (windowsPerBlock-1)*hopSize, self.bufferSize - windowSize + 1, hopSize)
+    
+    def processFrames(self, processFramesFunction):
+        self.inputBuffer[:, :-self.blockSize] = self.inputBuffer[:, self.blockSize:]
+        self.inputBuffer[:, -self.blockSize:] = self.inputFrames
+        self.outputBuffer[:, :-self.blockSize] = self.outputBuffer[:, self.blockSize:]
+        self.outputBuffer[:, -self.blockSize:] = 0
+        
+        for i, windowIndex in enumerate(self.windowIndexes):
+            self.windowedSamples[..., i] = self.inputBuffer[:, windowIndex:windowIndex+self.windowSize]
+        processedFrames = processFramesFunction(self.windowedSamples)
+        for i, windowIndex in enumerate(self.windowIndexes):
+            self.outputBuffer[:, windowIndex:windowIndex+self.windowSize] += processedFrames[..., i]
+        # the original read at a fixed two blocks, incomplete once windows span more than two blocks
+        self.outputFrames[:] = self.outputBuffer[:, -(self.latencyInBlocks+1)*self.blockSize:-self.latencyInBlocks*self.blockSize]
+
+def createOverlapAddProcessor(overlapAddProcessorClass, windowSize, hopSize, blockSize, *args):
+    inputFrames = np.zeros( (NUM_CHANNELS, blockSize), np.float32 )
+    outputFrames = np.zeros( (NUM_CHANNELS, blockSize), np.float32 )
+    return overlapAddProcessorClass(NUM_CHANNELS, windowSize, hopSize, blockSize, blockSize // hopSize, inputFrames, outputFrames, *args), inputFrames, outputFrames
+
+@pytest.mark.parametrize('windowSize, hopSize, blockSize', [(1024, 512, 512), (1024, 256, 512), (1024, 128, 1024), (1024, 256, 256),
+                                                            (1000, 256, 512), (1024, 512, 2048), (64, 16, 48), (1024, 1024, 1024)])
+def testOverlapAddMatchesBaseline(windowSize, hopSize, blockSize):
+    window = np.hanning(windowSize).astype(np.float32)[:, np.newaxis]
+    baselineWindowedSamples = []
+    windowedSamples = []
+    def getProcessFrames(windowedSamplesList):
+        def processFrames(samples):
+            windowedSamplesList.append( samples.copy() )
+            return samples * window * np.float32(1.5) + np.float32(0.1)
+        return processFrames
+    
+    overlapAddProcessor, inputFrames, outputFrames = createOverlapAddProcessor(OverlapAddProcessor, windowSize, hopSize, blockSize)
+    baselineProcessor, baselineInputFrames, baselineOutputFrames = createOverlapAddProcessor(BaselineOverlapAddProcessor, windowSize, hopSize, blockSize,
+                                                                                             overlapAddProcessor.latencyInBlocks)
+    randomState = np.random.RandomState(0)
+    for blockIndex in range(NUM_BLOCKS):
+        baselineInputFrames[:] = inputFrames[:] = randomState.randn(NUM_CHANNELS, blockSize)
+        baselineProcessor.processFrames( getProcessFrames(baselineWindowedSamples) )
+        overlapAddProcessor.processFrames( getProcessFrames(windowedSamples) )
+        np.testing.assert_array_equal(windowedSamples[-1], baselineWindowedSamples[-1])
+        np.testing.assert_allclose(outputFrames, baselineOutputFrames, atol=1e-5)
+    assert np.all(outputFrames != 0)
+
+@pytest.mark.parametrize('windowSize, hopSize, blockSize, latencyInBlocks', [(1024, 512, 512, 2), (1024, 256, 256, 4), (1000, 250, 250, 4), (256, 64, 512, 2)])
+def testOverlapAddOutputsCompleteBlocksAfterLatency(windowSize, hopSize, blockSize, latencyInBlocks):
+    # periodic Hann windows at a quarter or half window hop sum to a constant, so the output is the input delayed by latencyInBlocks
+    window = ( 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(windowSize) / windowSize) ).astype(np.float32)[:, np.newaxis] * hopSize * 2 / windowSize
+    overlapAddProcessor, inputFrames, outputFrames = createOverlapAddProcessor(OverlapAddProcessor, windowSize, hopSize, blockSize)
+    assert overlapAddProcessor.latencyInBlocks == latencyInBlocks
+    
+    randomState = np.random.RandomState(0)
+    inputBlocks = []
+    for blockIndex in range(NUM_BLOCKS):
+        inputFrames[:] = randomState.randn(NUM_CHANNELS, blockSize)
+        inputBlocks.append( inputFrames.copy() )
+        overlapAddProcessor.processFrames(lambda samples: samples * window)
+        if blockIndex >= latencyInBlocks + -(-windowSize // blockSize):
+            np.testing.assert_allclose(outputFrames, inputBlocks[blockIndex - latencyInBlocks], atol=1e-5)
+
+def getBlock(blockIndex):
+    return np.full(RING_BLOCK_SHAPE, blockIndex, np.float32)
+
+def writeBlocks(ring, numBlocks):
+    for blockIndex in range(numBlocks):
+        while not ring.write( getBlock(blockIndex) ):
+            pass
+
+def testBlockRingCountsOverrunsAndUnderruns():
+    ring = SharedMemoryBlockRing(3, RING_BLOCK_SHAPE)
+    try:
+        block = np.zeros(RING_BLOCK_SHAPE, np.float32)
+        assert not ring.read(block)
+        assert ring.getCounters() == (0, 1)
+        
+        assert all( [ring.write( getBlock(blockIndex) ) for blockIndex in range(3)] )
+        assert not ring.write( getBlock(3) )
+        assert ring.getCounters() == (1, 1)
+        assert ring.getNumAvailable() == 3
+        
+        # the dropped block is not delivered, and order is kept across wrap-arounds
+        for blockIndex in list(range(3)) + list(range(4, 10)):
+            if blockIndex >= 4:
+                assert ring.write( getBlock(blockIndex) )
+            assert ring.read(block)
+            np.testing.assert_array_equal( block, getBlock(blockIndex) )
+        assert not ring.read(block)
+        assert ring.getCounters() == (1, 2)
+    finally:
+        ring.release()
+
+def testBlockRingDiscardKeepsNewestBlocks():
+    ring = SharedMemoryBlockRing(4, RING_BLOCK_SHAPE)
+    try:
+        for blockIndex in range(4):
+            ring.write( getBlock(blockIndex) )
+        ring.discard(1)
+        block = np.zeros(RING_BLOCK_SHAPE, np.float32)
+        assert ring.read(block) and np.all(block == 3)
+        ring.discard(1)
+        assert ring.getNumAvailable() == 0
+        ring.discard()
+        assert ring.getNumAvailable() == 0
+    finally:
+        ring.release()
+
+def testBlockRingDiscardUpToProducerWriteIndex():
+    # the producer asks for the blocks written so far to be dropped, blocks written after the request are kept
+    ring = SharedMemoryBlockRing(4, RING_BLOCK_SHAPE)
+    try:
+        for blockIndex in range(2):
+            ring.write( getBlock(blockIndex) )
+        writeIndex = ring.writeIndex.value
+        ring.write( getBlock(2) )
+        ring.discard(writeIndex=writeIndex)
+        block = np.zeros(RING_BLOCK_SHAPE, np.float32)
+        assert ring.read(block) and np.all(block == 2)
+        ring.discard(writeIndex=writeIndex)
+        assert ring.getNumAvailable() == 0 and ring.readIndex.value == 3
+    finally:
+        ring.release()
+
+def testBlockRingIsSharedByName():
+    ring = SharedMemoryBlockRing(4, RING_BLOCK_SHAPE)
+    attachedRing = SharedMemoryBlockRing.attach(ring.array.name, track=False)
+    try:
+        ring.write( getBlock(7) )
+        ring.write( getBlock(8) )
+        assert attachedRing.getNumAvailable() == 2
+        block = np.zeros(RING_BLOCK_SHAPE, np.float32)
+        assert attachedRing.read(block) and np.all(block == 7)
+        assert ring.getNumAvailable() == 1
+        attachedRing.discard()
+        assert not attachedRing.read(block)
+        assert ring.getCounters() == (0, 1)
+    finally:
+        attachedRing.release()
+        name = ring.array.name
+        ring.release()
+    with pytest.raises(FileNotFoundError):
+        SharedMemory(name=name)
+
+def testBlockRingPassesBlocksBetweenProcesses():
+    numBlocks = 200
+    ring = SharedMemoryBlockRing(4, RING_BLOCK_SHAPE)
+    try:
+        producer = get_context('spawn').Process(target=writeBlocks, args=(ring, numBlocks))
+        producer.start()
+        block = np.zeros(RING_BLOCK_SHAPE, np.float32)
+        for blockIndex in range(numBlocks):
+            while not ring.read(block):
+                pass
+            np.testing.assert_array_equal( block, getBlock(blockIndex) )
+        producer.join(10)
+        assert producer.exitcode == 0
+        assert ring.getNumAvailable() == 0
+    finally:
+        ring.release()
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from os.path import join, exists
+
+from gccNMF.realtime import renderRealtimeGCCNMF
+from gccNMF.realtime.renderRealtimeGCCNMF import renderFiles, ENHANCED_FILE_SUFFIX, TDOA_TRACK_FILE_SUFFIX
+from gccNMF.wavfile import wavwrite, wavread
+
+SAMPLE_RATE = 16000
+NUM_SAMPLES = 20000
+OVERRIDES = {'dictionaryType': 'Random', 'dictionarySize': 16, 'numTDOAs': 16}
+
+def writeStereoFile(filePath, seedValue=0, delayInSamples=2):
+    source = 0.1 * np.random.RandomState(seedValue).randn(NUM_SAMPLES + delayInSamples)
+    stereoSamples = np.vstack( [source[delayInSamples:], source[:NUM_SAMPLES]] ).astype(np.float32)
+    wavwrite(stereoSamples, filePath, SAMPLE_RATE)
+    return wavread(filePath)[0]
+
+@pytest.fixture
+def separationDisabled(monkeypatch):
+    createProcessors = renderRealtimeGCCNMF.createProcessors
+    def createUnseparatedProcessors(*args, **kwargs):
+        processors = createProcessors(*args, **kwargs)
+        processors[1].separationEnabled = False
+        return processors
+    monkeypatch.setattr(renderRealtimeGCCNMF, 'createProcessors', createUnseparatedProcessors)
+
+@pytest.mark.parametrize('windowSize, hopSize, blockSize', [(1024, 512, 512), (1024, 256, 256)])
+def testRenderedOutputIsAlignedWithInput(tmpdir, separationDisabled, windowSize, hopSize, blockSize):
+    inputSamples = writeStereoFile( str(tmpdir.join('mixture.wav')) )
+    outputDir = str( tmpdir.join('output') )
+    overrides = dict(OVERRIDES, windowSize=windowSize, hopSize=hopSize, blockSize=blockSize)
+    [record] = renderFiles([str(tmpdir.join('mixture.wav'))], outputDir, overrides=overrides)
+    assert 'error' not in record
+    
+    # without separation the engine applies the squared sqrt-Hamming window, overlap-added to a near constant gain
+    outputSamples = wavread(record['outputFilePrefix'] + ENHANCED_FILE_SUFFIX)[0]
+    assert outputSamples.shape == inputSamples.shape
+    gain = np.mean( np.sum( np.hamming(windowSize).reshape(-1, hopSize), axis=0 ) )
+    np.testing.assert_allclose(outputSamples[:, windowSize:] / gain, inputSamples[:, windowSize:], atol=5e-3)
+    
+    tdoaTrack = np.loadtxt(record['outputFilePrefix'] + TDOA_TRACK_FILE_SUFFIX, delimiter=',', skiprows=1)
+    assert len(tdoaTrack) == -(-NUM_SAMPLES // blockSize)
+    assert tdoaTrack[-1, 0] == NUM_SAMPLES / float(SAMPLE_RATE)
+
+def testFilesWithTheSameNameDoNotCollide(tmpdir):
+    inputPaths = [str( tmpdir.mkdir(directoryName).join('mixture.wav') ) for directoryName in ['a', 'b']]
+    for seedValue, inputPath in enumerate(inputPaths):
+        writeStereoFile(inputPath, seedValue)
+    outputDir = str( tmpdir.join('output') )
+    
+    records = renderFiles([str( tmpdir.join('*', '*.wav') )], outputDir, overrides=OVERRIDES)
+    assert [record['outputFilePrefix'] for record in records] == [join(outputDir, 'a', 'mixture'), join(outputDir, 'b', 'mixture')]
+    outputSamples = [wavread(record['outputFilePrefix'] + ENHANCED_FILE_SUFFIX)[0] for record in records]
+    assert all( [outputSample.shape == (2, NUM_SAMPLES) for outputSample in outputSamples] )
+    assert not np.array_equal(outputSamples[0], outputSamples[1])
+    
+    # a single file keeps its name directly in the output directory
+    [record] = renderFiles([inputPaths[0]], outputDir, overrides=OVERRIDES)
+    assert exists( join(outputDir, 'mixture' + ENHANCED_FILE_SUFFIX) )
@@ -0,0 +1,36 @@
+import os
+
+from gccNMF.runBatchGCCNMF import (blasNumThreadsEnvironment, runBatchGCCNMF, loadManifest, appendManifestRecord, getManifestKey,
+                                    BLAS_NUM_THREADS_VARIABLES, MIXTURE_FILE_SUFFIX, STATUS_DONE, STATUS_FAILED)
+
+def testBLASNumThreadsEnvironmentIsRestored(monkeypatch):
+    monkeypatch.setenv('OMP_NUM_THREADS', '8')
+    for variableName in BLAS_NUM_THREADS_VARIABLES[1:]:
+        monkeypatch.delenv(variableName, raising=False)
+    
+    with blasNumThreadsEnvironment(2):
+        assert all( [os.environ[variableName] == '2' for variableName in BLAS_NUM_THREADS_VARIABLES] )
+    
+    assert os.environ['OMP_NUM_THREADS'] == '8'
+    assert not any( [variableName in os.environ for variableName in BLAS_NUM_THREADS_VARIABLES[1:]] )
+
+def testManifestSkipsOnlyMixturesDoneWithTheSameParameters(tmpdir):
+    mixtureFilePrefixes = [str( tmpdir.join(name) ) for name in ['a', 'b']]
+    for mixtureFilePrefix in mixtureFilePrefixes:
+        open(mixtureFilePrefix + MIXTURE_FILE_SUFFIX, 'w').close()
+    parameters, otherParameters = {'windowSize': 1024, 'hopSize': 128}, {'windowSize': 512, 'hopSize': 128}
+    manifestPath = str( tmpdir.join('manifest.jsonl') )
+    with open(manifestPath, 'w') as manifestFile:
+        for record in [{'mixtureFilePrefix': mixtureFilePrefixes[0], 'parameters': dict(reversed(parameters.items())), 'status': STATUS_DONE},
+                       {'mixtureFilePrefix': mixtureFilePrefixes[1], 'parameters': parameters, 'status': STATUS_FAILED},
+                       {'mixtureFilePrefix': mixtureFilePrefixes[0], 'parameters': otherParameters, 'status': STATUS_DONE}]:
+            appendManifestRecord(manifestFile, record)
+        manifestFile.write('{"mixtureFilePrefix": "trunc')
+    
+    assert getManifestKey(mixtureFilePrefixes[0], parameters) in loadManifest(manifestPath)
+    assert runBatchGCCNMF([str(tmpdir)], parameters, manifestPath=manifestPath) == []
+    
+    # b is not done with otherParameters: it is processed (and fails, the mixture file being empty) and recorded
+    records = runBatchGCCNMF([str(tmpdir)], otherParameters, manifestPath=manifestPath)
+    assert [(record['mixtureFilePrefix'], record['status']) for record in records] == [(mixtureFilePrefixes[1], STATUS_FAILED)]
+    assert loadManifest(manifestPath)[ getManifestKey(mixtureFilePrefixes[1], otherParameters) ]['status'] == STATUS_FAILED
@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+from os.path import join
+from scipy.io import wavfile
+
+from gccNMF.wavfile import (WavReader, WavWriter, wavread, wavwrite, CLIP_PROTECTION_NONE, CLIP_PROTECTION_LIMITER, CLIP_PROTECTION_RESCALE,
+                            CLIP_PROTECTION_MAX_SAMPLE_VALUE)
+
+SAMPLE_RATE = 16000
+NUM_CHANNELS = 4
+NUM_FRAMES = 1000
+
+def getSamples(numChannels=NUM_CHANNELS, numFrames=NUM_FRAMES, amplitude=0.5, seedValue=0):
+    return ( amplitude * np.random.RandomState(seedValue).uniform(-1, 1, (numChannels, numFrames)) ).astype(np.float32)
+
+def writeWav(tmpdir, bitsPerSample, samples=None):
+    samples = getSamples() if samples is None else samples
+    filePath = join(str(tmpdir), 'test%d.wav' % bitsPerSample)
+    if bitsPerSample == 24:
+        with WavWriter(filePath, SAMPLE_RATE, samples.shape[0], bitsPerSample, CLIP_PROTECTION_NONE) as wavWriter:
+            wavWriter.write(samples)
+    else:
+        pcm = np.round( samples * (2 ** (bitsPerSample - 1) - 1) ).astype('int%d' % bitsPerSample)
+        wavfile.write(filePath, SAMPLE_RATE, pcm.T)
+    return filePath
+
+@pytest.mark.parametrize('bitsPerSample', [16, 32])
+def testWavReaderMatchesWavread(tmpdir, bitsPerSample):
+    filePath = writeWav(tmpdir, bitsPerSample)
+    samples, sampleRate = wavread(filePath)
+    wavReader = WavReader(filePath)
+    assert (wavReader.sampleRate, wavReader.numChannels, len(wavReader)) == (sampleRate, NUM_CHANNELS, NUM_FRAMES)
+    np.testing.assert_array_equal(wavReader.read(), samples)
+
+def testWavReaderDecodes24BitSamples(tmpdir):
+    samples = getSamples()
+    wavReader = WavReader( writeWav(tmpdir, 24, samples) )
+    assert wavReader.bitsPerSample == 24
+    np.testing.assert_allclose(wavReader.read(), samples, atol=2.0 ** -22)
+
+@pytest.mark.parametrize('bitsPerSample', [16, 24, 32])
+def testWavReaderSelectsChannelsAndWindows(tmpdir, bitsPerSample):
+    filePath = writeWav(tmpdir, bitsPerSample)
+    samples = WavReader(filePath).read()
+    wavReader = WavReader(filePath, channelIndexes=[3, 1])
+    assert wavReader.numChannels == 2
+    np.testing.assert_array_equal( wavReader.read(100, 200), samples[[3, 1], 100:300] )
+    
+    # windows reaching past the end are zero padded into the caller's buffer
+    out = np.full( (2, 300), np.nan, np.float32 )
+    assert wavReader.read(NUM_FRAMES - 100, out=out) is out
+    np.testing.assert_array_equal( out[:, :100], samples[[3, 1], -100:] )
+    np.testing.assert_array_equal( out[:, 100:], 0 )
+
+def testWavReaderRejectsInvalidInputs(tmpdir):
+    filePath = writeWav(tmpdir, 16)
+    with pytest.raises(ValueError):
+        WavReader(filePath, channelIndexes=[0, NUM_CHANNELS])
+    
+    notWavFilePath = join(str(tmpdir), 'notWav.wav')
+    with open(notWavFilePath, 'wb') as notWavFile:
+        notWavFile.write(b'not a wav file')
+    with pytest.raises(ValueError):
+        WavReader(notWavFilePath)
+
+def writeBlocks(filePath, samples, blockSize, bitsPerSample=16, clipProtectionMode=CLIP_PROTECTION_LIMITER):
+    with WavWriter(filePath, SAMPLE_RATE, samples.shape[0], bitsPerSample, clipProtectionMode) as wavWriter:
+        for startIndex in range(0, samples.shape[-1], blockSize):
+            wavWriter.write(samples[:, startIndex:startIndex + blockSize])
+    return WavReader(filePath).read()
+
+@pytest.mark.parametrize('bitsPerSample', [16, 24, 32])
+def testWavWriterRoundTrip(tmpdir, bitsPerSample):
+    samples = getSamples()
+    readSamples = writeBlocks( join(str(tmpdir), 'test.wav'), samples, 77, bitsPerSample, CLIP_PROTECTION_NONE )
+    assert readSamples.shape == samples.shape
+    np.testing.assert_allclose(readSamples, samples, atol=2.0 ** -(bitsPerSample - 2))
+
+def testWavWriterRescaleMatchesWavwrite(tmpdir):
+    samples = getSamples(amplitude=1.5)
+    readSamples = writeBlocks( join(str(tmpdir), 'test.wav'), samples, 77, clipProtectionMode=CLIP_PROTECTION_RESCALE )
+    wavwrite( samples, join(str(tmpdir), 'reference.wav'), SAMPLE_RATE )
+    np.testing.assert_allclose( readSamples, wavread( join(str(tmpdir), 'reference.wav') )[0], atol=2.0 ** -15 )
+
+def testLimiterKeepsPeaksBelowThresholdAndLeavesQuietSamples(tmpdir):
+    samples = getSamples(numFrames=20000, amplitude=0.3)
+    samples[:, 10000] = [1.8, -1.2, 0.5, 2.5]
+    readSamples = writeBlocks( join(str(tmpdir), 'test.wav'), samples, 1000 )
+    
+    assert readSamples.shape == samples.shape
+    assert np.max( np.abs(readSamples) ) <= CLIP_PROTECTION_MAX_SAMPLE_VALUE + 2.0 ** -15
+    # the gain is only reduced around the peak, within the lookahead
+    farFromPeak = np.r_[:9000, 11000:20000]
+    np.testing.assert_allclose(readSamples[:, farFromPeak], samples[:, farFromPeak], atol=2.0 ** -14)
+
+def testLimiterOutputDoesNotDependOnBlockSize(tmpdir):
+    samples = getSamples(numFrames=20000, amplitude=1.2)
+    referenceSamples = writeBlocks( join(str(tmpdir), 'reference.wav'), samples, samples.shape[-1] )
+    for blockSize in [7, 100, 4096]:
+        np.testing.assert_array_equal( writeBlocks( join(str(tmpdir), 'test.wav'), samples, blockSize ), referenceSamples )
+
+def testWavWriterWithoutClipProtectionRejectsClipping(tmpdir):
+    with pytest.raises(ValueError):
+        writeBlocks( join(str(tmpdir), 'test.wav'), getSamples(amplitude=1.5), 100, clipProtectionMode=CLIP_PROTECTION_NONE )